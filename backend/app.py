@@ -1,24 +1,171 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, has_request_context, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 import os
+import io
+import itertools
 import json
-from datetime import datetime
-import math
-import re
+import base64
+import click
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
 from fuzzywuzzy import fuzz
 import sqlite3
+from sqlalchemy import event, tuple_, bindparam
+from sqlalchemy.exc import OperationalError
+from search_index import ProductSearchIndex
+from spelling import SpellingIndex, product_words
+from geo import StoreGridIndex, cell_circle, location_cell
+from ranking import RankingWeights, score_bound, store_scores, top_stores, without_distances
+from chat_log import ChatLogWriter
+from chat_retention import ChatRetention
+from session_context import SessionContextStore
+from catalog import Catalog, ProductRecord, StoreRecord, keyset_page
+from shared_catalog import SharedCatalogReader
+from response_cache import ResponseCache
+from result_cache import ResultCache
+from intent_router import IntentRouter, TOKEN_RE
+from inventory_feed import (
+    CLEAR_FEED_CHUNK_SQL, CREATE_FEED_CHUNK_SQL, FEED_CHUNK_TABLE, FEED_PARSERS, STAGE_FEED_CHUNK_SQL,
+    UPSERT_INVENTORY_SQL, ingest_feed,
+)
+from sqlite_profile import apply_sqlite_profile, current_pragmas
+from query_plans import check_query_plans
+from availability import DEFERRAL_TABLE, availability_triggers, batch_change, nearby_regions, rebuild_statements
+from datagen import REGIONS, generate_dataset
+from instrumentation import Instrumentation, SamplingProfiler
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///grocery_store.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///grocery_store.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
+# SQLite storage profile; an empty value keeps SQLite's default for that pragma
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT'] = os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')  # milliseconds
+app.config['SQLITE_CACHE_SIZE'] = os.environ.get('SQLITE_CACHE_SIZE', '-65536')  # negative means KiB
+app.config['SQLITE_MMAP_SIZE'] = os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))  # bytes
+
+# Reads use their own pool of query_only connections (0 reads through the writer's pool)
+app.config['SQLITE_READ_POOL_SIZE'] = int(os.environ.get('SQLITE_READ_POOL_SIZE', 8))
+if app.config['SQLITE_READ_POOL_SIZE']:
+    app.config['SQLALCHEMY_BINDS'] = {
+        'read': {
+            'url': app.config['SQLALCHEMY_DATABASE_URI'],
+            'pool_size': app.config['SQLITE_READ_POOL_SIZE'],
+            'max_overflow': 0
+        }
+    }
+
+# Chat history is written behind the response in batches
+app.config['CHAT_LOG_ASYNC'] = os.environ.get('CHAT_LOG_ASYNC', '1') == '1'
+app.config['CHAT_LOG_BATCH_SIZE'] = int(os.environ.get('CHAT_LOG_BATCH_SIZE', 100))
+app.config['CHAT_LOG_FLUSH_INTERVAL'] = float(os.environ.get('CHAT_LOG_FLUSH_INTERVAL', 0.5))  # seconds
+app.config['CHAT_LOG_QUEUE_SIZE'] = int(os.environ.get('CHAT_LOG_QUEUE_SIZE', 10000))
+app.config['CHAT_BATCH_MAX_SIZE'] = int(os.environ.get('CHAT_BATCH_MAX_SIZE', 1000))
+
+# Chat turns older than CHAT_HOT_DAYS move into monthly tables with their bot
+# responses compressed and deduplicated; months older than
+# CHAT_RETENTION_DAYS are dropped
+app.config['CHAT_HOT_DAYS'] = float(os.environ.get('CHAT_HOT_DAYS', 2))
+app.config['CHAT_RETENTION_DAYS'] = float(os.environ.get('CHAT_RETENTION_DAYS', 90))  # 0 keeps history forever
+app.config['CHAT_RETENTION_INTERVAL'] = float(os.environ.get('CHAT_RETENTION_INTERVAL', 3600))  # seconds, 0 disables
+app.config['CHAT_RETENTION_BATCH_SIZE'] = int(os.environ.get('CHAT_RETENTION_BATCH_SIZE', 500))
+app.config['CHAT_RETENTION_PAUSE'] = float(os.environ.get('CHAT_RETENTION_PAUSE', 0.05))  # seconds between batches
+
+# Per-session chat context (recent intents, last search results, last
+# location) for follow-up turns; sessions past the LRU limit are written to
+# SQLite when SESSION_CONTEXT_SPILL is on, and dropped otherwise
+app.config['SESSION_CONTEXT_MAX_SESSIONS'] = int(os.environ.get('SESSION_CONTEXT_MAX_SESSIONS', 10000))  # 0 disables
+app.config['SESSION_CONTEXT_TTL'] = float(os.environ.get('SESSION_CONTEXT_TTL', 1800))  # seconds
+app.config['SESSION_CONTEXT_MAX_BYTES'] = int(os.environ.get('SESSION_CONTEXT_MAX_BYTES', 1024))  # per session
+app.config['SESSION_CONTEXT_SPILL'] = os.environ.get('SESSION_CONTEXT_SPILL', '0') == '1'
+
+# Read endpoints are served from an in-memory catalog snapshot that is also
+# reloaded periodically to pick up changes made outside this process
+app.config['CATALOG_REFRESH_INTERVAL'] = float(os.environ.get('CATALOG_REFRESH_INTERVAL', 300))  # seconds, 0 disables
+# Set by the multi-process server (asgi.py --workers N) for its workers, which
+# then read the catalog from images the supervisor publishes in this directory
+app.config['SHARED_CATALOG_DIR'] = os.environ.get('SHARED_CATALOG_DIR', '')
+
+# Serialized product/store list responses, bounded by total size
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['RESPONSE_CACHE_MIN_COMPRESS_SIZE'] = int(os.environ.get('RESPONSE_CACHE_MIN_COMPRESS_SIZE', 1024))
+
+# Chat product searches and store scans, cached per catalog version (0 entries
+# disables); store scans are shared by users in the same grid cell of this many degrees
+app.config['CHAT_CACHE_MAX_ENTRIES'] = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', 10000))
+app.config['CHAT_CACHE_TTL'] = float(os.environ.get('CHAT_CACHE_TTL', 300))  # seconds
+app.config['CHAT_CACHE_CELL_SIZE'] = float(os.environ.get('CHAT_CACHE_CELL_SIZE', 0.05))
+
+# Chat search keywords are spell-corrected against the product vocabulary (0
+# disables); the dictionary is saved here and reloaded while products are unchanged
+app.config['SPELLING_MAX_DISTANCE'] = int(os.environ.get('SPELLING_MAX_DISTANCE', 2))
+app.config['SPELLING_INDEX_PATH'] = os.environ.get(
+    'SPELLING_INDEX_PATH', os.path.join(app.instance_path, 'spelling_index.json')
+)
+
+# Chat store ranking: score per km, minus bonuses (in km) for stocking
+# RANKING_STOCK_CAP or more of every product and for carrying the most
+# relevant products; the defaults rank by distance alone
+app.config['RANKING_DISTANCE_WEIGHT'] = float(os.environ.get('RANKING_DISTANCE_WEIGHT', 1.0))
+app.config['RANKING_STOCK_WEIGHT'] = float(os.environ.get('RANKING_STOCK_WEIGHT', 0.0))
+app.config['RANKING_TEXT_WEIGHT'] = float(os.environ.get('RANKING_TEXT_WEIGHT', 0.0))
+app.config['RANKING_STOCK_CAP'] = int(os.environ.get('RANKING_STOCK_CAP', 50))
+
+# Keyset pagination and NDJSON streaming of product/inventory lists
+app.config['PAGE_SIZE_MAX'] = int(os.environ.get('PAGE_SIZE_MAX', 1000))
+app.config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 500))  # rows read per pooled connection checkout
+
+# Checkout holds stock for a while before the order is placed
+app.config['RESERVATION_TTL'] = int(os.environ.get('RESERVATION_TTL', 900))  # seconds
+app.config['RESERVATION_MAX_ITEMS'] = int(os.environ.get('RESERVATION_MAX_ITEMS', 100))
+app.config['RESERVATION_LOCK_RETRIES'] = int(os.environ.get('RESERVATION_LOCK_RETRIES', 3))
+
+# POS/warehouse stock feeds are upserted in chunked transactions
+app.config['INVENTORY_FEED_CHUNK_SIZE'] = int(os.environ.get('INVENTORY_FEED_CHUNK_SIZE', 10000))
+app.config['INVENTORY_FEED_MAX_ERRORS'] = int(os.environ.get('INVENTORY_FEED_MAX_ERRORS', 100))
+
+# Materialized availability counts per product and per product x region (a
+# grid cell of this many degrees); "nearby" is the user's cell and its neighbours
+app.config['AVAILABILITY_REGION_SIZE'] = float(os.environ.get('AVAILABILITY_REGION_SIZE', 0.25))
+app.config['AVAILABILITY_MAX_IDS'] = int(os.environ.get('AVAILABILITY_MAX_IDS', 1000))
+
+# ASGI serving mode (asgi.py): threads for CPU-bound chat work, and for the
+# routes that are still served by the Flask app
+app.config['ASGI_CPU_THREADS'] = int(os.environ.get('ASGI_CPU_THREADS', os.cpu_count() or 4))
+app.config['ASGI_WSGI_THREADS'] = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+# Request latency, stage and SQL metrics served at /metrics; requests slower
+# than SLOW_REQUEST_MS are logged, with a folded-stack profile when the
+# sampling profiler is on
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '0') == '1'
+app.config['PROFILER_INTERVAL_MS'] = float(os.environ.get('PROFILER_INTERVAL_MS', 5))
+app.config['PROFILER_DIR'] = os.environ.get('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+
 db = SQLAlchemy(app)
 
+with app.app_context():
+    apply_sqlite_profile(db.engine, app.config)
+    if 'read' in db.engines:
+        apply_sqlite_profile(db.engines['read'], app.config, read_only=True)
+    # journal_mode is switched by the first write connection; open one now so
+    # readers never find the file still in rollback-journal mode
+    if app.config['SQLITE_JOURNAL_MODE'] and db.engine.dialect.name == 'sqlite':
+        db.engine.connect().close()
+
+def get_read_engine():
+    """Engine for read-only queries: the read pool when configured, otherwise the default engine"""
+    return db.engines.get('read', db.engine)
+
 # Database Models
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,6 +175,12 @@ class Product(db.Model):
     description = db.Column(db.Text)
     icon = db.Column(db.String(10))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_product_category', 'category'),
+        db.Index('idx_product_name', 'name'),
+        db.Index('idx_product_price', 'price'),
+    )
 
 class Store(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,10 +198,17 @@ class Inventory(db.Model):
     store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=0)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    # No trigger keeps this current: onupdate covers ORM and Core updates that leave it
+    # out, and raw SQL writers (the feed UPSERT) set it themselves
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     store = db.relationship('Store', backref=db.backref('inventory', lazy=True))
     product = db.relationship('Product', backref=db.backref('inventory', lazy=True))
+    
+    __table_args__ = (
+        db.Index('uq_inventory_store_product', 'store_id', 'product_id', unique=True),
+        db.Index('idx_inventory_product', 'product_id'),
+    )
 
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -56,58 +216,812 @@ class ChatMessage(db.Model):
     user_message = db.Column(db.Text)
     bot_response = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_chat_session', 'session_id', 'timestamp'),
+        db.Index('idx_chat_timestamp', 'timestamp'),
+    )
+
+class ChatResponse(db.Model):
+    """A bot response shared by archived chat turns, zlib-compressed"""
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(40), nullable=False, unique=True)  # SHA-1 of the response JSON
+    body = db.Column(db.LargeBinary, nullable=False)
+    last_seen = db.Column(db.DateTime, nullable=False)  # newest chat turn using it
+    
+    __table_args__ = (
+        db.Index('idx_chat_response_last_seen', 'last_seen'),
+    )
+
+class ChatSessionContext(db.Model):
+    """Chat session contexts evicted from memory while still live"""
+    session_id = db.Column(db.String(100), primary_key=True)
+    context = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)  # Unix time, like the in-memory store
+    
+    __table_args__ = (
+        db.Index('idx_chat_session_context_expiry', 'expires_at'),
+    )
+
+class Reservation(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    session_id = db.Column(db.String(100))
+    status = db.Column(db.String(20), nullable=False, default='held')  # held, ordered, released, expired
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_reservation_status_expiry', 'status', 'expires_at'),
+    )
+
+class ReservationItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.String(32), db.ForeignKey('reservation.id'), nullable=False, index=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+class Order(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.String(32), db.ForeignKey('reservation.id'), nullable=False, unique=True)
+    session_id = db.Column(db.String(100))
+    total = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Maintained by the triggers from availability_triggers(); never written directly
+class ProductAvailability(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    stores_available = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductRegionAvailability(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    region_row = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    region_col = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    stores_available = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+
+# Holds a row only inside a feed chunk's transaction, while the triggers are deferred
+class AvailabilityDeferral(db.Model):
+    __tablename__ = DEFERRAL_TABLE
+    id = db.Column(db.Integer, primary_key=True)
+
+# Views over the models; migrate_schema() (re)creates them
+SCHEMA_VIEWS = {
+    'store_inventory_view': (
+        'SELECT s.id AS store_id, s.name AS store_name, s.address, s.latitude, s.longitude, '
+        's.phone, s.hours, s.services, p.id AS product_id, p.name AS product_name, p.category, '
+        'p.price, p.description, p.icon, i.quantity, i.last_updated '
+        'FROM store s JOIN inventory i ON s.id = i.store_id JOIN product p ON i.product_id = p.id '
+        'WHERE i.quantity > 0'
+    ),
+    'product_availability_view': (
+        'SELECT p.id AS product_id, p.name AS product_name, p.category, p.price, p.description, p.icon, '
+        'COUNT(i.store_id) AS stores_available, SUM(i.quantity) AS total_quantity, '
+        'AVG(i.quantity) AS avg_quantity_per_store '
+        'FROM product p LEFT JOIN inventory i ON p.id = i.product_id AND i.quantity > 0 '
+        'GROUP BY p.id, p.name, p.category, p.price, p.description, p.icon'
+    ),
+}
+
+# Indexes and triggers from older databases or schema.sql that the models replace:
+# the unique (store_id, product_id) index covers store_id lookups, nothing filters
+# on quantity alone, nearby-store queries use the in-memory StoreGridIndex rather
+# than a (latitude, longitude) range scan, and writes set last_updated themselves
+OBSOLETE_INDEXES = ('idx_inventory_store_product', 'idx_inventory_store', 'idx_inventory_quantity', 'idx_store_location')
+OBSOLETE_TRIGGERS = ('update_inventory_timestamp',)
+
+# Catalog snapshot shared by all read endpoints
+def load_catalog(parts):
+    """Load the requested catalog parts from the database as immutable tuples"""
+    loaded = {}
+    with app.app_context(), get_read_engine().connect() as connection:
+        if 'products' in parts:
+            rows = connection.execute(db.select(
+                Product.id, Product.name, Product.category, Product.price, Product.description, Product.icon
+            ).order_by(Product.id)).all()
+            loaded['products'] = tuple(ProductRecord(*row) for row in rows)
+        
+        if 'stores' in parts:
+            rows = connection.execute(db.select(
+                Store.id, Store.name, Store.address, Store.latitude, Store.longitude,
+                Store.phone, Store.hours, Store.services
+            ).order_by(Store.id)).all()
+            loaded['stores'] = tuple(
+                StoreRecord(*row[:7], tuple(json.loads(row[7])) if row[7] else ())
+                for row in rows
+            )
+        
+        if 'inventory' in parts:
+            rows = connection.execute(db.select(
+                Inventory.store_id, Inventory.product_id, Inventory.quantity
+            ).order_by(Inventory.store_id, Inventory.id)).all()
+            loaded['inventory'] = tuple(tuple(row) for row in rows)
+    return loaded
+
+def store_inventory_query(store_ids):
+    """Inventory rows of some stores, in the same order load_catalog uses"""
+    return db.select(
+        Inventory.store_id, Inventory.product_id, Inventory.quantity
+    ).where(Inventory.store_id.in_(sorted(store_ids))).order_by(Inventory.store_id, Inventory.id)
+
+def load_store_inventory(store_ids):
+    """Load the inventory rows of some stores"""
+    with app.app_context(), get_read_engine().connect() as connection:
+        rows = connection.execute(store_inventory_query(store_ids)).all()
+        return [tuple(row) for row in rows]
+
+if app.config['SHARED_CATALOG_DIR']:
+    # Inventory lookups and search postings are read in place from the
+    # supervisor's image; products, stores and the store grid stay per process
+    catalog = SharedCatalogReader(app.config['SHARED_CATALOG_DIR'])
+    search_index = catalog.search_index
+else:
+    catalog = Catalog(
+        load_catalog,
+        refresh_interval=app.config['CATALOG_REFRESH_INTERVAL'],
+        store_loader=load_store_inventory
+    )
+    # Product search index, kept in step with the catalog
+    search_index = ProductSearchIndex()
+
+# Store grid, kept in step with the catalog
+store_locator = StoreGridIndex()
+
+def sync_search_index(old, new):
+    """Patch the search index with the products that changed between snapshots"""
+    if old is None or not search_index.built:
+        search_index.build(new.products)
+    elif new.products is not old.products:
+        for product in new.products:
+            if old.products_by_id.get(product.id) != product:
+                search_index.upsert(product.id, product.name, product.category, product.description)
+        for product_id in old.products_by_id.keys() - new.products_by_id.keys():
+            search_index.remove(product_id)
+
+def sync_store_locator(old, new):
+    """Patch the store grid with the stores that moved between snapshots"""
+    if old is None or not store_locator.built:
+        store_locator.build((s.id, s.latitude, s.longitude) for s in new.stores)
+    elif new.stores is not old.stores:
+        for store in new.stores:
+            previous = old.stores_by_id.get(store.id)
+            if previous is None or (previous.latitude, previous.longitude) != (store.latitude, store.longitude):
+                store_locator.upsert(store.id, store.latitude, store.longitude)
+        for store_id in old.stores_by_id.keys() - new.stores_by_id.keys():
+            store_locator.remove(store_id)
+
+# Spelling dictionary over product words, kept in step with the catalog
+spelling_index = SpellingIndex(max_distance=app.config['SPELLING_MAX_DISTANCE'])
+
+def sync_spelling_index(old, new):
+    """Load or build the spelling dictionary, then apply the word changes of edited products"""
+    if old is None or not spelling_index.built:
+        spelling_index.load_or_build(app.config['SPELLING_INDEX_PATH'], new.products)
+    elif new.products is not old.products:
+        changed = [p for p in new.products if old.products_by_id.get(p.id) != p]
+        previous = [old.products_by_id[p.id] for p in changed if p.id in old.products_by_id]
+        previous += [p for p in old.products if p.id not in new.products_by_id]
+        spelling_index.update(product_words(changed), product_words(previous))
+
+if not app.config['SHARED_CATALOG_DIR']:
+    catalog.add_listener(sync_search_index)
+catalog.add_listener(sync_store_locator)
+if app.config['SPELLING_MAX_DISTANCE']:
+    catalog.add_listener(sync_spelling_index)
+
+def get_catalog():
+    """Return the current catalog snapshot, pinned for the rest of the request"""
+    if not has_request_context():
+        return catalog.snapshot()
+    if 'catalog' not in g:
+        g.catalog = catalog.snapshot()
+    return g.catalog
+
+# Cached JSON bodies for the list endpoints, keyed by catalog version
+response_cache = ResponseCache(
+    max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'],
+    min_compress_size=app.config['RESPONSE_CACHE_MIN_COMPRESS_SIZE']
+)
+
+def clear_response_cache(old, new):
+    """Drop cached list bodies once the products or stores they were built from change"""
+    if old is None or new.products is not old.products or new.stores is not old.stores:
+        response_cache.clear()
+
+catalog.add_listener(clear_response_cache)
+
+# Chat search results, keyed by the catalog part versions they were computed from
+chat_cache = ResultCache(
+    max_entries=app.config['CHAT_CACHE_MAX_ENTRIES'],
+    ttl=app.config['CHAT_CACHE_TTL']
+)
+
+def catalog_version(part=None):
+    """Version of the catalog snapshot serving this request, or of one of its parts"""
+    snapshot = get_catalog()
+    return snapshot.version if part is None else snapshot.versions[part]
+
+def invalidate_catalog(parts=('products', 'stores', 'inventory')):
+    """Explicit invalidation hook for writes that bypass the ORM session"""
+    catalog.invalidate(parts)
+
+def invalidate_inventory(store_ids):
+    """Explicit invalidation hook for inventory writes to a known set of stores"""
+    if store_ids:
+        catalog.invalidate_stores(store_ids)
+
+CATALOG_MODELS = {Product: 'products', Store: 'stores', Inventory: 'inventory'}
+
+@event.listens_for(db.session, 'after_flush')
+def track_catalog_changes(session, flush_context):
+    """Remember which catalog parts a transaction touched"""
+    parts = session.info.setdefault('catalog_changes', set())
+    for obj in session.new | session.dirty | session.deleted:
+        part = CATALOG_MODELS.get(type(obj))
+        if part:
+            parts.add(part)
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_catalog_changes(session):
+    """Invalidate the catalog parts touched by a committed transaction"""
+    parts = session.info.pop('catalog_changes', None)
+    if parts:
+        catalog.invalidate(parts)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_catalog_changes(session, previous_transaction):
+    """Forget catalog changes that were rolled back"""
+    session.info.pop('catalog_changes', None)
+
+# Chat history persistence
+def write_chat_messages(rows):
+    """Insert a batch of chat records in a single transaction"""
+    with app.app_context():
+        db.session.execute(ChatMessage.__table__.insert(), rows)
+        db.session.commit()
+
+chat_log = ChatLogWriter(
+    write_chat_messages,
+    batch_size=app.config['CHAT_LOG_BATCH_SIZE'],
+    flush_interval=app.config['CHAT_LOG_FLUSH_INTERVAL'],
+    max_queue=app.config['CHAT_LOG_QUEUE_SIZE']
+)
+
+with app.app_context():
+    chat_retention = ChatRetention(
+        db.engine,
+        ChatMessage.__table__,
+        ChatResponse.__table__,
+        retention_days=app.config['CHAT_RETENTION_DAYS'],
+        hot_days=app.config['CHAT_HOT_DAYS'],
+        batch_size=app.config['CHAT_RETENTION_BATCH_SIZE'],
+        interval=app.config['CHAT_RETENTION_INTERVAL'],
+        pause=app.config['CHAT_RETENTION_PAUSE']
+    )
+
+@app.before_request
+def start_chat_retention():
+    """Start the retention thread with the first request this process serves"""
+    chat_retention.start()
+
+# Chat session contexts
+def write_session_contexts(rows):
+    """Store a batch of spilled session contexts and drop the expired ones"""
+    table = ChatSessionContext.__table__
+    with app.app_context():
+        db.session.execute(table.insert().prefix_with('OR REPLACE'), rows)
+        db.session.execute(table.delete().where(table.c.expires_at <= time.time()))
+        db.session.commit()
+    for row in rows:
+        session_contexts.spilled(row['session_id'], row['context'].encode('utf-8'))
+
+def load_session_context(session_id):
+    """A spilled session context as (encoded context, expires_at), or None"""
+    table = ChatSessionContext.__table__
+    with app.app_context(), get_read_engine().connect() as connection:
+        row = connection.execute(
+            db.select(table.c.context, table.c.expires_at).where(table.c.session_id == session_id)
+        ).first()
+    return (row.context.encode('utf-8'), row.expires_at) if row is not None else None
+
+# Evicted contexts are written behind the request, like chat history
+session_spill = ChatLogWriter(
+    write_session_contexts,
+    batch_size=app.config['CHAT_LOG_BATCH_SIZE'],
+    flush_interval=app.config['CHAT_LOG_FLUSH_INTERVAL'],
+    max_queue=app.config['CHAT_LOG_QUEUE_SIZE']
+) if app.config['SESSION_CONTEXT_SPILL'] else None
+
+session_contexts = SessionContextStore(
+    max_sessions=app.config['SESSION_CONTEXT_MAX_SESSIONS'],
+    ttl=app.config['SESSION_CONTEXT_TTL'],
+    max_entry_bytes=app.config['SESSION_CONTEXT_MAX_BYTES'],
+    spill=(lambda session_id, data, expires_at: session_spill.record(
+        {'session_id': session_id, 'context': data.decode('utf-8'), 'expires_at': expires_at}
+    )) if session_spill is not None else None,
+    load=load_session_context if session_spill is not None else None
+)
+
+# Per-request stage timers, SQL counters and latency histograms
+instrumentation = Instrumentation(
+    enabled=app.config['METRICS_ENABLED'],
+    slow_request_ms=app.config['SLOW_REQUEST_MS'],
+    profiler=SamplingProfiler(
+        app.config['PROFILER_DIR'], interval=app.config['PROFILER_INTERVAL_MS'] / 1000
+    ) if app.config['PROFILER_ENABLED'] and app.config['METRICS_ENABLED'] else None
+)
+instrumentation.install_sql_hooks()
+
+def catalog_gauges():
+    """Size and version of the current catalog snapshot"""
+    snapshot = catalog.snapshot()
+    return {
+        'version': snapshot.version,
+        'products': len(snapshot.products),
+        'stores': len(snapshot.stores),
+        'inventory_rows': len(snapshot.inventory)
+    }
+
+instrumentation.add_gauges('freshmart_catalog', 'Catalog snapshot', catalog_gauges)
+instrumentation.add_gauges('freshmart_chat_log', 'Chat log writer', chat_log.stats)
+instrumentation.add_gauges('freshmart_response_cache', 'Response cache', response_cache.stats)
+instrumentation.add_gauges('freshmart_chat_cache', 'Chat search cache', chat_cache.stats)
+instrumentation.add_gauges('freshmart_chat_retention', 'Chat history retention', chat_retention.stats)
+instrumentation.add_gauges('freshmart_session_context', 'Chat session contexts', session_contexts.stats)
+instrumentation.add_gauges('freshmart_search_index', 'Product search index', search_index.stats)
+
+@app.before_request
+def begin_request_trace():
+    """Start timing the request's stages and SQL statements"""
+    g.request_trace = instrumentation.begin_request()
+
+@app.after_request
+def end_request_trace(response):
+    """Record the request in the latency histograms, by route rule rather than raw path"""
+    token = g.pop('request_trace', None)
+    if token is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        instrumentation.end_request(token, request.method, route, response.status_code)
+    return response
+
+@app.teardown_request
+def discard_request_trace(exc):
+    """Close the trace of a request that failed before after_request ran"""
+    token = g.pop('request_trace', None)
+    if token is not None:
+        instrumentation.end_request(token, request.method, 'unhandled', 500)
+
+def make_chat_row(session_id, user_message, response):
+    """Build the chat_message row for one chat turn"""
+    return {
+        'session_id': session_id,
+        'user_message': user_message,
+        'bot_response': json.dumps(response),
+        'timestamp': datetime.utcnow()
+    }
+
+@instrumentation.timed('chat_log')
+def save_chat_message(session_id, user_message, response):
+    """Persist one chat turn, behind the response unless CHAT_LOG_ASYNC is off"""
+    row = make_chat_row(session_id, user_message, response)
+    if app.config['CHAT_LOG_ASYNC']:
+        chat_log.record(row)
+    else:
+        write_chat_messages([row])
 
 # Utility Functions
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    R = 6371  # Earth's radius in kilometers
+def serialize_product(product):
+    """Build the public dict for a catalog product"""
+    return product._asdict()
+
+def serialize_store(store, distance=None):
+    """Build the public dict for a catalog store, with distance when known"""
+    store_data = {
+        'id': store.id,
+        'name': store.name,
+        'address': store.address,
+        'latitude': store.latitude,
+        'longitude': store.longitude,
+        'phone': store.phone,
+        'hours': store.hours,
+        'services': list(store.services)
+    }
+    if distance is not None:
+        store_data['distance'] = round(distance, 1)
+    return store_data
+
+def serialize_inventory_item(product, quantity):
+    """Build the public dict for one product in a store's inventory"""
+    return {
+        'product_id': product.id,
+        'product_name': product.name,
+        'category': product.category,
+        'price': product.price,
+        'quantity': quantity,
+        'icon': product.icon
+    }
+
+# Keyset sort orders for /api/products; each ends with the id so keys are
+# unique, and each is backed by an index for the streaming queries
+PRODUCT_SORT_COLUMNS = {
+    'id': (Product.id,),
+    'name': (Product.name, Product.id),
+    'price': (Product.price, Product.id),
+}
+
+def encode_cursor(key):
+    """Opaque `after` token for a keyset sort key"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(token, columns):
+    """Sort key tuple from an `after` token, checked against the sort columns"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid after cursor')
     
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+    if not isinstance(key, list) or len(key) != len(columns):
+        raise ValueError('Invalid after cursor')
+    for value, column in zip(key, columns):
+        expected = column.type.python_type
+        if isinstance(value, bool) or not (isinstance(value, expected) or (expected is float and isinstance(value, int))):
+            raise ValueError('Invalid after cursor')
+    return tuple(key)
+
+def parse_limit():
+    """Read the limit query argument (None when absent); raises ValueError unless it is a positive integer"""
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    return limit
+
+def parse_page_args(columns):
+    """Read the limit and after query arguments; raises ValueError when malformed"""
+    limit = parse_limit()
+    
+    after = request.args.get('after')
+    if after is not None:
+        after = decode_cursor(after, columns)
+    return limit, after
+
+def wants_stream():
+    """True when the client opted into an NDJSON stream"""
+    return (
+        request.args.get('stream', '').lower() in ('1', 'true')
+        or request.accept_mimetypes.best == 'application/x-ndjson'
+    )
+
+def paged_response(keys, items, after, limit, serialize):
+    """One keyset page as {'items': [...], 'next': cursor or None}"""
+    page_size = min(limit or app.config['PAGE_SIZE_MAX'], app.config['PAGE_SIZE_MAX'])
+    page, last_key = keyset_page(keys, items, after, page_size)
+    return jsonify({
+        'items': [serialize(item) for item in page],
+        'next': encode_cursor(last_key) if last_key is not None else None
+    })
+
+# Inventory reservations. Stock is taken and returned with conditional
+# UPDATEs so concurrent checkouts can never drive a quantity below zero.
+class OutOfStockError(Exception):
+    """A reservation line could not be covered by the store's stock"""
     
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+    def __init__(self, store_id, product_id, quantity):
+        super().__init__(f'Insufficient stock for product {product_id} at store {store_id}')
+        self.store_id = store_id
+        self.product_id = product_id
+        self.quantity = quantity
+
+class ReservationError(Exception):
+    """The reservation is unknown, expired or no longer held"""
+
+inventory_table = Inventory.__table__
+reservation_table = Reservation.__table__
+reservation_item_table = ReservationItem.__table__
+
+# The first inventory row per (store, product) is the one the catalog reads
+first_inventory_row = db.select(inventory_table.c.id).where(
+    inventory_table.c.store_id == bindparam('line_store_id'),
+    inventory_table.c.product_id == bindparam('line_product_id')
+).order_by(inventory_table.c.id).limit(1).scalar_subquery()
+
+TAKE_STOCK = inventory_table.update().where(
+    inventory_table.c.id == first_inventory_row,
+    inventory_table.c.quantity >= bindparam('line_quantity')
+).values(
+    quantity=inventory_table.c.quantity - bindparam('line_quantity'),
+    last_updated=bindparam('now')
+)
+
+RETURN_STOCK = inventory_table.update().where(
+    inventory_table.c.id == first_inventory_row
+).values(
+    quantity=inventory_table.c.quantity + bindparam('line_quantity'),
+    last_updated=bindparam('now')
+)
+
+# Moving a reservation out of 'held' is how one caller claims it
+CLAIM_RESERVATION = reservation_table.update().where(
+    reservation_table.c.id == bindparam('claim_id'),
+    reservation_table.c.status == 'held'
+).values(status=bindparam('new_status'))
+
+ORDER_RESERVATION = reservation_table.update().where(
+    reservation_table.c.id == bindparam('claim_id'),
+    reservation_table.c.status == 'held',
+    reservation_table.c.expires_at > bindparam('now')
+).values(status='ordered')
+
+RESERVATION_LINES = db.select(
+    reservation_item_table.c.store_id, reservation_item_table.c.product_id, reservation_item_table.c.quantity
+).where(reservation_item_table.c.reservation_id == bindparam('claim_id'))
+
+ORDER_LINES = db.select(
+    reservation_item_table.c.store_id, reservation_item_table.c.product_id,
+    reservation_item_table.c.quantity, Product.price
+).join(Product, Product.id == reservation_item_table.c.product_id).where(
+    reservation_item_table.c.reservation_id == bindparam('claim_id')
+)
+
+EXPIRED_RESERVATIONS = db.select(reservation_table.c.id).where(
+    reservation_table.c.status == 'held',
+    reservation_table.c.expires_at <= bindparam('now')
+)
+
+def parse_reservation_items(items):
+    """Validate reservation lines and merge repeats into sorted (store_id, product_id, quantity) tuples"""
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    if len(items) > app.config['RESERVATION_MAX_ITEMS']:
+        raise ValueError(f"At most {app.config['RESERVATION_MAX_ITEMS']} items per reservation")
     
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    merged = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each item must be an object')
+        values = [item.get('store_id'), item.get('product_id'), item.get('quantity', 1)]
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            raise ValueError('store_id, product_id and quantity must be integers')
+        if values[2] < 1:
+            raise ValueError('quantity must be positive')
+        key = (values[0], values[1])
+        merged[key] = merged.get(key, 0) + values[2]
     
-    return R * c
+    # A fixed lock order keeps concurrent multi-line checkouts from deadlocking
+    return [(store_id, product_id, quantity) for (store_id, product_id), quantity in sorted(merged.items())]
 
-def fuzzy_search_products(query, threshold=60):
-    """Search products using fuzzy matching"""
-    products = Product.query.all()
-    matches = []
-    
-    for product in products:
-        # Check name match
-        name_score = fuzz.partial_ratio(query.lower(), product.name.lower())
-        # Check category match
-        category_score = fuzz.partial_ratio(query.lower(), product.category.lower())
-        # Check description match
-        desc_score = fuzz.partial_ratio(query.lower(), product.description.lower()) if product.description else 0
-        
-        max_score = max(name_score, category_score, desc_score)
-        
-        if max_score >= threshold:
-            matches.append({
-                'product': product,
-                'score': max_score
+def run_inventory_transaction(work):
+    """Run work() and commit, retrying when SQLite reports the database as locked"""
+    retries = app.config['RESERVATION_LOCK_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e) or attempt == retries:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+        except Exception:
+            db.session.rollback()
+            raise
+
+def reserve_inventory(items, session_id=None, ttl=None):
+    """Take stock for every line in one transaction and hold it until the reservation expires"""
+    lines = parse_reservation_items(items)
+    release_expired_reservations()
+    
+    ttl = app.config['RESERVATION_TTL'] if ttl is None else ttl
+    reservation_id = uuid.uuid4().hex
+    
+    def work():
+        now = datetime.utcnow()
+        for store_id, product_id, quantity in lines:
+            result = db.session.execute(TAKE_STOCK, {
+                'line_store_id': store_id, 'line_product_id': product_id, 'line_quantity': quantity, 'now': now
             })
+            if result.rowcount != 1:
+                # Rolls back the lines already taken
+                raise OutOfStockError(store_id, product_id, quantity)
+        
+        expires_at = now + timedelta(seconds=ttl)
+        db.session.execute(reservation_table.insert(), {
+            'id': reservation_id, 'session_id': session_id, 'status': 'held',
+            'expires_at': expires_at, 'created_at': now
+        })
+        db.session.execute(reservation_item_table.insert(), [
+            {'reservation_id': reservation_id, 'store_id': s, 'product_id': p, 'quantity': q}
+            for s, p, q in lines
+        ])
+        return expires_at
+    
+    expires_at = run_inventory_transaction(work)
+    invalidate_inventory({store_id for store_id, _, _ in lines})
     
-    # Sort by score (highest first)
-    matches.sort(key=lambda x: x['score'], reverse=True)
-    return [match['product'] for match in matches]
+    return {
+        'reservation_id': reservation_id,
+        'status': 'held',
+        'expires_at': expires_at.isoformat(),
+        'items': [{'store_id': s, 'product_id': p, 'quantity': q} for s, p, q in lines]
+    }
 
-def extract_product_keywords(message):
-    """Extract potential product names from user message"""
-    # Common product-related keywords to filter out
-    stop_words = {'find', 'search', 'looking', 'for', 'need', 'want', 'buy', 'get', 'have', 'where', 'can', 'i', 'the', 'a', 'an', 'some', 'any'}
+def release_reservation(reservation_id, status='released'):
+    """Return a held reservation's stock; False when it was not held any more"""
+    def work():
+        # Claiming the reservation first means only one caller returns its stock
+        claimed = db.session.execute(CLAIM_RESERVATION, {'claim_id': reservation_id, 'new_status': status})
+        if claimed.rowcount != 1:
+            return None
+        
+        lines = db.session.execute(RESERVATION_LINES, {'claim_id': reservation_id}).all()
+        now = datetime.utcnow()
+        db.session.execute(RETURN_STOCK, [
+            {'line_store_id': s, 'line_product_id': p, 'line_quantity': q, 'now': now} for s, p, q in lines
+        ])
+        return {store_id for store_id, _, _ in lines}
+    
+    stores = run_inventory_transaction(work)
+    if stores is None:
+        return False
+    invalidate_inventory(stores)
+    return True
+
+_sweep_lock = threading.Lock()
+_next_sweep = 0.0
+
+def release_expired_reservations(force=False):
+    """Return the stock of held reservations past their TTL, at most once a second unless forced"""
+    global _next_sweep
+    if not force:
+        if time.monotonic() < _next_sweep or not _sweep_lock.acquire(blocking=False):
+            return 0
+    else:
+        _sweep_lock.acquire()
+    try:
+        _next_sweep = time.monotonic() + 1.0
+        expired = db.session.execute(EXPIRED_RESERVATIONS, {'now': datetime.utcnow()}).scalars().all()
+        db.session.commit()
+        return sum(1 for reservation_id in expired if release_reservation(reservation_id, 'expired'))
+    finally:
+        _sweep_lock.release()
+
+def place_order(reservation_id, session_id=None):
+    """Turn a held, unexpired reservation into an order"""
+    def work():
+        now = datetime.utcnow()
+        claimed = db.session.execute(ORDER_RESERVATION, {'claim_id': reservation_id, 'now': now})
+        if claimed.rowcount != 1:
+            raise ReservationError('Reservation not found, expired or already used')
+        
+        lines = db.session.execute(ORDER_LINES, {'claim_id': reservation_id}).all()
+        total = round(sum(quantity * price for _, _, quantity, price in lines), 2)
+        order_id = db.session.execute(Order.__table__.insert(), {
+            'reservation_id': reservation_id, 'session_id': session_id, 'total': total, 'created_at': now
+        }).inserted_primary_key[0]
+        return {
+            'order_id': order_id,
+            'reservation_id': reservation_id,
+            'total': total,
+            'items': [{'store_id': s, 'product_id': p, 'quantity': q, 'price': price} for s, p, q, price in lines]
+        }
+    
+    return run_inventory_transaction(work)
+
+# Bulk inventory feeds
+def write_inventory_chunk(rows):
+    """
+    Upsert one chunk of (store_id, product_id, quantity) rows in a single
+    transaction. The per-row availability triggers are deferred meanwhile
+    and the chunk's net change is applied once per product and region.
+    """
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql(CREATE_FEED_CHUNK_SQL)
+        connection.exec_driver_sql(STAGE_FEED_CHUNK_SQL, rows)
+        connection.exec_driver_sql(f'INSERT INTO {DEFERRAL_TABLE} (id) VALUES (1)')
+        connection.exec_driver_sql(UPSERT_INVENTORY_SQL)
+        connection.exec_driver_sql(f'DELETE FROM {DEFERRAL_TABLE}')
+        for statement in batch_change(FEED_CHUNK_TABLE, app.config['AVAILABILITY_REGION_SIZE']):
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(CLEAR_FEED_CHUNK_SQL)
+
+def import_inventory_feed(lines, feed_format):
+    """Apply a stock feed and invalidate the catalog inventory of the stores it touched"""
+    snapshot = get_catalog()
+    try:
+        result = ingest_feed(
+            lines, feed_format, write_inventory_chunk,
+            chunk_size=app.config['INVENTORY_FEED_CHUNK_SIZE'],
+            known_stores=snapshot.stores_by_id,
+            known_products=snapshot.products_by_id,
+            max_errors=app.config['INVENTORY_FEED_MAX_ERRORS']
+        )
+    except Exception as e:
+        # Chunks committed before the failure are live
+        invalidate_inventory(getattr(e, 'result', {}).get('stores'))
+        raise
+    invalidate_inventory(result['stores'])
+    
+    elapsed = result['elapsed']
+    result['stores'] = len(result['stores'])
+    result['elapsed'] = round(elapsed, 3)
+    result['rows_per_sec'] = round(result['rows'] / elapsed) if elapsed else None
+    return result
+
+def detect_feed_format(filename, mimetype):
+    """Feed format from a file extension or content type, or None"""
+    if filename and '.' in filename:
+        extension = filename.rsplit('.', 1)[1].lower()
+        if extension == 'csv':
+            return 'csv'
+        if extension in ('ndjson', 'jsonl'):
+            return 'ndjson'
+    if mimetype == 'text/csv':
+        return 'csv'
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'ndjson'
+    return None
+
+def get_batch_memo():
+    """Results memo shared by the items of one chat batch, or None outside a batch"""
+    if has_request_context():
+        return g.get('batch_memo')
+    return None
+
+def fuzzy_search_products(query, threshold=60, snapshot=None):
+    """Search products using fuzzy matching"""
+    return [product for product, _ in rank_products(query, threshold, snapshot=snapshot)]
+
+@instrumentation.timed('fuzzy_search')
+def rank_products(query, threshold=60, limit=None, snapshot=None, category=None):
+    """(product, score) pairs for a search, best first; with a limit only the top ones are scored into a heap"""
+    snapshot = snapshot or get_catalog()
+    
+    memo = get_batch_memo()
+    memo_key = ('products', query, threshold, limit, category, snapshot.version)
+    if memo is not None and memo_key in memo:
+        return memo[memo_key]
     
-    # Split message into words and filter
-    words = re.findall(r'\b\w+\b', message.lower())
-    keywords = [word for word in words if word not in stop_words and len(word) > 2]
+    # Ids the snapshot doesn't know yet are skipped before they take a slot
+    products_by_id = snapshot.products_by_id
+    if category:
+        accept = lambda product_id: product_id in products_by_id and products_by_id[product_id].category == category
+    else:
+        accept = products_by_id.__contains__
+    
+    # Identical searches share one scoring pass per products version
+    scored = chat_cache.get_or_compute(
+        ('products', query, threshold, limit, category, snapshot.versions['products']),
+        lambda: search_index.search_scored(query, threshold, limit, accept)
+    )
+    products = [(products_by_id[pid], score) for pid, score in scored if pid in products_by_id]
+    
+    if memo is not None:
+        memo[memo_key] = products
+    return products
+
+# Common product-related keywords to filter out of searches
+STOP_WORDS = frozenset(['find', 'search', 'looking', 'for', 'need', 'want', 'buy', 'get', 'have', 'where', 'can', 'i', 'the', 'a', 'an', 'some', 'any'])
+
+# A follow-up ("where can I buy that?", "which store has them") points back
+# at the last search with one of REFERENCE_WORDS; any other keyword it has
+# must be one of FOLLOW_UP_WORDS
+REFERENCE_WORDS = frozenset(['that', 'this', 'it', 'them', 'those', 'these', 'they', 'ones'])
+FOLLOW_UP_WORDS = REFERENCE_WORDS | frozenset([
+    'which', 'store', 'stores', 'shop', 'shops', 'sell', 'sells', 'has', 'carry', 'carries', 'stock',
+    'nearby', 'near', 'nearest', 'closest', 'there', 'you', 'does', 'please', 'again', 'show', 'from'
+])
+
+def extract_product_keywords(message, tokens=None):
+    """Extract potential product names from user message"""
+    # Split message into words (unless the router already did) and filter
+    words = tokens if tokens is not None else TOKEN_RE.findall(message.lower())
+    keywords = [word for word in words if word not in STOP_WORDS and len(word) > 2]
     
     return keywords
 
@@ -127,43 +1041,180 @@ def chat():
         response = process_chat_message(user_message, user_location, session_id)
         
         # Save chat history
-        chat_record = ChatMessage(
-            session_id=session_id,
-            user_message=user_message,
-            bot_response=json.dumps(response)
-        )
-        db.session.add(chat_record)
-        db.session.commit()
+        save_chat_message(session_id, user_message, response)
         
-        return jsonify(response)
+        with instrumentation.stage('json_encode'):
+            return jsonify(response)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Process many chat messages in one request, e.g. log replays or FAQ ingestion"""
+    try:
+        data = request.get_json()
+        items = data.get('messages')
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'messages must be a non-empty list'}), 400
+        if len(items) > app.config['CHAT_BATCH_MAX_SIZE']:
+            return jsonify({'error': f"At most {app.config['CHAT_BATCH_MAX_SIZE']} messages per batch"}), 400
+        
+        stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
+        
+        # Every item reads the same catalog snapshot, and identical product
+        # and store searches are computed once per batch
+        get_catalog()
+        g.batch_memo = {}
+        
+        if stream:
+            return Response(
+                stream_with_context(stream_chat_batch(items)),
+                mimetype='application/x-ndjson'
+            )
+        
+        rows = []
+        try:
+            responses = [answer_batch_item(item, rows) for item in items]
+        finally:
+            if rows:
+                write_chat_messages(rows)
+        
+        return jsonify({'responses': responses})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def process_batch_item(item, rows):
+    """Answer one chat batch item, appending its chat record to rows"""
+    if not isinstance(item, dict):
+        return {'error': 'Each message must be an object'}
+    
+    user_message = (item.get('message') or '').strip()
+    if not user_message:
+        return {'error': 'Message is required'}
+    
+    user_location = item.get('location')
+    session_id = item.get('session_id', 'default')
+    
+    response = process_chat_message(user_message, user_location, session_id)
+    rows.append(make_chat_row(session_id, user_message, response))
+    return response
+
+def answer_batch_item(item, rows):
+    """process_batch_item, with a failing item answered by its error instead of failing the batch"""
+    try:
+        return process_batch_item(item, rows)
+    except Exception as e:
+        return {'error': str(e)}
+
+def stream_chat_batch(items):
+    """Yield one NDJSON line per batch item, then store all chat records together"""
+    rows = []
+    try:
+        for index, item in enumerate(items):
+            yield json.dumps({'index': index, 'response': answer_batch_item(item, rows)}) + '\n'
+    finally:
+        if rows:
+            write_chat_messages(rows)
+
+# Chat intents, matched anywhere in the lowercased message; when several
+# match, the highest priority wins (on equal priorities, the intent registered
+# first) and unmatched messages get the default
+# handler(parsed, user_location, found), which may record what it resolved in found
+intent_router = IntentRouter(
+    default_handler=lambda parsed, user_location, found: handle_default_response(parsed.text)
+)
+
+# Product search queries
+intent_router.register(
+    'product_search', ['find', 'search', 'looking for', 'need', 'want'],
+    lambda parsed, user_location, found: handle_product_search(parsed.text, user_location, parsed.tokens, found),
+    priority=30
+)
+
+# Store location queries
+intent_router.register(
+    'store_locations', ['store', 'shop', 'location', 'nearby', 'near me', 'directions'],
+    lambda parsed, user_location, found: handle_store_query(parsed.text, user_location),
+    priority=20
+)
+
+# Help queries
+intent_router.register(
+    'help', ['help', 'what can you do', 'how', 'assist'],
+    lambda parsed, user_location, found: handle_help_query(),
+    priority=10
+)
+
 def process_chat_message(message, user_location, session_id):
     """Process user message and return appropriate response"""
-    message_lower = message.lower()
+    # Clients without a session id all share 'default', so it keeps no context
+    session_key = session_id if session_id != 'default' else None
+    context = session_contexts.get(session_key)
+    if context is not None and not user_location:
+        user_location = context.location
     
-    # Product search queries
-    if any(keyword in message_lower for keyword in ['find', 'search', 'looking for', 'need', 'want']):
-        return handle_product_search(message, user_location)
+    with instrumentation.stage('intent_routing'):
+        intent, parsed = intent_router.match(message)
+        follow_up = context is not None and context.products and is_follow_up(parsed.tokens)
+    
+    response = handle_follow_up(context.products, user_location) if follow_up else None
+    found = {}
+    if response is not None:
+        name = 'follow_up'
+    else:
+        name = intent.name if intent is not None else 'default'
+        handler = intent.handler if intent is not None else intent_router.default_handler
+        response = handler(parsed, user_location, found)
     
-    # Store location queries
-    elif any(keyword in message_lower for keyword in ['store', 'shop', 'location', 'nearby', 'near me', 'directions']):
-        return handle_store_query(message, user_location)
+    location = user_location if isinstance(user_location, dict) and 'lat' in user_location and 'lng' in user_location else None
+    session_contexts.update(session_key, name, found.get('products'), location)
+    return response
+
+def is_follow_up(tokens):
+    """Whether a message refers back to the last search and names no product of its own"""
+    return any(token in REFERENCE_WORDS for token in tokens) and all(
+        keyword in FOLLOW_UP_WORDS for keyword in extract_product_keywords(None, tokens)
+    )
+
+def handle_follow_up(products, user_location):
+    """
+    Answer a follow-up such as "where can I buy that?" from the products the
+    session's last search found, without searching again; None if none of
+    them is in the catalog any more
+    """
+    snapshot = get_catalog()
+    found = [
+        (snapshot.products_by_id[product_id], score)
+        for product_id, score in products
+        if product_id in snapshot.products_by_id
+    ]
+    if not found:
+        return None
     
-    # Help queries
-    elif any(keyword in message_lower for keyword in ['help', 'what can you do', 'how', 'assist']):
-        return handle_help_query()
+    stores_with_products = find_stores_with_products(
+        [product.id for product, _ in found], user_location, limit=3, snapshot=snapshot,
+        relevance={product.id: score for product, score in found}
+    )
     
-    # Default response
-    else:
-        return handle_default_response(message)
+    return {
+        'type': 'product_search',
+        'message': f"Here's where to find the {len(found)} product(s) from your last search:",
+        'products': [serialize_product(product) for product, _ in found],
+        'stores': stores_with_products
+    }
 
-def handle_product_search(message, user_location):
-    """Handle product search queries"""
+def handle_product_search(message, user_location, tokens=None, found=None):
+    """Handle product search queries; the products found go to found['products'] as (id, score)"""
     # Extract keywords and search for products
-    keywords = extract_product_keywords(message)
+    keywords = extract_product_keywords(message, tokens)
+    snapshot = get_catalog()  # also builds the spelling index on first use
+    if spelling_index.built:
+        # Typos are fixed word by word before the fuzzy search sees them
+        with instrumentation.stage('spelling'):
+            keywords = [spelling_index.correct(keyword) for keyword in keywords]
     search_query = ' '.join(keywords)
     
     if not search_query:
@@ -172,35 +1223,28 @@ def handle_product_search(message, user_location):
             'message': "I'd be happy to help you find products! Could you tell me what specific item you're looking for?"
         }
     
-    # Search for products
-    products = fuzzy_search_products(search_query)
+    # Top 5 products, then the top 3 stores for them
+    ranked = rank_products(search_query, limit=5, snapshot=snapshot)
     
-    if not products:
+    if not ranked:
         return {
             'type': 'text',
             'message': f"I couldn't find any products matching '{search_query}'. Try searching for items like 'apples', 'milk', 'bread', or browse our categories: fruits, vegetables, dairy, snacks, beverages, and bakery."
         }
     
-    # Limit to top 5 results
-    products = products[:5]
-    
-    # Find stores with these products
-    stores_with_products = find_stores_with_products([p.id for p in products], user_location)
+    products = [product for product, _ in ranked]
+    if found is not None:
+        found['products'] = [(product.id, score) for product, score in ranked]
+    stores_with_products = find_stores_with_products(
+        [p.id for p in products], user_location, limit=3, snapshot=snapshot,
+        relevance={product.id: score for product, score in ranked}
+    )
     
     return {
         'type': 'product_search',
         'message': f"I found {len(products)} product(s) matching your search:",
-        'products': [
-            {
-                'id': p.id,
-                'name': p.name,
-                'category': p.category,
-                'price': p.price,
-                'description': p.description,
-                'icon': p.icon
-            } for p in products
-        ],
-        'stores': stores_with_products[:3]  # Top 3 nearest stores
+        'products': [serialize_product(p) for p in products],
+        'stores': stores_with_products
     }
 
 def handle_store_query(message, user_location):
@@ -211,35 +1255,20 @@ def handle_store_query(message, user_location):
             'message': "I'd love to help you find nearby stores! However, I need your location first. Please allow location access when prompted."
         }
     
-    # Get all stores with distances
-    stores = Store.query.all()
-    stores_with_distance = []
+    # Only the nearest stores are needed, so ask the grid index for them
+    snapshot = get_catalog()
+    nearest = store_locator.nearest(user_location['lat'], user_location['lng'], 5)
     
-    for store in stores:
-        distance = calculate_distance(
-            user_location['lat'], user_location['lng'],
-            store.latitude, store.longitude
-        )
-        
-        stores_with_distance.append({
-            'id': store.id,
-            'name': store.name,
-            'address': store.address,
-            'latitude': store.latitude,
-            'longitude': store.longitude,
-            'phone': store.phone,
-            'hours': store.hours,
-            'services': json.loads(store.services) if store.services else [],
-            'distance': round(distance, 1)
-        })
-    
-    # Sort by distance
-    stores_with_distance.sort(key=lambda x: x['distance'])
+    stores_with_distance = [
+        serialize_store(snapshot.stores_by_id[store_id], distance)
+        for store_id, distance in nearest
+        if store_id in snapshot.stores_by_id
+    ]
     
     return {
         'type': 'store_locations',
         'message': f"Here are the nearest SUVAI stores to your location:",
-        'stores': stores_with_distance[:5]  # Top 5 nearest stores
+        'stores': stores_with_distance  # Top 5 nearest stores
     }
 
 def handle_help_query():
@@ -276,152 +1305,708 @@ def handle_default_response(message):
         'message': random.choice(responses)
     }
 
-def find_stores_with_products(product_ids, user_location):
-    """Find stores that have the specified products in stock"""
-    stores = Store.query.all()
-    stores_with_products = []
+def stock_by_store(product_ids, snapshot):
+    """In-stock products among product_ids per store, as {store_id: [{product_id, quantity}]} in store id order"""
+    stores = snapshot.stores_by_id
+    quantities = snapshot.stock
     
-    for store in stores:
-        # Check inventory for each product
+    # Only stores stocking at least one of the products can qualify
+    candidate_ids = sorted({
+        store_id
+        for product_id in set(product_ids)
+        for store_id, _ in snapshot.product_stores.get(product_id, ())
+        if store_id in stores
+    })
+    
+    # Work out stock per store first so only stores that qualify get ranked
+    available = {}
+    for store_id in candidate_ids:
         available_products = []
         for product_id in product_ids:
-            inventory = Inventory.query.filter_by(store_id=store.id, product_id=product_id).first()
-            if inventory and inventory.quantity > 0:
+            quantity = quantities.get((store_id, product_id))
+            if quantity and quantity > 0:
                 available_products.append({
                     'product_id': product_id,
-                    'quantity': inventory.quantity
+                    'quantity': quantity
                 })
-        
         if available_products:
-            distance = 0
-            if user_location:
-                distance = calculate_distance(
-                    user_location['lat'], user_location['lng'],
-                    store.latitude, store.longitude
-                )
-            
-            # Determine availability status
-            availability_status = 'in-stock' if len(available_products) == len(product_ids) else 'low-stock'
-            
-            stores_with_products.append({
-                'id': store.id,
-                'name': store.name,
-                'address': store.address,
-                'latitude': store.latitude,
-                'longitude': store.longitude,
-                'phone': store.phone,
-                'hours': store.hours,
-                'services': json.loads(store.services) if store.services else [],
-                'distance': round(distance, 1),
-                'available_products': available_products,
-                'availability_status': availability_status
-            })
+            available[store_id] = available_products
+    return available
+
+def nearest_stock(product_ids, cell, limit, snapshot, relevance=None):
+    """
+    stock_by_store() narrowed to the stores that can rank among the top
+    limit from some point of a grid cell (see ranking.score_bound)
+    """
+    available = stock_by_store(product_ids, snapshot)
+    if len(available) <= limit:
+        return available
+    
+    (lat, lng), radius = cell_circle(cell, app.config['CHAT_CACHE_CELL_SIZE'])
+    ids, distances = store_locator.distances(lat, lng, list(available))
+    if len(ids) <= limit:
+        return available
+    weights = ranking_weights()
+    scores = store_scores(weights, distances, [available[s] for s in ids.tolist()], product_ids, relevance)
+    near = set(ids[scores <= score_bound(scores, limit, weights, radius)].tolist())
+    return {store_id: stock for store_id, stock in available.items() if store_id in near}
+
+def ranking_weights():
+    """Store ranking weights from the app config"""
+    config = app.config
+    return RankingWeights(
+        config['RANKING_DISTANCE_WEIGHT'], config['RANKING_STOCK_WEIGHT'],
+        config['RANKING_TEXT_WEIGHT'], config['RANKING_STOCK_CAP']
+    )
+
+@instrumentation.timed('store_lookup')
+def find_stores_with_products(product_ids, user_location, limit=None, snapshot=None, relevance=None):
+    """
+    Find stores that have the specified products in stock, best ranked first;
+    relevance optionally maps product ids to their search scores
+    """
+    if not product_ids:
+        return []
+    
+    snapshot = snapshot or get_catalog()
+    stores = snapshot.stores_by_id
+    
+    memo = get_batch_memo()
+    location_key = (user_location['lat'], user_location['lng']) if user_location else None
+    weights = ranking_weights()
+    relevance_key = weights.relevance_key(product_ids, relevance)
+    memo_key = ('stores', tuple(product_ids), location_key, limit, relevance_key, snapshot.version)
+    if memo is not None and memo_key in memo:
+        return memo[memo_key]
     
-    # Sort by distance
+    # The stock scan is cached per stores/inventory version; with a location
+    # and a limit, per grid cell too, keeping only the stores that can rank
+    # among the nearest from somewhere in the cell
+    versions = (snapshot.versions['stores'], snapshot.versions['inventory'])
+    if user_location and limit:
+        cell = location_cell(user_location['lat'], user_location['lng'], app.config['CHAT_CACHE_CELL_SIZE'])
+        available = chat_cache.get_or_compute(
+            ('stores', tuple(product_ids), cell, limit, relevance_key) + versions,
+            lambda: nearest_stock(product_ids, cell, limit, snapshot, relevance)
+        )
+    else:
+        available = chat_cache.get_or_compute(
+            ('stores', tuple(product_ids)) + versions,
+            lambda: stock_by_store(product_ids, snapshot)
+        )
+    
+    # One vectorized distance pass over the qualifying stores, then only
+    # the best `limit` of them are picked out
     if user_location:
-        stores_with_products.sort(key=lambda x: x['distance'])
+        ids, distances = store_locator.distances(user_location['lat'], user_location['lng'], list(available))
+    else:
+        ids, distances = without_distances(list(available))
+    scores = store_scores(weights, distances, [available[s] for s in ids.tolist()], product_ids, relevance)
+    ranked = top_stores(ids, distances, scores, limit)
+    if not user_location:
+        ranked = [(store_id, 0) for store_id, _ in ranked]
+    
+    stores_with_products = []
+    
+    for store_id, distance in ranked:
+        available_products = available[store_id]
+        
+        # Determine availability status
+        availability_status = 'in-stock' if len(available_products) == len(product_ids) else 'low-stock'
+        
+        store_data = serialize_store(stores[store_id], distance)
+        store_data['available_products'] = available_products
+        store_data['availability_status'] = availability_status
+        stores_with_products.append(store_data)
     
+    if memo is not None:
+        memo[memo_key] = stores_with_products
     return stores_with_products
 
 @app.route('/api/products', methods=['GET'])
+@response_cache.cached(lambda: catalog_version('products'), skip_if=wants_stream)
 def get_products():
-    """Get all products or search products"""
+    """Get all products or search products, optionally paged or streamed"""
     try:
         search_query = request.args.get('search', '')
         category = request.args.get('category', '')
+        sort = request.args.get('sort')
         
-        query = Product.query
+        if sort is not None and sort not in PRODUCT_SORT_COLUMNS:
+            return jsonify({'error': f"sort must be one of {', '.join(PRODUCT_SORT_COLUMNS)}"}), 400
+        limit, after = parse_page_args(PRODUCT_SORT_COLUMNS[sort or 'id'])
+        paged = limit is not None or after is not None
         
-        if category:
-            query = query.filter(Product.category == category)
+        snapshot = get_catalog()
         
         if search_query:
-            products = fuzzy_search_products(search_query)
-            if category:
-                products = [p for p in products if p.category == category]
-        else:
-            products = query.all()
-        
-        return jsonify([
-            {
-                'id': p.id,
-                'name': p.name,
-                'category': p.category,
-                'price': p.price,
-                'description': p.description,
-                'icon': p.icon
-            } for p in products
-        ])
+            # Search results are ranked by relevance, so only limit applies
+            if sort is not None or after is not None:
+                return jsonify({'error': 'sort and after cannot be combined with search'}), 400
+            ranked = rank_products(search_query, limit=limit, snapshot=snapshot, category=category or None)
+            products = [product for product, _ in ranked]
+            if wants_stream():
+                return Response(
+                    (json.dumps(serialize_product(p)) + '\n' for p in products),
+                    mimetype='application/x-ndjson'
+                )
+            if paged:
+                return jsonify({'items': [serialize_product(p) for p in products], 'next': None})
+            return jsonify([serialize_product(p) for p in products])
+        
+        if wants_stream():
+            return Response(
+                stream_with_context(stream_products(category, sort or 'id', after, limit)),
+                mimetype='application/x-ndjson'
+            )
+        
+        keys, products = snapshot.product_view(sort or 'id', category or None)
+        if paged:
+            return paged_response(keys, products, after, limit, serialize_product)
+        return jsonify([serialize_product(p) for p in products])
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def product_list_query(category, sort, after, limit):
+    """Products in keyset order after the `after` key, optionally for one category"""
+    columns = PRODUCT_SORT_COLUMNS[sort]
+    query = db.select(
+        Product.id, Product.name, Product.category, Product.price, Product.description, Product.icon
+    )
+    if category:
+        query = query.where(Product.category == category)
+    if after is not None:
+        query = query.where(tuple_(*columns) > tuple_(*after))
+    query = query.order_by(*columns)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def keyset_chunks(make_query, key_of, after):
+    """
+    Yield the rows of make_query(after) one STREAM_CHUNK_SIZE chunk at a
+    time, resuming after the key of each chunk's last row. Every chunk is
+    read on its own read connection, which goes back to the pool before the
+    rows are sent, so a slow client never holds one.
+    """
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    while True:
+        with get_read_engine().connect() as connection:
+            rows = connection.execute(make_query(after).limit(chunk_size)).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = key_of(rows[-1])
+
+def stream_products(category, sort, after, limit):
+    """Yield products as NDJSON lines read in keyset chunks"""
+    columns = PRODUCT_SORT_COLUMNS[sort]
+    rows = keyset_chunks(
+        lambda after: product_list_query(category, sort, after, None),
+        lambda row: tuple(getattr(row, column.key) for column in columns),
+        after
+    )
+    for row in itertools.islice(rows, limit):
+        yield json.dumps(serialize_product(ProductRecord(*row))) + '\n'
+
+def parse_product_ids(value):
+    """Comma-separated product ids, deduplicated in order; raises ValueError when malformed"""
+    try:
+        product_ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        raise ValueError('ids must be comma-separated integers')
+    if not product_ids:
+        raise ValueError('ids is required')
+    if len(product_ids) > app.config['AVAILABILITY_MAX_IDS']:
+        raise ValueError(f"At most {app.config['AVAILABILITY_MAX_IDS']} ids per request")
+    return product_ids
+
+def availability_query(product_ids):
+    """Materialized availability of some products"""
+    return db.select(
+        ProductAvailability.product_id, ProductAvailability.stores_available, ProductAvailability.total_quantity
+    ).where(ProductAvailability.product_id.in_(product_ids))
+
+def nearby_availability_query(product_ids, rows, cols):
+    """Availability of some products summed over a block of regions"""
+    return db.select(
+        ProductRegionAvailability.product_id,
+        db.func.sum(ProductRegionAvailability.stores_available),
+        db.func.sum(ProductRegionAvailability.total_quantity)
+    ).where(
+        ProductRegionAvailability.product_id.in_(product_ids),
+        ProductRegionAvailability.region_row.between(*rows),
+        ProductRegionAvailability.region_col.between(*cols)
+    ).group_by(ProductRegionAvailability.product_id)
+
+def availability_response(product_ids, totals, nearby=None):
+    """Availability body from {product_id: (stores, units)} totals and optional nearby sums"""
+    availability = []
+    for product_id in product_ids:
+        stores_available, total_quantity = totals.get(product_id, (0, 0))
+        item = {
+            'product_id': product_id,
+            'stores_available': stores_available,
+            'total_quantity': total_quantity
+        }
+        if nearby is not None:
+            stores_available, total_quantity = nearby.get(product_id, (0, 0))
+            item['nearby'] = {'stores_available': stores_available, 'total_quantity': total_quantity}
+        availability.append(item)
+    return {'availability': availability}
+
+@app.route('/api/products/availability', methods=['GET'])
+def get_product_availability():
+    """Availability of many products in one call, optionally also near lat/lng"""
+    try:
+        product_ids = parse_product_ids(request.args.get('ids', ''))
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        
+        products_by_id = get_catalog().products_by_id
+        product_ids = [product_id for product_id in product_ids if product_id in products_by_id]
+        
+        with get_read_engine().connect() as connection:
+            totals = {row[0]: row[1:] for row in connection.execute(availability_query(product_ids))}
+            nearby = None
+            if lat is not None and lng is not None:
+                rows, cols = nearby_regions(lat, lng, app.config['AVAILABILITY_REGION_SIZE'])
+                nearby = {
+                    row[0]: row[1:]
+                    for row in connection.execute(nearby_availability_query(product_ids, rows, cols))
+                }
         
+        return jsonify(availability_response(product_ids, totals, nearby))
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/stores', methods=['GET'])
+@response_cache.cached(lambda: catalog_version('stores'))
 def get_stores():
     """Get all stores or find nearby stores"""
     try:
         lat = request.args.get('lat', type=float)
         lng = request.args.get('lng', type=float)
+        radius = request.args.get('radius', type=float)  # kilometers
+        limit = parse_limit()
         
-        stores = Store.query.all()
-        stores_data = []
-        
-        for store in stores:
-            store_data = {
-                'id': store.id,
-                'name': store.name,
-                'address': store.address,
-                'latitude': store.latitude,
-                'longitude': store.longitude,
-                'phone': store.phone,
-                'hours': store.hours,
-                'services': json.loads(store.services) if store.services else []
-            }
-            
-            if lat and lng:
-                distance = calculate_distance(lat, lng, store.latitude, store.longitude)
-                store_data['distance'] = round(distance, 1)
-            
-            stores_data.append(store_data)
+        snapshot = get_catalog()
         
-        # Sort by distance if location provided
         if lat and lng:
-            stores_data.sort(key=lambda x: x['distance'])
+            if radius is not None:
+                # The ring search stops once it is past the radius
+                nearest = store_locator.nearest(lat, lng, limit or len(snapshot.stores), radius_km=radius)
+            elif limit is not None:
+                # Small k: the ring search only touches nearby cells
+                nearest = store_locator.nearest(lat, lng, limit)
+            else:
+                nearest = store_locator.rank(lat, lng)
+            
+            stores_data = [
+                serialize_store(snapshot.stores_by_id[store_id], distance)
+                for store_id, distance in nearest
+                if store_id in snapshot.stores_by_id
+            ]
+        else:
+            stores = snapshot.stores[:limit] if limit is not None else snapshot.stores
+            stores_data = [serialize_store(store) for store in stores]
         
         return jsonify(stores_data)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Get runtime counters for the backend's background subsystems"""
+    snapshot = get_catalog()
+    return jsonify({
+        'catalog': {
+            'version': snapshot.version,
+            'loaded_at': snapshot.loaded_at,
+            'products': len(snapshot.products),
+            'stores': len(snapshot.stores),
+            'inventory_rows': len(snapshot.inventory)
+        },
+        'chat_log': chat_log.stats(),
+        'response_cache': response_cache.stats(),
+        'chat_cache': chat_cache.stats(),
+        'chat_retention': chat_retention.stats(),
+        'session_context': session_contexts.stats(),
+        'search_index': search_index.stats(),
+        'storage': storage_stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this process"""
+    if not instrumentation.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def storage_stats():
+    """Effective SQLite pragmas and pool state of the write and read engines"""
+    stats = {}
+    for name, engine in (('write', db.engine), ('read', get_read_engine())):
+        if engine.dialect.name != 'sqlite':
+            continue
+        with engine.connect() as connection:
+            stats[name] = {
+                'pragmas': current_pragmas(connection.connection),
+                'pool': engine.pool.status()
+            }
+    return stats
+
 @app.route('/api/inventory/<int:store_id>', methods=['GET'])
 def get_store_inventory(store_id):
-    """Get inventory for a specific store"""
+    """Get inventory for a specific store, optionally paged or streamed by product id"""
     try:
-        inventory_items = db.session.query(Inventory, Product).join(Product).filter(
-            Inventory.store_id == store_id,
-            Inventory.quantity > 0
-        ).all()
+        limit, after = parse_page_args((Inventory.product_id,))
+        
+        if wants_stream():
+            return Response(
+                stream_with_context(stream_store_inventory(store_id, after, limit)),
+                mimetype='application/x-ndjson'
+            )
+        
+        snapshot = get_catalog()
+        
+        if limit is not None or after is not None:
+            keys, rows = snapshot.inventory_view(store_id)
+            return paged_response(keys, rows, after, limit, lambda row: serialize_inventory_item(*row))
         
         inventory_data = []
-        for inventory, product in inventory_items:
-            inventory_data.append({
-                'product_id': product.id,
-                'product_name': product.name,
-                'category': product.category,
-                'price': product.price,
-                'quantity': inventory.quantity,
-                'icon': product.icon
-            })
+        for product_id, quantity in snapshot.store_inventory.get(store_id, ()):
+            product = snapshot.products_by_id.get(product_id)
+            if product is None or not quantity or quantity <= 0:
+                continue
+            inventory_data.append(serialize_inventory_item(product, quantity))
         
         return jsonify(inventory_data)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def store_inventory_list_query(store_id, after):
+    """A store's inventory joined with its products, by product id after the `after` key"""
+    query = db.select(
+        Inventory.product_id, Product.name, Product.category, Product.price, Product.description,
+        Product.icon, Inventory.quantity
+    ).join(Product, Product.id == Inventory.product_id).where(Inventory.store_id == store_id)
+    if after is not None:
+        query = query.where(Inventory.product_id > after[0])
+    return query.order_by(Inventory.product_id, Inventory.id)
+
+def stream_store_inventory(store_id, after, limit):
+    """Yield a store's in-stock products as NDJSON lines read in keyset chunks, by product id"""
+    rows = keyset_chunks(
+        lambda after: store_inventory_list_query(store_id, after),
+        lambda row: (row[0],),
+        after
+    )
+    sent = 0
+    previous_id = None
+    for row in rows:
+        # First row per product wins, as in the catalog snapshot
+        if row[0] == previous_id:
+            continue
+        previous_id = row[0]
+        quantity = row[6]
+        if not quantity or quantity <= 0:
+            continue
+        yield json.dumps(serialize_inventory_item(ProductRecord(*row[:6]), quantity)) + '\n'
+        sent += 1
+        if limit and sent >= limit:
+            break
+
+@app.route('/api/inventory/reserve', methods=['POST'])
+def reserve():
+    """Hold stock for a cart until it is ordered, released or expires"""
+    try:
+        data = request.get_json()
+        # Clients may ask for a shorter hold than RESERVATION_TTL, never a longer one
+        ttl = data.get('ttl')
+        if ttl is not None and (
+            not isinstance(ttl, int) or isinstance(ttl, bool) or not 0 < ttl <= app.config['RESERVATION_TTL']
+        ):
+            raise ValueError(f"ttl must be an integer from 1 to {app.config['RESERVATION_TTL']} seconds")
+        reservation = reserve_inventory(data.get('items'), data.get('session_id'), ttl=ttl)
+        return jsonify(reservation), 201
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OutOfStockError as e:
+        return jsonify({
+            'error': str(e),
+            'store_id': e.store_id,
+            'product_id': e.product_id,
+            'requested': e.quantity
+        }), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/inventory/reserve/<reservation_id>', methods=['DELETE'])
+def release(reservation_id):
+    """Give a held reservation's stock back"""
+    try:
+        if not release_reservation(reservation_id):
+            return jsonify({'error': 'Reservation not found or no longer held'}), 404
+        return jsonify({'reservation_id': reservation_id, 'status': 'released'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/orders', methods=['POST'])
+def create_order():
+    """Place an order from a reservation, or reserve and order items in one call"""
+    try:
+        data = request.get_json()
+        session_id = data.get('session_id')
+        reservation_id = data.get('reservation_id')
+        
+        if not reservation_id:
+            reservation_id = reserve_inventory(data.get('items'), session_id)['reservation_id']
+        
+        return jsonify(place_order(reservation_id, session_id)), 201
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OutOfStockError as e:
+        return jsonify({
+            'error': str(e),
+            'store_id': e.store_id,
+            'product_id': e.product_id,
+            'requested': e.quantity
+        }), 409
+    except ReservationError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/inventory/bulk', methods=['POST'])
+def bulk_inventory():
+    """Upsert stock levels from a CSV or NDJSON feed sent as the body or as a multipart 'file'"""
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            stream = upload.stream
+            feed_format = request.args.get('format') or detect_feed_format(upload.filename, upload.mimetype)
+        else:
+            stream = request.stream
+            feed_format = request.args.get('format') or detect_feed_format(None, request.mimetype)
+        
+        if feed_format not in FEED_PARSERS:
+            return jsonify({'error': 'Send text/csv or application/x-ndjson, or pass format=csv|ndjson'}), 400
+        
+        # Read line by line; the body is never held in memory as a whole
+        lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        return jsonify(import_inventory_feed(lines, feed_format))
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e), 'partial': getattr(e, 'result', None) is not None}), 500
+
+@app.cli.command('import-inventory')
+@click.argument('path')
+@click.option('--format', 'feed_format', type=click.Choice(sorted(FEED_PARSERS)),
+              help='Feed format; guessed from the file extension by default')
+def import_inventory_command(path, feed_format):
+    """Stream a CSV/NDJSON stock feed file (or - for stdin) into the inventory table"""
+    feed_format = feed_format or detect_feed_format(path, None)
+    if feed_format is None:
+        raise click.UsageError('Cannot tell the feed format from the file name; pass --format')
+    
+    migrate_schema()
+    with click.open_file(path, encoding='utf-8') as lines:
+        result = import_inventory_feed(lines, feed_format)
+    
+    click.echo(
+        f"{result['applied']} rows applied, {result['rejected']} rejected, "
+        f"{result['stores']} stores touched in {result['elapsed']}s ({result['rows_per_sec']} rows/s)"
+    )
+    for error in result['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+
+@app.cli.command('generate-data')
+@click.option('--products', default=100000, show_default=True, help='Products to add')
+@click.option('--stores', default=2000, show_default=True, help='Stores to add, each with its own inventory')
+@click.option('--density', default=0.05, show_default=True, help='Share of all products each new store stocks (1.0 = dense)')
+@click.option('--chat-messages', default=0, show_default=True, help='Chat messages to add')
+@click.option('--chat-days', default=90, show_default=True, help='Days of history the chat messages span')
+@click.option('--regions', type=click.Choice(sorted(REGIONS)), default='us', show_default=True,
+              help='Metro areas the stores are spread over')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--reset', is_flag=True, help='Drop all existing data first')
+def generate_data_command(products, stores, density, chat_messages, chat_days, regions, seed, reset):
+    """Add a seeded synthetic catalogue, stores, inventory and chat history for scale testing"""
+    if reset:
+        db.drop_all()
+        chat_retention.drop_expired(datetime.max)
+    migrate_schema()
+    
+    # Non-unique indexes and the availability triggers are rebuilt once at the
+    # end by migrate_schema() instead of being maintained row by row
+    with db.engine.begin() as connection:
+        for table in (Inventory.__table__, ChatMessage.__table__):
+            for index in table.indexes:
+                if not index.unique:
+                    connection.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+        for name in availability_triggers(app.config['AVAILABILITY_REGION_SIZE']):
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    
+    start = time.perf_counter()
+    try:
+        with db.engine.begin() as connection:
+            result = generate_dataset(
+                connection, products=products, stores=stores, density=density, chat_messages=chat_messages,
+                regions=regions, seed=seed, chat_days=chat_days
+            )
+    finally:
+        rebuild_start = time.perf_counter()
+        migrate_schema()
+    
+    for table, stats in result.items():
+        rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+        click.echo(f"{table}: {stats['rows']} rows in {stats['seconds']}s ({rate:,.0f} rows/s)")
+    click.echo(
+        f"indexes and availability rebuilt in {time.perf_counter() - rebuild_start:.1f}s, "
+        f"{time.perf_counter() - start:.1f}s in total"
+    )
+
+def migrate_schema():
+    """
+    Bring a database up to the models: tables, indexes, the unique
+    (store, product) inventory constraint and views. Safe to run on every
+    start. Older databases may hold duplicate inventory rows, of which the
+    first is kept.
+    """
+    db.create_all()
+    
+    inventory_indexes = {index['name'] for index in db.inspect(db.engine).get_indexes('inventory')}
+    if 'uq_inventory_store_product' not in inventory_indexes:
+        db.session.execute(db.text(
+            'DELETE FROM inventory WHERE id NOT IN '
+            '(SELECT MIN(id) FROM inventory GROUP BY store_id, product_id)'
+        ))
+    for name in OBSOLETE_INDEXES:
+        db.session.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+    for name in OBSOLETE_TRIGGERS:
+        db.session.execute(db.text(f'DROP TRIGGER IF EXISTS {name}'))
+    db.session.commit()
+    
+    # create_all() only builds indexes together with new tables
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    with db.engine.begin() as connection:
+        for name, select in SCHEMA_VIEWS.items():
+            connection.exec_driver_sql(f'DROP VIEW IF EXISTS {name}')
+            connection.exec_driver_sql(f'CREATE VIEW {name} AS {select}')
+    
+    migrate_availability_triggers()
+
+def migrate_availability_triggers():
+    """
+    Install the availability triggers, and recompute the availability tables
+    from inventory whenever the triggers were missing or built for another
+    region size, since writes made meanwhile were not counted
+    """
+    size = app.config['AVAILABILITY_REGION_SIZE']
+    triggers = availability_triggers(size)
+    with db.engine.begin() as connection:
+        installed = dict(connection.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"
+        ).all())
+        if all(installed.get(name) == sql for name, sql in triggers.items()):
+            return
+        for name, sql in triggers.items():
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+            connection.exec_driver_sql(sql)
+        for statement in rebuild_statements(size):
+            connection.exec_driver_sql(statement)
+
+@app.cli.command('prune-chat')
+def prune_chat_command():
+    """Archive old chat turns, drop expired months and unused responses now"""
+    migrate_schema()
+    result = chat_retention.run()
+    click.echo(
+        f"{result['moved']} chat turns archived, {result['partitions_dropped']} monthly tables dropped, "
+        f"{result['responses_deleted']} unused responses deleted"
+    )
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Create missing tables, indexes and views and drop obsolete ones"""
+    migrate_schema()
+    click.echo('Schema is up to date')
+
+def hot_queries():
+    """(name, statement, params) for the selective queries on request paths"""
+    now = datetime.utcnow()
+    line = {'line_store_id': 1, 'line_product_id': 1, 'line_quantity': 1, 'now': now}
+    queries = [
+        ('store inventory reload', store_inventory_query({1, 2}), {}),
+        ('store inventory stream', store_inventory_list_query(1, None), {}),
+        ('store inventory stream after cursor', store_inventory_list_query(1, (1,)), {}),
+        ('products by category', product_list_query('fruits', 'id', None, 50), {}),
+    ]
+    # The first page of the unfiltered product list walks the table by design and stops at LIMIT
+    for sort, columns in PRODUCT_SORT_COLUMNS.items():
+        after = tuple(column.type.python_type() for column in columns)
+        queries.append((f'products by {sort} after cursor', product_list_query(None, sort, after, 50), {}))
+    queries += [
+        ('take stock', TAKE_STOCK, line),
+        ('return stock', RETURN_STOCK, line),
+        ('claim reservation', CLAIM_RESERVATION, {'claim_id': 'x', 'new_status': 'released'}),
+        ('order reservation', ORDER_RESERVATION, {'claim_id': 'x', 'now': now}),
+        ('reservation lines', RESERVATION_LINES, {'claim_id': 'x'}),
+        ('order lines', ORDER_LINES, {'claim_id': 'x'}),
+        ('expired reservations', EXPIRED_RESERVATIONS, {'now': now}),
+        ('product availability', availability_query([1, 2, 3]), {}),
+        ('chat turns to archive', chat_retention.batch_query(now), {}),
+        ('unused chat responses', chat_retention.unreferenced_query(now), {}),
+        ('nearby product availability', nearby_availability_query([1, 2, 3], (0, 2), (0, 2)), {}),
+        ('store inventory view by store',
+         db.text('SELECT * FROM store_inventory_view WHERE store_id = :store_id'), {'store_id': 1}),
+        ('product availability view by product',
+         db.text('SELECT * FROM product_availability_view WHERE product_id = :product_id'), {'product_id': 1}),
+    ]
+    return queries
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN QUERY PLAN every hot query; exits non-zero if any reads a whole table"""
+    migrate_schema()
+    with db.engine.connect() as connection:
+        results = check_query_plans(connection, hot_queries())
+    
+    failed = 0
+    for name, plan, scanned in results:
+        failed += bool(scanned)
+        click.echo(f"{'FAIL' if scanned else 'ok':>4}  {name}")
+        for detail in plan:
+            click.echo(f"      {detail}")
+    if failed:
+        raise click.ClickException(f'{failed} of {len(results)} queries scan a whole table')
+    click.echo(f'All {len(results)} queries use indexes')
+
 # Initialize database and populate with mock data
 def init_db():
     """Initialize database with mock data"""
-    db.create_all()
+    migrate_schema()
     
     # Check if data already exists
     if Product.query.first():
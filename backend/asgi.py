@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+ASGI serving mode
+Serves the API from an asyncio event loop, e.g. with several uvicorn worker
+processes (`python asgi.py --workers 4`). POST /api/chat and
+GET /api/products/availability are served natively. Intent routing and fuzzy
+scoring run on a bounded thread pool and database access goes through
+aiosqlite, so a slow chat turn never holds the loop. Every other route is
+handed to the Flask app on a worker thread, so responses are identical to
+the WSGI server's. With several workers, the supervisor process owns the
+catalog and publishes it to them through shared memory (shared_catalog.py).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import aiosqlite
+
+from app import (
+    app, db, catalog, search_index, instrumentation, init_db, ChatMessage, make_chat_row, save_chat_message, process_chat_message,
+    chat_retention, parse_product_ids, availability_query, nearby_availability_query, availability_response
+)
+from availability import nearby_regions
+from query_plans import driver_sql
+from shared_catalog import CatalogPublisher
+from sqlite_profile import sqlite_pragmas
+
+INSERT_CHAT_SQL = (
+    'INSERT INTO chat_message (session_id, user_message, bot_response, timestamp) VALUES (?, ?, ?, ?)'
+)
+
+
+class AsyncDatabase:
+    """aiosqlite connections for the native routes: a pool of query_only readers and one writer"""
+
+    def __init__(self, path, config, readers):
+        self.path = path
+        self.config = config
+        self.reader_count = readers
+        self._readers = None
+        self._writer = None
+        self._write_lock = None
+        self._open_lock = asyncio.Lock()
+
+    async def open(self):
+        async with self._open_lock:
+            if self._readers is not None:
+                return
+            self._writer = await self._connect(read_only=False)
+            self._write_lock = asyncio.Lock()
+            readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                readers.put_nowait(await self._connect(read_only=True))
+            self._readers = readers
+
+    async def close(self):
+        if self._readers is None:
+            return
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        await self._writer.close()
+        self._readers = self._writer = None
+
+    async def _connect(self, read_only):
+        connection = await aiosqlite.connect(self.path)
+        for statement in sqlite_pragmas(self.config, read_only):
+            await connection.execute(statement)
+        return connection
+
+    async def fetchall(self, sql, params=()):
+        await self.open()
+        connection = await self._readers.get()
+        start = time.perf_counter()
+        try:
+            async with connection.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._readers.put_nowait(connection)
+            instrumentation.record_sql(sql, time.perf_counter() - start)
+
+    async def executemany(self, sql, rows):
+        """Run a write statement for each row in one transaction"""
+        await self.open()
+        async with self._write_lock:
+            start = time.perf_counter()
+            try:
+                await self._writer.executemany(sql, rows)
+                await self._writer.commit()
+            except Exception:
+                await self._writer.rollback()
+                raise
+            finally:
+                instrumentation.record_sql(sql, time.perf_counter() - start)
+
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input for a worker thread, pulling body chunks from the ASGI receive channel"""
+
+    def __init__(self, receive, loop, initial=b'', more_body=True):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = memoryview(initial)
+        self._more_body = more_body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more_body = False
+                break
+            self._chunk = memoryview(message.get('body', b''))
+            self._more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(body, 64 * 1024),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def request_headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def cors_headers(headers):
+    """Response headers matching CORS(app) with its defaults (any origin)"""
+    origin = headers.get('origin')
+    if origin:
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    return [(b'access-control-allow-origin', b'*')]
+
+
+def float_arg(args, name):
+    """A float query argument, or None when missing or malformed (as request.args.get(type=float))"""
+    try:
+        return float(args[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def answer_chat(user_message, user_location, session_id, log_async):
+    """One chat turn on a pool thread; the chat record is queued here when logging is asynchronous"""
+    with app.app_context(), instrumentation.watch_thread():
+        response = process_chat_message(user_message, user_location, session_id)
+        if log_async:
+            save_chat_message(session_id, user_message, response)
+        return response
+
+
+class FreshMartASGI:
+    """ASGI application: native async chat and availability routes, Flask for the rest"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        with flask_app.app_context():
+            self.dialect = db.engine.dialect
+            database_path = db.engine.url.database
+            timestamp_type = ChatMessage.__table__.c.timestamp.type
+            self.process_timestamp = timestamp_type.bind_processor(self.dialect) or (lambda value: value)
+        self.database = AsyncDatabase(database_path, config, max(config['SQLITE_READ_POOL_SIZE'], 1))
+        self.cpu_pool = ThreadPoolExecutor(config['ASGI_CPU_THREADS'], thread_name_prefix='asgi-cpu')
+        self.wsgi_pool = ThreadPoolExecutor(config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+        self.routes = {
+            ('POST', '/api/chat'): self.chat,
+            ('GET', '/api/products/availability'): self.product_availability,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            handler = self.routes.get((scope['method'], scope['path']))
+            if handler is None:
+                await self.call_flask(scope, receive, send)
+            else:
+                await self.traced(handler, scope, receive, send)
+
+    async def traced(self, handler, scope, receive, send):
+        """Run a native route as one traced request; Flask traces the routes it serves itself"""
+        token = instrumentation.begin_request(sample=False)
+        if token is None:
+            await handler(scope, receive, send)
+            return
+        status = []
+
+        async def send_traced(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            await send(message)
+
+        try:
+            await handler(scope, receive, send_traced)
+        finally:
+            instrumentation.end_request(token, scope['method'], scope['path'], status[0] if status else 500)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.open()
+                # Native chat requests never reach Flask's before_request hooks
+                chat_retention.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                self.cpu_pool.shutdown(wait=False)
+                self.wsgi_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run_cpu(self, fn, *args):
+        # In a copy of the request's context, so stage timers reach its trace
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.cpu_pool, functools.partial(context.run, fn, *args)
+        )
+
+    async def respond(self, scope, send, data, status=200):
+        """Send a JSON response encoded exactly as jsonify() would"""
+        with instrumentation.stage('json_encode'):
+            body = self.flask_app.json.response(data).get_data()
+        headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ] + cors_headers(request_headers(scope))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def call_flask(self, scope, receive, send, body=None):
+        """Serve a request with the Flask app on a worker thread, streaming the body both ways"""
+        loop = asyncio.get_running_loop()
+        if body is None:
+            request_body = RequestBody(receive, loop)
+        else:
+            request_body = RequestBody(receive, loop, body, more_body=False)
+        environ = build_environ(scope, request_body)
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        # A chat body handed back from the native route stays part of that route's trace
+        context = contextvars.copy_context()
+        await loop.run_in_executor(self.wsgi_pool, context.run, self.run_wsgi, environ, send_sync)
+
+    def run_wsgi(self, environ, send_sync):
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        result = self.flask_app(environ, start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    send_sync({'type': 'http.response.start', **response_start})
+                    started = True
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                send_sync({'type': 'http.response.start', **response_start})
+            send_sync({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def chat(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        # Bodies the route would reject are left to Flask for its exact error
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        content_type = request_headers(scope).get('content-type', '').split(';')[0].strip()
+        if (content_type != 'application/json' or not isinstance(data, dict)
+                or not isinstance(data.get('message', ''), str)):
+            await self.call_flask(scope, receive, send, body)
+            return
+
+        try:
+            user_message = data.get('message', '').strip()
+            user_location = data.get('location')  # {'lat': float, 'lng': float}
+            session_id = data.get('session_id', 'default')
+
+            if not user_message:
+                await self.respond(scope, send, {'error': 'Message is required'}, 400)
+                return
+
+            log_async = self.flask_app.config['CHAT_LOG_ASYNC']
+            response = await self.run_cpu(answer_chat, user_message, user_location, session_id, log_async)
+            if not log_async:
+                row = make_chat_row(session_id, user_message, response)
+                with instrumentation.stage('chat_log'):
+                    await self.database.executemany(INSERT_CHAT_SQL, [(
+                        row['session_id'], row['user_message'], row['bot_response'],
+                        self.process_timestamp(row['timestamp'])
+                    )])
+        except Exception as e:
+            await self.respond(scope, send, {'error': str(e)}, 500)
+            return
+        await self.respond(scope, send, response)
+
+    async def product_availability(self, scope, receive, send):
+        args = dict(reversed(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)))
+        try:
+            product_ids = parse_product_ids(args.get('ids', ''))
+            lat = float_arg(args, 'lat')
+            lng = float_arg(args, 'lng')
+
+            snapshot = await self.run_cpu(catalog.snapshot)
+            product_ids = [product_id for product_id in product_ids if product_id in snapshot.products_by_id]
+
+            rows = await self.database.fetchall(*driver_sql(availability_query(product_ids), self.dialect))
+            totals = {row[0]: row[1:] for row in rows}
+            nearby = None
+            if lat is not None and lng is not None:
+                region_rows, region_cols = nearby_regions(lat, lng, self.flask_app.config['AVAILABILITY_REGION_SIZE'])
+                query = nearby_availability_query(product_ids, region_rows, region_cols)
+                nearby = {row[0]: row[1:] for row in await self.database.fetchall(*driver_sql(query, self.dialect))}
+            data = availability_response(product_ids, totals, nearby)
+        except ValueError as e:
+            await self.respond(scope, send, {'error': str(e)}, 400)
+            return
+        except Exception as e:
+            await self.respond(scope, send, {'error': str(e)}, 500)
+            return
+        await self.respond(scope, send, data)
+
+
+application = FreshMartASGI(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the FreshMart API with uvicorn')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--access-log', action='store_true')
+    parser.add_argument(
+        '--catalog', choices=('shared', 'local'),
+        help='with several workers: one catalog image in shared memory (default), or a catalog per worker'
+    )
+    args = parser.parse_args()
+
+    # Once, before the workers start, so they never race to create tables
+    with app.app_context():
+        init_db()
+
+    # Workers are fresh processes that import the app after this point, so
+    # they pick the shared catalog up from the environment
+    publisher = None
+    if args.workers > 1 and (args.catalog or 'shared') == 'shared':
+        publisher = CatalogPublisher(catalog, search_index)
+        publisher.start()
+        os.environ['SHARED_CATALOG_DIR'] = publisher.directory
+
+    import uvicorn
+    try:
+        uvicorn.run(
+            'asgi:application', host=args.host, port=args.port, workers=args.workers,
+            access_log=args.access_log
+        )
+    finally:
+        if publisher is not None:
+            publisher.close()
+
+if __name__ == '__main__':
+    main()
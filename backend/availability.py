@@ -0,0 +1,147 @@
+"""
+Materialized product availability
+Counts of in-stock stores and units per product, and per product and region
+(a cell of a lat/lng grid over store locations). SQLite triggers on inventory
+keep both tables current in the same transaction as every write, whether it
+comes from the ORM or a reservation, by adding the new row's contribution and
+subtracting the old one. Bulk feed chunks defer the triggers with a row in
+DEFERRAL_TABLE and apply their net change once per product and region instead.
+"""
+
+import math
+
+# While this table holds a row, the inventory triggers skip their work. A
+# writer inserts and deletes the row inside its own transaction, so no other
+# connection ever sees it
+DEFERRAL_TABLE = 'availability_deferral'
+
+
+def region_cell(lat, lng, size):
+    """(row, col) of the region containing a point; matches the triggers' SQL"""
+    return (math.floor(lat / size), math.floor(lng / size))
+
+
+def nearby_regions(lat, lng, size, rings=1):
+    """(min_row, max_row), (min_col, max_col) of the regions within `rings` cells of a point"""
+    row, col = region_cell(lat, lng, size)
+    return (row - rings, row + rings), (col - rings, col + rings)
+
+
+def _floor_sql(expression):
+    # CAST truncates towards zero, so step down for negative non-integers
+    return f'(CAST({expression} AS INTEGER) - (({expression}) < CAST({expression} AS INTEGER)))'
+
+
+def _region_sql(lat, lng, size):
+    return _floor_sql(f'{lat} / {float(size)!r}'), _floor_sql(f'{lng} / {float(size)!r}')
+
+
+def _add_sql(table, columns, select, where=None):
+    """Upsert adding stores_available/total_quantity deltas onto the existing row"""
+    keys = ', '.join(columns)
+    sql = (
+        f'INSERT INTO {table} ({keys}, stores_available, total_quantity) '
+        f'SELECT {select}'
+    )
+    # The WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+    sql += f' WHERE {where or 1}'
+    return sql + (
+        f' ON CONFLICT({keys}) DO UPDATE SET '
+        'stores_available = stores_available + excluded.stores_available, '
+        'total_quantity = total_quantity + excluded.total_quantity;'
+    )
+
+
+def _row_contribution(row, sign, size):
+    """Statements adding (sign 1) or removing (sign -1) one inventory row's counts"""
+    stores = f'{sign} * (CASE WHEN {row}.quantity > 0 THEN 1 ELSE 0 END)'
+    units = f'{sign} * (CASE WHEN {row}.quantity > 0 THEN {row}.quantity ELSE 0 END)'
+    region_row, region_col = _region_sql('store.latitude', 'store.longitude', size)
+    return [
+        _add_sql('product_availability', ['product_id'], f'{row}.product_id, {stores}, {units}'),
+        _add_sql(
+            'product_region_availability', ['product_id', 'region_row', 'region_col'],
+            f'{row}.product_id, {region_row}, {region_col}, {stores}, {units} FROM store',
+            f'store.id = {row}.store_id'
+        ),
+    ]
+
+
+def _store_move(store, sign, size):
+    """Statement adding or removing a store's in-stock products from its region"""
+    region_row, region_col = _region_sql(f'{store}.latitude', f'{store}.longitude', size)
+    return _add_sql(
+        'product_region_availability', ['product_id', 'region_row', 'region_col'],
+        f'product_id, {region_row}, {region_col}, {sign}, {sign} * quantity FROM inventory',
+        f'store_id = {store}.id AND quantity > 0'
+    )
+
+
+def batch_change(staged, size):
+    """
+    Statements adding the net change of a staged feed chunk, whose rows
+    carry the new quantity and the previous one (NULL for a new row), one
+    upsert per product and per product and region
+    """
+    change = (
+        f'SUM(({staged}.quantity > 0) - (IFNULL({staged}.previous, 0) > 0)), '
+        f'SUM(MAX({staged}.quantity, 0) - MAX(IFNULL({staged}.previous, 0), 0))'
+    )
+    changed = f'{staged}.quantity IS NOT {staged}.previous'
+    region_row, region_col = _region_sql('store.latitude', 'store.longitude', size)
+    return [
+        _add_sql(
+            'product_availability', ['product_id'],
+            f'{staged}.product_id, {change} FROM {staged}',
+            f'{changed} GROUP BY {staged}.product_id'
+        ),
+        _add_sql(
+            'product_region_availability', ['product_id', 'region_row', 'region_col'],
+            f'{staged}.product_id, {region_row}, {region_col}, {change} FROM {staged}, store',
+            f'store.id = {staged}.store_id AND {changed} '
+            f'GROUP BY {staged}.product_id, {region_row}, {region_col}'
+        ),
+    ]
+
+
+def availability_triggers(size):
+    """Trigger name -> CREATE TRIGGER statement for a region size in degrees"""
+    inventory_update = 'AFTER UPDATE OF store_id, product_id, quantity ON inventory'
+    active = f'NOT EXISTS (SELECT 1 FROM {DEFERRAL_TABLE})'
+    old_row, old_col = _region_sql('OLD.latitude', 'OLD.longitude', size)
+    new_row, new_col = _region_sql('NEW.latitude', 'NEW.longitude', size)
+    triggers = {
+        'inventory_availability_insert': ('AFTER INSERT ON inventory', f'NEW.quantity > 0 AND {active}',
+                                          _row_contribution('NEW', 1, size)),
+        'inventory_availability_delete': ('AFTER DELETE ON inventory', f'OLD.quantity > 0 AND {active}',
+                                          _row_contribution('OLD', -1, size)),
+        'inventory_availability_update_old': (inventory_update, f'OLD.quantity > 0 AND {active}',
+                                              _row_contribution('OLD', -1, size)),
+        'inventory_availability_update_new': (inventory_update, f'NEW.quantity > 0 AND {active}',
+                                              _row_contribution('NEW', 1, size)),
+        'store_availability_move': (
+            'AFTER UPDATE OF latitude, longitude ON store',
+            f'{old_row} != {new_row} OR {old_col} != {new_col}',
+            [_store_move('OLD', -1, size), _store_move('NEW', 1, size)]
+        ),
+    }
+    return {
+        name: f'CREATE TRIGGER {name} {event} FOR EACH ROW WHEN {when} BEGIN {" ".join(body)} END'
+        for name, (event, when, body) in triggers.items()
+    }
+
+
+def rebuild_statements(size):
+    """Statements recomputing both tables from inventory, for installing or changing the triggers"""
+    region_row, region_col = _region_sql('s.latitude', 's.longitude', size)
+    return [
+        'DELETE FROM product_availability',
+        'DELETE FROM product_region_availability',
+        'INSERT INTO product_availability (product_id, stores_available, total_quantity) '
+        'SELECT product_id, COUNT(*), SUM(quantity) FROM inventory WHERE quantity > 0 GROUP BY product_id',
+        'INSERT INTO product_region_availability '
+        '(product_id, region_row, region_col, stores_available, total_quantity) '
+        f'SELECT i.product_id, {region_row}, {region_col}, COUNT(*), SUM(i.quantity) '
+        'FROM inventory i JOIN store s ON s.id = i.store_id WHERE i.quantity > 0 '
+        f'GROUP BY i.product_id, {region_row}, {region_col}',
+    ]
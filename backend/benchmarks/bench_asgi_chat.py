@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Chat serving load test
+Starts the API as a real server, first the threaded Flask server and then
+the ASGI mode (asgi.py) with one and with several uvicorn workers. Each runs
+against the same throwaway database with a few thousand extra products, so
+fuzzy scoring has real work to do. Concurrent chat sessions are ramped up
+(each sends a message over a keep-alive connection, reads the reply and
+pauses for the think time). Reports throughput and p50/p99 latency per level,
+and the most sessions each server holds before p99 degrades past
+DEGRADE_FACTOR x its single-session p99 (or P99_FLOOR_MS, if higher).
+Client and server share the machine, so absolute numbers are pessimistic.
+
+Usage: python benchmarks/bench_asgi_chat.py [seconds per level [max sessions [workers [think ms]]]]
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+EXTRA_PRODUCTS = 3000
+DEGRADE_FACTOR = 3
+P99_FLOOR_MS = 20
+MESSAGES = [
+    'find fresh apples', 'I need milk and bread', 'looking for organic carrots',
+    'show nearby stores', 'where can I buy cheese', 'search for orange juice', 'help',
+]
+WORDS = ['organic', 'fresh', 'apple', 'milk', 'bread', 'cheese', 'juice', 'carrot', 'rice', 'pasta', 'tea', 'honey']
+
+
+def populate():
+    """Child process: create the schema and mock data, plus EXTRA_PRODUCTS products"""
+    from app import app, db, init_db, Product
+    rng = random.Random(0)
+    with app.app_context():
+        init_db()
+        db.session.execute(Product.__table__.insert(), [
+            {'name': f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}', 'category': 'bench', 'price': 1.0}
+            for i in range(EXTRA_PRODUCTS)
+        ])
+        db.session.commit()
+
+
+def serve_flask(port):
+    """Child process: the app's threaded development server without the reloader"""
+    from app import app
+    app.run(port=port, threaded=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+class Session:
+    """One chat session on a keep-alive HTTP/1.1 connection, reconnecting when the server closes it"""
+
+    def __init__(self, port, session_id):
+        self.port = port
+        self.session_id = session_id
+        self.reader = self.writer = None
+
+    async def chat(self, message):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        body = json.dumps({
+            'message': message, 'session_id': self.session_id, 'location': {'lat': 40.7589, 'lng': -73.9851}
+        }).encode()
+        self.writer.write(
+            b'POST /api/chat HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_level(port, sessions, seconds, think):
+    """(requests/s, p50 ms, p99 ms, errors) with `sessions` concurrent sessions"""
+    latencies = []
+    errors = 0
+    stop_at = time.perf_counter() + seconds
+
+    async def session_loop(index):
+        nonlocal errors
+        rng = random.Random(index)
+        session = Session(port, f'load-{index}')
+        await asyncio.sleep(rng.random() * think)  # don't start in lockstep
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                status = await session.chat(rng.choice(MESSAGES))
+                if status != 200:
+                    errors += 1
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors += 1
+                session.close()
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(think)
+        session.close()
+
+    await asyncio.gather(*(session_loop(i) for i in range(sessions)))
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    return len(latencies) / seconds, p50, p99, errors
+
+
+def load_test(name, command, env, seconds, max_sessions, think):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable] + command + [str(port)], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(port)
+        print(f"\n{name}")
+        print(f"{'sessions':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        baseline = None
+        fits = 0
+        sessions = 1
+        while sessions <= max_sessions:
+            rate, p50, p99, errors = asyncio.run(run_level(port, sessions, seconds, think))
+            print(f"{sessions:>9} {rate:>8,.0f} {p50:>8.1f} {p99:>8.1f} {errors:>7}")
+            if baseline is None:
+                baseline = max(p99 * DEGRADE_FACTOR, P99_FLOOR_MS)
+            if errors or p99 > baseline:
+                break
+            fits = sessions
+            sessions *= 2
+        print(f"holds {fits} concurrent sessions with p99 under {baseline:.1f} ms")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    if sys.argv[1:2] == ['--populate']:
+        populate()
+        return
+    if sys.argv[1:2] == ['--serve-flask']:
+        serve_flask(int(sys.argv[2]))
+        return
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    max_sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 2)
+    think = (float(sys.argv[4]) if len(sys.argv) > 4 else 50) / 1000
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_asgi_chat.db')}"
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--populate'], env=env, check=True)
+
+    print(f"{seconds:g}s per level, {think * 1000:g} ms think time, {EXTRA_PRODUCTS} extra products")
+    this_script = os.path.abspath(__file__)
+    load_test('flask (threaded dev server)', [this_script, '--serve-flask'], env, seconds, max_sessions, think)
+    asgi = ['asgi.py', '--workers']
+    load_test('asgi, 1 worker', asgi + ['1', '--port'], env, seconds, max_sessions, think)
+    if workers > 1:
+        load_test(f'asgi, {workers} workers', asgi + [str(workers), '--port'], env, seconds, max_sessions, think)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Product availability benchmark
+Times a listing page's availability badges three ways: one aggregate query
+per product against product_availability_view (COUNT/SUM over inventory on
+every read), one GET /api/products/availability call for the whole page
+(materialized tables), and the same call with nearby counts. Also reports
+what the triggers cost inventory writes, by timing single-row stock updates
+with the triggers installed and dropped.
+
+Usage: python benchmarks/bench_availability.py [stores [products [page size]]]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench_availability.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_FILE}'
+os.environ['CATALOG_REFRESH_INTERVAL'] = '0'
+
+import app as backend  # noqa: E402
+from app import app, db, Store, Product, Inventory  # noqa: E402
+from availability import availability_triggers  # noqa: E402
+
+PAGES = 50
+WRITES = 2000
+
+
+def populate(store_count, product_count):
+    """Reset the database with stores spread around New York, each stocking most products"""
+    rng = random.Random(0)
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Product {i}', 'category': 'bench', 'price': 1.0}
+        for i in range(product_count)
+    ])
+    db.session.execute(Store.__table__.insert(), [
+        {'name': f'Store {i}', 'address': f'{i} Bench St',
+         'latitude': 40.7 + rng.uniform(-2, 2), 'longitude': -74.0 + rng.uniform(-2, 2)}
+        for i in range(store_count)
+    ])
+    db.session.execute(Inventory.__table__.insert(), [
+        {'store_id': store_id, 'product_id': product_id, 'quantity': rng.choice((0, 5, 20, 100))}
+        for store_id in range(1, store_count + 1)
+        for product_id in range(1, product_count + 1)
+    ])
+    db.session.commit()
+    backend.migrate_schema()
+    backend.invalidate_catalog()
+
+
+def per_product_view(page):
+    with db.engine.connect() as connection:
+        for product_id in page:
+            connection.exec_driver_sql(
+                'SELECT stores_available, total_quantity FROM product_availability_view WHERE product_id = ?',
+                (product_id,)
+            ).one()
+
+
+def timed(pages, fn):
+    """Mean milliseconds per page"""
+    start = time.perf_counter()
+    for page in pages:
+        fn(page)
+    return (time.perf_counter() - start) / len(pages) * 1000
+
+
+def write_rate(store_count, product_count):
+    """Single-row stock updates per second, one transaction each"""
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(WRITES):
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'UPDATE inventory SET quantity = ?, last_updated = CURRENT_TIMESTAMP WHERE store_id = ? AND product_id = ?',
+                (rng.randint(0, 50), rng.randint(1, store_count), rng.randint(1, product_count))
+            )
+    return WRITES / (time.perf_counter() - start)
+
+
+def main():
+    store_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    product_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    page_size = int(sys.argv[3]) if len(sys.argv) > 3 else 48
+
+    rng = random.Random(2)
+    pages = [rng.sample(range(1, product_count + 1), page_size) for _ in range(PAGES)]
+    client = app.test_client()
+
+    with app.app_context():
+        populate(store_count, product_count)
+        print(f"{store_count} stores x {product_count} products, {page_size} products per page")
+
+        backend.get_catalog()  # load the catalog outside the measurement
+        view_ms = timed(pages, per_product_view)
+        batch_ms = timed(pages, lambda page: client.get(
+            '/api/products/availability?ids=' + ','.join(map(str, page))
+        ).get_json())
+        nearby_ms = timed(pages, lambda page: client.get(
+            '/api/products/availability?lat=40.75&lng=-73.98&ids=' + ','.join(map(str, page))
+        ).get_json())
+        print(f"{'view, one query per product':>32} {view_ms:>8.2f} ms/page")
+        print(f"{'availability endpoint':>32} {batch_ms:>8.2f} ms/page")
+        print(f"{'availability endpoint + nearby':>32} {nearby_ms:>8.2f} ms/page")
+
+        with_triggers = write_rate(store_count, product_count)
+        with db.engine.begin() as connection:
+            for name in availability_triggers(app.config['AVAILABILITY_REGION_SIZE']):
+                connection.exec_driver_sql(f'DROP TRIGGER {name}')
+        without_triggers = write_rate(store_count, product_count)
+        print(f"\nstock updates/s: {with_triggers:,.0f} with triggers, {without_triggers:,.0f} without")
+
+
+if __name__ == '__main__':
+    main()
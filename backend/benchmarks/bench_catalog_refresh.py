@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Catalog store reload benchmark
+Builds a Catalog over in-memory inventories of growing size and times
+reloading one store's inventory (invalidate_stores() then snapshot(), what
+a reservation or stock update triggers) against indexing the whole
+inventory from scratch. Every store stocks STORE_PRODUCTS products and
+every product is stocked by about FANOUT stores, so the inventory grows
+with the store count while a store reload, which only touches that store's
+rows and its products' store lists, should stay flat.
+
+Usage: python benchmarks/bench_catalog_refresh.py [stores...]
+"""
+
+import gc
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from catalog import Catalog, CatalogSnapshot  # noqa: E402
+
+STORE_PRODUCTS = 1000  # products per store
+FANOUT = 100           # stores per product, on average
+RELOADS = 20
+
+
+def make_inventory(store_count, rng):
+    """{store_id: [(store_id, product_id, quantity)]}, STORE_PRODUCTS random products per store"""
+    product_count = max(STORE_PRODUCTS, store_count * STORE_PRODUCTS // FANOUT)
+    return {
+        store_id: [
+            (store_id, product_id, rng.choice((0, 5, 20, 100)))
+            for product_id in sorted(rng.sample(range(1, product_count + 1), STORE_PRODUCTS))
+        ]
+        for store_id in range(1, store_count + 1)
+    }
+
+
+def main():
+    store_counts = [int(arg) for arg in sys.argv[1:]] or [50, 200, 800, 2000]
+    rng = random.Random(0)
+
+    print(f"{'stores':>7} {'rows':>9} {'full index ms':>14} {'store reload ms':>16} {'p95 ms':>8}")
+    for store_count in store_counts:
+        inventory = make_inventory(store_count, rng)
+
+        def loader(parts):
+            rows = tuple(row for store_id in sorted(inventory) for row in inventory[store_id])
+            return {part: rows if part == 'inventory' else () for part in parts}
+
+        def store_loader(store_ids):
+            return [row for store_id in sorted(store_ids) for row in inventory[store_id]]
+
+        catalog = Catalog(loader, refresh_interval=0, store_loader=store_loader)
+        snapshot = catalog.snapshot()
+        # Don't bill the first full collection of the freshly loaded inventory to a reload
+        gc.collect()
+
+        start = time.perf_counter()
+        CatalogSnapshot(0, (), (), snapshot.inventory)
+        full_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for _ in range(RELOADS):
+            store_id = rng.randint(1, store_count)
+            inventory[store_id] = [(s, p, q + 1) for s, p, q in inventory[store_id]]
+            catalog.invalidate_stores({store_id})
+            start = time.perf_counter()
+            reloaded = catalog.snapshot()
+            timings.append((time.perf_counter() - start) * 1000)
+            assert reloaded.version > snapshot.version
+            snapshot = reloaded
+
+        # Sanity check: the patched lookups match indexing from scratch
+        expected = CatalogSnapshot(0, (), (), snapshot.inventory)
+        assert dict(snapshot.stock) == dict(expected.stock)
+        assert dict(snapshot.product_stores) == dict(expected.product_stores)
+
+        timings.sort()
+        print(f"{store_count:>7} {len(snapshot.inventory):>9} {full_ms:>14.1f} {timings[len(timings) // 2]:>16.2f} "
+              f"{timings[int(len(timings) * 0.95)]:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Distance ranking micro-benchmark
+Compares the scalar calculate_distance loop plus a full list sort against
+one batch_distance call plus argpartition for picking the nearest stores.
+
+Usage: python benchmarks/bench_distance.py [store counts...]
+"""
+
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np  # noqa: E402
+
+from geo import calculate_distance, batch_distance, smallest_k, StoreGridIndex  # noqa: E402
+
+TOP_K = 5
+ORIGIN = (40.7589, -73.9851)
+
+
+def scalar_top_k(stores, k):
+    """The per-store loop the handlers used to run"""
+    ranked = []
+    for store_id, lat, lng in stores:
+        ranked.append((calculate_distance(ORIGIN[0], ORIGIN[1], lat, lng), store_id))
+    ranked.sort()
+    return ranked[:k]
+
+
+def batch_top_k(ids, lats, lngs, k):
+    """One vectorized distance pass over packed arrays, then argpartition"""
+    distances = batch_distance(ORIGIN[0], ORIGIN[1], lats, lngs)
+    order = smallest_k(distances, k)
+    return list(zip(distances[order].tolist(), ids[order].tolist()))
+
+
+def timed(func, *args, repeats):
+    """Best-of-N wall time of func(*args) in milliseconds"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    store_counts = [int(arg) for arg in sys.argv[1:]] or [10, 1000, 100000]
+    rng = random.Random(42)
+
+    print(f"{'stores':>8} {'scalar ms':>10} {'batch ms':>10} {'cached ms':>10} {'speedup':>8}")
+    for store_count in store_counts:
+        stores = [(i, rng.uniform(25, 49), rng.uniform(-124, -67)) for i in range(store_count)]
+        ids = np.array([s[0] for s in stores], dtype=np.int64)
+        lats = np.array([s[1] for s in stores])
+        lngs = np.array([s[2] for s in stores])
+
+        grid = StoreGridIndex()
+        grid.build(stores)
+
+        # Sanity check: every path picks the same stores (grid.rank uses the
+        # cached, pre-converted coordinate arrays)
+        expected = [store_id for _, store_id in scalar_top_k(stores, TOP_K)]
+        assert [store_id for _, store_id in batch_top_k(ids, lats, lngs, TOP_K)] == expected
+        assert [store_id for store_id, _ in grid.rank(ORIGIN[0], ORIGIN[1], TOP_K)] == expected
+
+        repeats = 3 if store_count >= 100000 else 20
+        scalar_ms = timed(scalar_top_k, stores, TOP_K, repeats=repeats)
+        batch_ms = timed(batch_top_k, ids, lats, lngs, TOP_K, repeats=repeats)
+        cached_ms = timed(grid.rank, ORIGIN[0], ORIGIN[1], TOP_K, repeats=repeats)
+
+        print(f"{store_count:>8} {scalar_ms:>10.3f} {batch_ms:>10.3f} {cached_ms:>10.3f} {scalar_ms / batch_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Intent routing benchmark
+Measures messages/sec through the compiled IntentRouter as the number of
+registered intents grows, next to the chained any(keyword in message) scans
+process_chat_message used to run.
+
+Usage: python benchmarks/bench_intent_router.py [extra intent counts...]
+"""
+
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from intent_router import IntentRouter  # noqa: E402
+
+BASE_INTENTS = [
+    ('product_search', ['find', 'search', 'looking for', 'need', 'want'], 30),
+    ('store_locations', ['store', 'shop', 'location', 'nearby', 'near me', 'directions'], 20),
+    ('help', ['help', 'what can you do', 'how', 'assist'], 10),
+]
+
+MESSAGES = [
+    "find apples",
+    "I'm looking for some fresh dairy products",
+    "show nearby stores",
+    "where can I buy milk near me",
+    "help me please",
+    "what can you do",
+    "hello there",
+    "do you sell organic bananas and whole wheat bread in the brooklyn area",
+]
+
+DURATION = 1.0  # seconds per measurement
+
+
+def synthetic_intents(count, rng):
+    """Extra intents with made-up keywords that never match the sample messages"""
+    letters = 'bcdfghjklmnpqrstvwxz'
+    intents = []
+    for i in range(count):
+        keywords = [''.join(rng.choice(letters) for _ in range(rng.randint(5, 9))) for _ in range(5)]
+        intents.append((f'intent_{i}', keywords, -i))
+    return intents
+
+
+def build_router(intents):
+    router = IntentRouter(default_handler=lambda parsed: None)
+    for name, keywords, priority in intents:
+        router.register(name, keywords, lambda parsed: None, priority)
+    router.parse('')  # compile outside the timed loop
+    return router
+
+
+def legacy_match(intents, message):
+    """Check intents in priority order with substring scans, as before"""
+    message_lower = message.lower()
+    for name, keywords, _ in intents:
+        if any(keyword in message_lower for keyword in keywords):
+            return name
+    return None
+
+
+def throughput(func):
+    """Messages routed per second over DURATION seconds"""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for message in MESSAGES:
+            func(message)
+        count += len(MESSAGES)
+        elapsed = time.perf_counter() - start
+        if elapsed >= DURATION:
+            return count / elapsed
+
+
+def main():
+    extra_counts = [int(arg) for arg in sys.argv[1:]] or [0, 10, 100, 1000]
+    rng = random.Random(7)
+
+    print(f"{'intents':>8} {'keywords':>9} {'legacy msg/s':>13} {'router msg/s':>13}")
+    for extra in extra_counts:
+        intents = BASE_INTENTS + synthetic_intents(extra, rng)
+        ordered = sorted(intents, key=lambda intent: intent[2], reverse=True)
+        router = build_router(intents)
+
+        # Both must agree before we compare speed
+        for message in MESSAGES:
+            intent, _ = router.match(message)
+            assert (intent.name if intent else None) == legacy_match(ordered, message), message
+
+        legacy = throughput(lambda message: legacy_match(ordered, message))
+        routed = throughput(router.route)
+        keyword_count = sum(len(keywords) for _, keywords, _ in intents)
+        print(f"{len(intents):>8} {keyword_count:>9} {legacy:>13,.0f} {routed:>13,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Inventory feed ingestion benchmark
+Writes CSV stock feeds of growing size to disk and streams them through
+import_inventory_feed twice (fresh inserts, then updates of every row),
+reporting rows/sec. A third, traced pass reports the peak memory allocated
+while ingesting (the catalog snapshot, which holds every inventory row by
+design, is loaded beforehand). For comparison, the first size is also
+loaded one db.session.add() at a time, as init_db does.
+
+Usage: python benchmarks/bench_inventory_feed.py [row counts...]
+"""
+
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TEMP_DIR = tempfile.mkdtemp()
+DB_FILE = os.path.join(TEMP_DIR, 'bench_inventory_feed.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_FILE}'
+
+import app as backend  # noqa: E402
+from app import app, db, Store, Product, Inventory  # noqa: E402
+
+PRODUCT_COUNT = 5000
+LEGACY_ROWS = 20000
+
+
+def populate(store_count):
+    """Reset the database with store_count stores, PRODUCT_COUNT products and no inventory"""
+    # The full migrated schema, so writes pay for the indexes and the
+    # availability triggers as they do in production
+    db.drop_all()
+    backend.migrate_schema()
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Product {i}', 'category': 'bench', 'price': 1.0}
+        for i in range(PRODUCT_COUNT)
+    ])
+    db.session.execute(Store.__table__.insert(), [
+        {'name': f'Store {i}', 'address': f'{i} Bench St', 'latitude': 40.7, 'longitude': -74.0}
+        for i in range(store_count)
+    ])
+    db.session.commit()
+    backend.invalidate_catalog()
+
+
+def write_feed(path, row_count, seed):
+    """Write a CSV feed covering row_count distinct (store, product) pairs"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['store_id', 'product_id', 'quantity'])
+        for i in range(row_count):
+            writer.writerow([i // PRODUCT_COUNT + 1, i % PRODUCT_COUNT + 1, rng.randint(0, 500)])
+
+
+def import_feed(path):
+    backend.get_catalog()  # reload the catalog outside the measurement
+    with open(path, newline='') as lines:
+        return backend.import_inventory_feed(lines, 'csv')
+
+
+def traced_peak_mb(path):
+    """Peak memory allocated while importing path, in MB"""
+    backend.get_catalog()
+    tracemalloc.start()
+    try:
+        import_feed(path)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def legacy_load(path):
+    """Add Inventory rows through the ORM one at a time, committing once"""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for store_id, product_id, quantity in reader:
+            db.session.add(Inventory(store_id=int(store_id), product_id=int(product_id), quantity=int(quantity)))
+    db.session.commit()
+
+
+def main():
+    row_counts = [int(arg) for arg in sys.argv[1:]] or [100000, 500000, 2000000]
+
+    print(f"{'rows':>9} {'feed MB':>8} {'insert rows/s':>14} {'update rows/s':>14} {'ingest peak MB':>15}")
+    with app.app_context():
+        legacy_rows = min(LEGACY_ROWS, row_counts[0])
+        populate(legacy_rows // PRODUCT_COUNT + 1)
+        path = os.path.join(TEMP_DIR, 'legacy.csv')
+        write_feed(path, legacy_rows, 0)
+        start = time.perf_counter()
+        legacy_load(path)
+        legacy_rate = legacy_rows / (time.perf_counter() - start)
+
+        for row_count in row_counts:
+            populate(row_count // PRODUCT_COUNT + 1)
+            path = os.path.join(TEMP_DIR, f'feed_{row_count}.csv')
+            write_feed(path, row_count, 1)
+            feed_mb = os.path.getsize(path) / 2 ** 20
+
+            rates = []
+            for seed in (1, 2):
+                if seed == 2:
+                    write_feed(path, row_count, seed)
+                result = import_feed(path)
+                assert result['applied'] == row_count, result
+                rates.append(result['rows_per_sec'])
+            assert db.session.query(Inventory).count() == row_count
+            peak = traced_peak_mb(path)
+            print(f"{row_count:>9} {feed_mb:>8.1f} {rates[0]:>14,} {rates[1]:>14,} {peak:>15.1f}")
+            os.remove(path)
+
+    print(f"\nORM add() per row, {legacy_rows} rows: {legacy_rate:,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
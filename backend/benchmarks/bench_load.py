@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark
+Drives a weighted mix of API calls (chat, product search, store lookup,
+inventory, checkout) from concurrent client threads for a fixed time per
+concurrency level. By default the app runs in-process through the Flask test
+client against a throwaway database holding the mock data plus synthetic
+stores, products and inventory; --url points it at a running server instead
+(python app.py, or asgi.py with several workers). Reports req/s and
+p50/p95/p99 latency per operation, saves the run as JSON, and compares it
+with a stored baseline, exiting non-zero when something regressed.
+
+Usage:
+  python benchmarks/bench_load.py --mix mixed --concurrency 1,4,16 --duration 10 --output run.json
+  python benchmarks/bench_load.py --baseline baseline.json          # flag regressions
+  python benchmarks/bench_load.py --output baseline.json            # record a new baseline
+  python benchmarks/bench_load.py --url http://localhost:5000 --mix chat=3,search=1
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+PERCENTILES = (50, 95, 99)
+CHAT_MESSAGES = [
+    'find fresh apples', 'I need milk and bread', 'looking for organic carrots', 'show nearby stores',
+    'where can I buy cheese', 'search for orange juice', 'help', 'do you have greek yogurt',
+]
+SEARCH_TERMS = ['apple', 'milk', 'bread', 'cheese', 'juice', 'carrot', 'organic', 'fresh', 'yogurt', 'chips']
+
+# Weights of each operation in the named mixes
+MIXES = {
+    'browse': {'search': 4, 'stores': 2, 'inventory': 4},
+    'chat': {'chat': 1},
+    'checkout': {'inventory': 3, 'checkout': 1},
+    'mixed': {'chat': 3, 'search': 3, 'stores': 1, 'inventory': 2, 'checkout': 1},
+}
+
+
+class Dataset:
+    """Store and product ids (and where the stores are) that requests are drawn from"""
+
+    def __init__(self, stores, product_ids):
+        self.store_ids = [store['id'] for store in stores]
+        self.product_ids = product_ids
+        self.locations = [(store['latitude'], store['longitude']) for store in stores]
+
+    def location(self, rng):
+        lat, lng = rng.choice(self.locations)
+        return {'lat': round(lat + rng.uniform(-0.05, 0.05), 6), 'lng': round(lng + rng.uniform(-0.05, 0.05), 6)}
+
+
+# Each operation returns (method, path, JSON body, statuses that count as success)
+
+def chat_request(rng, data):
+    body = {'message': rng.choice(CHAT_MESSAGES), 'session_id': f'load-{rng.randrange(1000)}',
+            'location': data.location(rng)}
+    return 'POST', '/api/chat', body, (200,)
+
+
+def search_request(rng, data):
+    return 'GET', f'/api/products?search={quote(rng.choice(SEARCH_TERMS))}', None, (200,)
+
+
+def stores_request(rng, data):
+    location = data.location(rng)
+    return 'GET', f"/api/stores?lat={location['lat']}&lng={location['lng']}&limit=10", None, (200,)
+
+
+def inventory_request(rng, data):
+    return 'GET', f'/api/inventory/{rng.choice(data.store_ids)}?limit=50', None, (200,)
+
+
+def checkout_request(rng, data):
+    store_id = rng.choice(data.store_ids)
+    items = [
+        {'store_id': store_id, 'product_id': product_id, 'quantity': 1}
+        for product_id in rng.sample(data.product_ids, min(len(data.product_ids), rng.randint(1, 3)))
+    ]
+    # Out of stock (409) is a normal checkout outcome, not a failure
+    return 'POST', '/api/orders', {'session_id': f'load-{rng.randrange(1000)}', 'items': items}, (201, 409)
+
+
+OPERATIONS = {
+    'chat': chat_request,
+    'search': search_request,
+    'stores': stores_request,
+    'inventory': inventory_request,
+    'checkout': checkout_request,
+}
+
+
+def parse_mix(value):
+    """A named mix, or weights like 'chat=3,search=1'"""
+    if value in MIXES:
+        return dict(MIXES[value])
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}; choose from {", ".join(OPERATIONS)}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class InProcessTarget:
+    """Calls the app through the Flask test client, one client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.name = 'in-process'
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HTTPTarget:
+    """Calls a running server over keep-alive connections, one per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        if self.prefix.endswith('/api'):
+            self.prefix = self.prefix[:-len('/api')]
+        self.name = url
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+def populate(stores, products, seed=0):
+    """Mock data plus synthetic stores around New York, each stocking most products"""
+    from app import app, db, init_db, invalidate_catalog
+    from datagen import generate_dataset
+    with app.app_context():
+        init_db()
+        with db.engine.begin() as connection:
+            generate_dataset(connection, products=products, stores=stores, density=0.8, regions='nyc', seed=seed)
+        invalidate_catalog()
+    return app
+
+
+def discover(target):
+    """Read the store and product ids the target serves"""
+    status, body = target.request('GET', '/api/stores')
+    if status != 200:
+        raise RuntimeError(f'GET /api/stores returned {status}')
+    stores = json.loads(body)
+    status, body = target.request('GET', '/api/products')
+    if status != 200:
+        raise RuntimeError(f'GET /api/products returned {status}')
+    product_ids = [product['id'] for product in json.loads(body)]
+    if not stores or not product_ids:
+        raise RuntimeError('the target has no stores or no products')
+    return Dataset(stores, product_ids)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / seconds, 2),
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = round(percentile(latencies, p) * 1000, 3)
+    summary['max_ms'] = round(latencies[-1] * 1000, 3) if latencies else 0.0
+    return summary
+
+
+def run_level(target, data, weights, concurrency, duration, seed):
+    """Per-operation and overall summaries for `concurrency` threads over `duration` seconds"""
+    names = list(weights)
+    name_weights = [weights[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(concurrency + 1)
+    stop_at = [0.0]
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        local_samples = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        start_gate.wait()
+        while time.perf_counter() < stop_at[0]:
+            name = rng.choices(names, name_weights)[0]
+            method, path, body, ok = OPERATIONS[name](rng, data)
+            start = time.perf_counter()
+            try:
+                status, _ = target.request(method, path, body)
+            except Exception:
+                status = None
+            local_samples[name].append(time.perf_counter() - start)
+            if status not in ok:
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local_samples[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    stop_at[0] = time.perf_counter() + duration
+    start_gate.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = {'all': summarize([x for name in names for x in samples[name]], sum(errors.values()), elapsed)}
+    for name in names:
+        results[name] = summarize(samples[name], errors[name], elapsed)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_level(concurrency, results):
+    print(f"\nconcurrency {concurrency}")
+    print(f"{'operation':>10} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, stats in results.items():
+        print(f"{name:>10} {stats['requests']:>9} {stats['rps']:>9,.1f} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['errors']:>7}")
+
+
+def compare(run, baseline, tolerance, min_delta_ms):
+    """Regressions of run against baseline: slower p95/p99, lower req/s, or new errors"""
+    regressions = []
+    for level, operations in run['results'].items():
+        for name, stats in operations.items():
+            base = baseline.get('results', {}).get(level, {}).get(name)
+            if base is None:
+                continue
+            for key in ('p95_ms', 'p99_ms'):
+                if stats[key] > base[key] * (1 + tolerance) and stats[key] - base[key] > min_delta_ms:
+                    regressions.append(f"concurrency {level} {name}: {key} {base[key]:.2f} -> {stats[key]:.2f}")
+            if stats['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append(f"concurrency {level} {name}: req/s {base['rps']:,.1f} -> {stats['rps']:,.1f}")
+            if stats['errors'] > base['errors']:
+                regressions.append(f"concurrency {level} {name}: errors {base['errors']} -> {stats['errors']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for the FreshMart API')
+    parser.add_argument('--url', help='benchmark a running server (e.g. http://localhost:5000) instead of in-process')
+    parser.add_argument('--mix', type=parse_mix, default='mixed',
+                        help=f'{", ".join(MIXES)}, or weights like chat=3,search=1 (default: mixed)')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated client thread counts')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--stores', type=int, default=50, help='synthetic stores (in-process only)')
+    parser.add_argument('--products', type=int, default=2000, help='synthetic products (in-process only)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the run as JSON')
+    parser.add_argument('--baseline', help='JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative change before flagging a regression (default: 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='latency increases below this are never regressions (default: 1)')
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return args
+
+
+def run(args):
+    """Run the benchmark described by parsed arguments and return the results document"""
+    if args.url:
+        target = HTTPTarget(args.url)
+    else:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_load.db')}"
+        os.environ.setdefault('CATALOG_REFRESH_INTERVAL', '0')
+        target = InProcessTarget(populate(args.stores, args.products, args.seed))
+
+    data = discover(target)
+    print(f"{target.name}: {len(data.store_ids)} stores, {len(data.product_ids)} products, "
+          f"mix {', '.join(f'{name}={weight:g}' for name, weight in args.mix.items())}")
+    if args.warmup > 0:
+        run_level(target, data, args.mix, max(args.concurrency), args.warmup, args.seed + 1)
+
+    document = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'target': target.name,
+            'mix': args.mix,
+            'duration': args.duration,
+            'stores': len(data.store_ids),
+            'products': len(data.product_ids),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'results': {},
+    }
+    for concurrency in args.concurrency:
+        results = run_level(target, data, args.mix, concurrency, args.duration, args.seed)
+        document['results'][str(concurrency)] = results
+        print_level(concurrency, results)
+    return document
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    document = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"\nsaved {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(document, baseline, args.tolerance, args.min_delta_ms)
+        for key in ('target', 'mix', 'stores', 'products'):
+            if baseline['meta'].get(key) != document['meta'][key]:
+                print(f"\nwarning: baseline {key} was {baseline['meta'].get(key)}, this run {document['meta'][key]}")
+        print(f"\ncompared with {args.baseline} ({baseline['meta'].get('git_commit') or 'unknown commit'}), "
+              f"tolerance {args.tolerance:.0%}")
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("  no regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Reservation contention benchmark
+Runs many concurrent checkouts against a handful of hot SKUs, once through a
+read-modify-write on ORM objects (what a naive checkout would do) and once
+through POST /api/inventory/reserve, and reports throughput and oversell.
+Oversold units are units handed out beyond the stock that existed; the
+reserve endpoint must always report zero.
+
+Usage: python benchmarks/bench_reservations.py [workers [checkouts]]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench_reservations.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_FILE}'
+
+import app as backend  # noqa: E402
+from app import app, db, Store, Product, Inventory  # noqa: E402
+
+STORE_COUNT = 2
+HOT_PRODUCTS = 5
+STOCK = 200        # units per (store, product)
+MAX_LINES = 3      # lines per checkout
+MAX_QUANTITY = 2   # units per line
+
+
+def populate():
+    """Reset the database with a few stores and hot products at STOCK units each"""
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Hot product {i}', 'category': 'bench', 'price': 1.0}
+        for i in range(HOT_PRODUCTS)
+    ])
+    db.session.execute(Store.__table__.insert(), [
+        {'name': f'Store {i}', 'address': f'{i} Bench St', 'latitude': 40.7, 'longitude': -74.0}
+        for i in range(STORE_COUNT)
+    ])
+    db.session.execute(Inventory.__table__.insert(), [
+        {'store_id': store_id, 'product_id': product_id, 'quantity': STOCK}
+        for store_id in range(1, STORE_COUNT + 1)
+        for product_id in range(1, HOT_PRODUCTS + 1)
+    ])
+    db.session.commit()
+    backend.invalidate_catalog()
+
+
+def make_checkouts(count):
+    rng = random.Random(count)
+    checkouts = []
+    for _ in range(count):
+        lines = {}
+        for _ in range(rng.randint(1, MAX_LINES)):
+            key = (rng.randint(1, STORE_COUNT), rng.randint(1, HOT_PRODUCTS))
+            lines[key] = rng.randint(1, MAX_QUANTITY)
+        checkouts.append([
+            {'store_id': store_id, 'product_id': product_id, 'quantity': quantity}
+            for (store_id, product_id), quantity in lines.items()
+        ])
+    return checkouts
+
+
+def naive_checkout(items):
+    """Check stock, then write back quantity - n through the ORM"""
+    try:
+        for item in items:
+            row = Inventory.query.filter_by(store_id=item['store_id'], product_id=item['product_id']).first()
+            if row.quantity < item['quantity']:
+                db.session.rollback()
+                return 'rejected'
+            row.quantity = row.quantity - item['quantity']
+        db.session.commit()
+        return 'ok'
+    except Exception:
+        db.session.rollback()
+        return 'error'
+
+
+def endpoint_checkout(client, items):
+    response = client.post('/api/inventory/reserve', json={'items': items, 'session_id': 'bench'})
+    return {201: 'ok', 409: 'rejected'}.get(response.status_code, 'error')
+
+
+def run(checkouts, workers, use_endpoint):
+    """Return (elapsed seconds, outcome counts, units sold per SKU) for one run"""
+    with app.app_context():
+        populate()
+    queue = list(enumerate(checkouts))
+    queue_lock = threading.Lock()
+    counts = {'ok': 0, 'rejected': 0, 'error': 0}
+    sold = {}
+    results_lock = threading.Lock()
+    start_gate = threading.Barrier(workers + 1)
+
+    def worker():
+        client = app.test_client()
+        with app.app_context():
+            start_gate.wait()
+            while True:
+                with queue_lock:
+                    if not queue:
+                        return
+                    _, items = queue.pop()
+                outcome = endpoint_checkout(client, items) if use_endpoint else naive_checkout(items)
+                with results_lock:
+                    counts[outcome] += 1
+                    if outcome == 'ok':
+                        for item in items:
+                            key = (item['store_id'], item['product_id'])
+                            sold[key] = sold.get(key, 0) + item['quantity']
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, counts, sold
+
+
+def report(name, checkouts, workers, use_endpoint):
+    elapsed, counts, sold = run(checkouts, workers, use_endpoint)
+    with app.app_context():
+        remaining = {
+            (row.store_id, row.product_id): row.quantity
+            for row in db.session.query(Inventory.store_id, Inventory.product_id, Inventory.quantity)
+        }
+    units_sold = sum(sold.values())
+    oversold = sum(max(0, units - STOCK) for units in sold.values())
+    # Units handed out that never left the stock count (lost updates)
+    lost = sum(units - (STOCK - remaining[key]) for key, units in sold.items())
+    oversell_rate = oversold / units_sold if units_sold else 0.0
+    print(
+        f"{name:>10} {len(checkouts) / elapsed:>12,.0f} {counts['ok']:>6} {counts['rejected']:>9} "
+        f"{counts['error']:>7} {units_sold:>6} {oversold:>9} {lost:>6} {oversell_rate:>9.2%}"
+    )
+    return oversold
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    checkouts = make_checkouts(count)
+    capacity = STORE_COUNT * HOT_PRODUCTS * STOCK
+    print(f"{workers} workers, {count} checkouts, {capacity} units of stock on {STORE_COUNT * HOT_PRODUCTS} SKUs")
+    print(
+        f"{'':>10} {'checkouts/s':>12} {'ok':>6} {'rejected':>9} {'errors':>7} "
+        f"{'sold':>6} {'oversold':>9} {'lost':>6} {'oversell':>9}"
+    )
+    report('naive ORM', checkouts, workers, use_endpoint=False)
+    oversold = report('reserve', checkouts, workers, use_endpoint=True)
+    if oversold:
+        sys.exit('reserve endpoint oversold stock')
+
+
+if __name__ == '__main__':
+    main()
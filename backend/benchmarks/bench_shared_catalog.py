@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Shared catalog memory benchmark
+Starts the ASGI server with several workers twice against the same
+throwaway database with a large inventory: once with a catalog per worker
+(--catalog local) and once with the supervisor publishing one shared-memory
+image (--catalog shared). Every worker is warmed until it has loaded the
+catalog, then the proportional set size (PSS, shared pages split between
+the processes mapping them) of the server's processes is summed from
+/proc/<pid>/smaps_rollup. Also reports how long a bulk stock update takes to
+show up in reads.
+
+Linux only. Usage: python benchmarks/bench_shared_catalog.py [workers [stores [products]]]
+"""
+
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_asgi_chat import BACKEND_DIR, free_port, wait_until_up
+
+WARM_REQUESTS = 200
+PROPAGATION_TIMEOUT = 30  # seconds; a per-worker catalog only catches up on its periodic refresh
+
+
+def populate(store_count, product_count):
+    """Child process: stores spread around New York, each stocking most products"""
+    from app import app, db, init_db, Store, Product, Inventory
+    rng = random.Random(0)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Product.__table__.insert(), [
+            {'name': f'Product {i}', 'category': 'bench', 'price': 1.0}
+            for i in range(product_count)
+        ])
+        db.session.execute(Store.__table__.insert(), [
+            {'name': f'Store {i}', 'address': f'{i} Bench St',
+             'latitude': 40.7 + rng.uniform(-2, 2), 'longitude': -74.0 + rng.uniform(-2, 2)}
+            for i in range(store_count)
+        ])
+        db.session.execute(Inventory.__table__.insert(), [
+            {'store_id': store_id, 'product_id': product_id, 'quantity': rng.choice((0, 5, 20, 100))}
+            for store_id in range(1, store_count + 1)
+            for product_id in range(1, product_count + 1)
+            if rng.random() < 0.9
+        ])
+        db.session.commit()
+        init_db()
+
+
+def request(port, method, path, body=None, content_type='application/json'):
+    # A new connection each time, so requests spread over the workers
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request(method, path, body=body, headers={'Connection': 'close', 'Content-Type': content_type})
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, data
+
+
+def process_tree(pid):
+    """pid and all of its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except OSError:
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, ()))
+    return tree
+
+
+def memory_kb(pid, field):
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(mode, workers, env):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'asgi.py', '--workers', str(workers), '--catalog', mode, '--port', str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(port, timeout=120)
+        start = time.perf_counter()
+        for i in range(WARM_REQUESTS):
+            request(port, 'GET', f'/api/inventory/{i % 10 + 1}?limit=5')
+            request(port, 'POST', '/api/chat', json.dumps({'message': 'find product 12'}))
+        warm = time.perf_counter() - start
+
+        pids = process_tree(server.pid)
+        pss = sum(memory_kb(pid, 'Pss') for pid in pids) / 1024
+        rss = sum(memory_kb(pid, 'Rss') for pid in pids) / 1024
+
+        # Bulk update through one worker, then poll until reads reflect it
+        quantity = random.randint(1000, 9999)
+        feed = 'store_id,product_id,quantity\n' + ''.join(f'1,{p},{quantity}\n' for p in range(1, 51))
+        status, _ = request(port, 'POST', '/api/inventory/bulk', feed, 'text/csv')
+        assert status == 200, status
+        # Every read must see it, whichever worker serves it
+        start = time.perf_counter()
+        fresh = 0
+        while fresh < workers * 4 and time.perf_counter() - start < PROPAGATION_TIMEOUT:
+            if f'"quantity":{quantity}'.encode() in request(port, 'GET', '/api/inventory/1?limit=1')[1]:
+                fresh += 1
+            else:
+                fresh = 0
+                time.sleep(0.005)
+        propagation = (time.perf_counter() - start) * 1000
+        propagation = f'{propagation:.1f}' if fresh else f'>{PROPAGATION_TIMEOUT * 1000}'
+
+        print(f"{mode:>7} {len(pids):>6} {pss:>10,.0f} {rss:>10,.0f} {warm:>9.1f} {propagation:>15}", flush=True)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    if sys.argv[1:2] == ['--populate']:
+        populate(int(sys.argv[2]), int(sys.argv[3]))
+        return
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    store_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    product_count = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_shared_catalog.db')}"
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--populate', str(store_count), str(product_count)],
+        env=env, check=True
+    )
+
+    print(f"{workers} workers, {store_count} stores x {product_count} products")
+    print(f"{'catalog':>7} {'procs':>6} {'PSS MB':>10} {'RSS MB':>10} {'warm s':>9} {'propagation ms':>15}")
+    measure('local', workers, env)
+    measure('shared', workers, env)
+
+
+if __name__ == '__main__':
+    main()
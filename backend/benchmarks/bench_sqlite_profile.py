@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+SQLite storage profile benchmark
+Runs a mixed load of catalog inventory reads and chat-log batch writes from
+concurrent threads for a fixed time, once with SQLite's defaults (rollback
+journal, synchronous=FULL, reads through the writer's pool) and once with
+the configured profile (WAL, synchronous=NORMAL, cache/mmap, read pool).
+Each profile runs in a fresh process, because the app reads its storage
+config at import time.
+
+Usage: python benchmarks/bench_sqlite_profile.py [readers [writers [seconds]]]
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+PRODUCT_COUNT = 2000
+STORE_COUNT = 50
+CHAT_BATCH = 10
+
+PROFILES = [
+    ('defaults', {
+        'SQLITE_JOURNAL_MODE': '',
+        'SQLITE_SYNCHRONOUS': '',
+        'SQLITE_BUSY_TIMEOUT': '',
+        'SQLITE_CACHE_SIZE': '',
+        'SQLITE_MMAP_SIZE': '',
+        'SQLITE_READ_POOL_SIZE': '0',
+    }),
+    ('tuned', {}),  # the app's default profile
+]
+
+
+def run_load(readers, writers, seconds):
+    """Child process: populate a fresh database and run the mixed load"""
+    # Imported here so the parent process never reads the storage config
+    import app as backend
+    from app import app, db, Store, Product, Inventory
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Product.__table__.insert(), [
+            {'name': f'Product {i}', 'category': 'bench', 'price': 1.0}
+            for i in range(PRODUCT_COUNT)
+        ])
+        db.session.execute(Store.__table__.insert(), [
+            {'name': f'Store {i}', 'address': f'{i} Bench St', 'latitude': 40.7, 'longitude': -74.0}
+            for i in range(STORE_COUNT)
+        ])
+        db.session.execute(Inventory.__table__.insert(), [
+            {'store_id': store_id, 'product_id': product_id, 'quantity': 10}
+            for store_id in range(1, STORE_COUNT + 1)
+            for product_id in range(1, PRODUCT_COUNT + 1)
+        ])
+        db.session.commit()
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    read_latencies = []
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                backend.load_store_inventory({rng.randint(1, STORE_COUNT)})
+                outcome = 'reads'
+            except Exception:
+                outcome = 'errors'
+            elapsed = time.perf_counter() - start
+            with lock:
+                counts[outcome] += 1
+                read_latencies.append(elapsed)
+
+    def writer(seed):
+        while not stop.is_set():
+            rows = [
+                backend.make_chat_row(f'bench-{seed}', 'find milk', {'type': 'text', 'message': 'ok'})
+                for _ in range(CHAT_BATCH)
+            ]
+            try:
+                backend.write_chat_messages(rows)
+                outcome = 'writes'
+            except Exception:
+                outcome = 'errors'
+            with lock:
+                counts[outcome] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] if read_latencies else 0.0
+    print(json.dumps({
+        'reads_per_sec': counts['reads'] / seconds,
+        'writes_per_sec': counts['writes'] * CHAT_BATCH / seconds,
+        'errors': counts['errors'],
+        'read_p99_ms': p99 * 1000
+    }))
+
+
+def main():
+    if sys.argv[1:2] == ['--run']:
+        run_load(*(int(arg) for arg in sys.argv[2:4]), float(sys.argv[4]))
+        return
+
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+
+    print(f"{readers} reader threads, {writers} chat-log writer threads, {seconds:g}s per profile")
+    print(f"{'profile':>10} {'reads/s':>9} {'read p99 ms':>12} {'chat rows/s':>12} {'errors':>7}")
+    for name, overrides in PROFILES:
+        env = dict(os.environ, **overrides)
+        env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_profile.db')}"
+        env['CHAT_LOG_ASYNC'] = '0'
+        env['CATALOG_REFRESH_INTERVAL'] = '0'
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', str(readers), str(writers), str(seconds)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{name:>10} {result['reads_per_sec']:>9,.0f} {result['read_p99_ms']:>12.1f} "
+            f"{result['writes_per_sec']:>12,.0f} {result['errors']:>7}"
+        )
+
+
+if __name__ == '__main__':
+    main()
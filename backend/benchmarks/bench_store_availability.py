@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Store availability benchmark
+Compares the per-store inventory lookups find_stores_with_products used to
+make with the current implementation, reporting SQL query count (for the
+first, cold call) and best latency for a growing number of stores.
+
+Usage: python benchmarks/bench_store_availability.py [store counts...]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench_availability.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_FILE}'
+
+from sqlalchemy import event  # noqa: E402
+
+import app as backend  # noqa: E402
+from app import app, db, Store, Product, Inventory  # noqa: E402
+from geo import calculate_distance  # noqa: E402
+
+PRODUCT_COUNT = 50
+SEARCH_SIZE = 5
+REPEATS = 5
+LOCATION = {'lat': 40.7589, 'lng': -73.9851}
+
+
+def legacy_find_stores_with_products(product_ids, user_location):
+    """The original store x product lookup, kept here for comparison"""
+    stores = Store.query.all()
+    stores_with_products = []
+
+    for store in stores:
+        available_products = []
+        for product_id in product_ids:
+            inventory = Inventory.query.filter_by(store_id=store.id, product_id=product_id).first()
+            if inventory and inventory.quantity > 0:
+                available_products.append({'product_id': product_id, 'quantity': inventory.quantity})
+
+        if available_products:
+            distance = calculate_distance(
+                user_location['lat'], user_location['lng'],
+                store.latitude, store.longitude
+            )
+            stores_with_products.append({'id': store.id, 'distance': round(distance, 1)})
+
+    stores_with_products.sort(key=lambda x: x['distance'])
+    return stores_with_products
+
+
+def populate(store_count):
+    """Reset the database with store_count stores and random inventory"""
+    rng = random.Random(store_count)
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Product {i}', 'category': 'bench', 'price': 1.0, 'description': f'Benchmark product {i}'}
+        for i in range(PRODUCT_COUNT)
+    ])
+    db.session.execute(Store.__table__.insert(), [
+        {
+            'name': f'Store {i}',
+            'address': f'{i} Bench St',
+            'latitude': 40.5 + rng.random(),
+            'longitude': -74.2 + rng.random(),
+            'services': '["Delivery"]'
+        }
+        for i in range(store_count)
+    ])
+    db.session.execute(Inventory.__table__.insert(), [
+        {'store_id': store_id, 'product_id': product_id, 'quantity': rng.randint(0, 100)}
+        for store_id in range(1, store_count + 1)
+        for product_id in range(1, PRODUCT_COUNT + 1)
+        if rng.random() < 0.8
+    ])
+    db.session.commit()
+    backend.invalidate_catalog()
+
+
+def measure(func, product_ids):
+    """Return (query count of the first call, best latency in ms) for func"""
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        best = None
+        queries = None
+        for _ in range(REPEATS):
+            db.session.expire_all()
+            statements.clear()
+            start = time.perf_counter()
+            func(product_ids, LOCATION)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+            if queries is None:
+                queries = len(statements)
+        return queries, best
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def main():
+    store_counts = [int(arg) for arg in sys.argv[1:]] or [10, 50, 200, 1000]
+    product_ids = list(range(1, SEARCH_SIZE + 1))
+
+    print(f"{'stores':>8} {'legacy queries':>15} {'legacy ms':>10} {'new queries':>12} {'new ms':>8}")
+    with app.app_context():
+        for store_count in store_counts:
+            populate(store_count)
+            legacy_queries, legacy_ms = measure(legacy_find_stores_with_products, product_ids)
+            new_queries, new_ms = measure(backend.find_stores_with_products, product_ids)
+            print(f"{store_count:>8} {legacy_queries:>15} {legacy_ms:>10.1f} {new_queries:>12} {new_ms:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""
+Versioned in-memory catalog snapshot
+Products, stores and inventory are loaded into immutable structures that all
+read endpoints share. Writers invalidate the parts they touched and the next
+read (or the periodic refresh) publishes a new snapshot with a higher version.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from collections.abc import Mapping, Sequence
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+ProductRecord = namedtuple('ProductRecord', 'id name category price description icon')
+StoreRecord = namedtuple('StoreRecord', 'id name address latitude longitude phone hours services')
+
+CATALOG_PARTS = frozenset(['products', 'stores', 'inventory'])
+
+# Keyset sort keys; every key ends with the product id so it is unique
+PRODUCT_SORT_KEYS = {
+    'id': lambda p: (p.id,),
+    'name': lambda p: (p.name, p.id),
+    'price': lambda p: (p.price, p.id),
+}
+
+
+def keyset_page(keys, items, after=None, limit=None):
+    """
+    Return (page, last_key) for the items after the `after` key, where keys
+    is the sorted list of unique keys parallel to items. last_key is None
+    when the page reaches the end.
+    """
+    start = bisect_right(keys, after) if after is not None else 0
+    end = len(items) if limit is None else min(start + limit, len(items))
+    last_key = keys[end - 1] if end < len(items) and end > start else None
+    return items[start:end], last_key
+
+
+class StoreInventory(Sequence):
+    """
+    Inventory rows, (store_id, product_id, quantity) ordered by store then
+    row id, kept per store as store_id -> tuple of (product_id, quantity) so
+    one store's rows can be replaced without touching the others
+    """
+
+    def __init__(self, by_store):
+        self.by_store = MappingProxyType(by_store)
+        self._length = None   # counted on first use, so a store reload doesn't visit every store
+        self._offsets = None  # (store ids, row offsets), built on the first index lookup
+
+    @classmethod
+    def from_rows(cls, rows, previous=None):
+        """Group rows by store, reusing previous's tuples for the stores whose rows are unchanged"""
+        by_store = {}
+        for store_id, product_id, quantity in rows:
+            by_store.setdefault(store_id, []).append((product_id, quantity))
+        old = previous.by_store if previous is not None else {}
+        for store_id, store_rows in by_store.items():
+            store_rows = tuple(store_rows)
+            by_store[store_id] = old[store_id] if old.get(store_id) == store_rows else store_rows
+        return cls(by_store)
+
+    def replace(self, store_ids, rows):
+        """A copy with the rows of store_ids replaced by rows (those stores' rows, in row id order)"""
+        by_store = dict(self.by_store)
+        for store_id in store_ids:
+            by_store.pop(store_id, None)
+        by_store.update(StoreInventory.from_rows(rows, self).by_store)
+        return StoreInventory(by_store)
+
+    def changed_stores(self, other):
+        """Ids of the stores whose rows differ from other's"""
+        if other is None:
+            return set(self.by_store)
+        stores = self.by_store.keys() | other.by_store.keys()
+        return {store_id for store_id in stores if self.by_store.get(store_id) is not other.by_store.get(store_id)}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('inventory row index out of range')
+        if self._offsets is None:
+            store_ids = sorted(self.by_store)
+            offsets = [0]
+            for store_id in store_ids:
+                offsets.append(offsets[-1] + len(self.by_store[store_id]))
+            self._offsets = (store_ids, offsets)
+        store_ids, offsets = self._offsets
+        i = bisect_right(offsets, index) - 1
+        product_id, quantity = self.by_store[store_ids[i]][index - offsets[i]]
+        return (store_ids[i], product_id, quantity)
+
+    def __iter__(self):
+        for store_id in sorted(self.by_store):
+            for product_id, quantity in self.by_store[store_id]:
+                yield (store_id, product_id, quantity)
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(len(rows) for rows in self.by_store.values())
+        return self._length
+
+    def __eq__(self, other):
+        if isinstance(other, StoreInventory):
+            return self.by_store == other.by_store
+        return NotImplemented
+
+    __hash__ = None
+
+
+class StoreStockView(Mapping):
+    """(store_id, product_id) -> quantity of the first row per pair, over store_id -> {product_id: quantity}"""
+
+    def __init__(self, by_store):
+        self._by_store = by_store
+        self._length = None
+
+    def __getitem__(self, key):
+        store_id, product_id = key
+        return self._by_store[store_id][product_id]
+
+    def get(self, key, default=None):
+        store_id, product_id = key
+        quantities = self._by_store.get(store_id)
+        return default if quantities is None else quantities.get(product_id, default)
+
+    def __contains__(self, key):
+        store_id, product_id = key
+        quantities = self._by_store.get(store_id)
+        return quantities is not None and product_id in quantities
+
+    def __iter__(self):
+        for store_id, quantities in self._by_store.items():
+            for product_id in quantities:
+                yield (store_id, product_id)
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(len(quantities) for quantities in self._by_store.values())
+        return self._length
+
+
+class CatalogSnapshot:
+    """Immutable view of products, stores and inventory at one version"""
+
+    __slots__ = (
+        'version', 'loaded_at', 'products', 'products_by_id', 'stores', 'stores_by_id',
+        'inventory', 'stock', 'store_inventory', 'product_stores', 'versions', '_views', '_store_stock'
+    )
+
+    def __init__(self, version, products, stores, inventory, previous=None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.products = products    # tuple of ProductRecord ordered by id
+        self.stores = stores        # tuple of StoreRecord ordered by id
+        self.inventory = inventory  # StoreInventory
+        self._views = {}            # lazily built sorted views for keyset pagination
+        
+        # Version at which each part last changed, so caches that depend on
+        # one part survive changes to the others
+        self.versions = {
+            part: previous.versions[part]
+            if previous is not None and getattr(previous, part) is getattr(self, part) else version
+            for part in CATALOG_PARTS
+        }
+
+        # Derived lookups are shared with the previous snapshot when their
+        # source tuple did not change
+        if previous is not None and previous.products is products:
+            self.products_by_id = previous.products_by_id
+        else:
+            self.products_by_id = MappingProxyType({p.id: p for p in products})
+
+        if previous is not None and previous.stores is stores:
+            self.stores_by_id = previous.stores_by_id
+        else:
+            self.stores_by_id = MappingProxyType({s.id: s for s in stores})
+
+        if previous is not None and previous.inventory is inventory:
+            self._store_stock = previous._store_stock
+            self.stock = previous.stock
+            self.store_inventory = previous.store_inventory
+            self.product_stores = previous.product_stores
+        else:
+            self._index_inventory(inventory, previous)
+
+    def product_view(self, sort='id', category=None):
+        """(keys, products) sorted by PRODUCT_SORT_KEYS[sort], optionally for one category"""
+        view_key = ('products', sort, category)
+        view = self._views.get(view_key)
+        if view is None:
+            sort_key = PRODUCT_SORT_KEYS[sort]
+            products = self.products if category is None else [p for p in self.products if p.category == category]
+            products = tuple(sorted(products, key=sort_key))
+            view = self._views[view_key] = ([sort_key(p) for p in products], products)
+        return view
+
+    def inventory_view(self, store_id):
+        """(keys, rows) of a store's in-stock (product, quantity) rows sorted by product id"""
+        view_key = ('inventory', store_id)
+        view = self._views.get(view_key)
+        if view is None:
+            rows = {}
+            for product_id, quantity in self.store_inventory.get(store_id, ()):
+                # First row per product wins, as in stock
+                if product_id not in rows:
+                    rows[product_id] = quantity
+            rows = tuple(
+                (self.products_by_id[product_id], quantity)
+                for product_id, quantity in sorted(rows.items())
+                if product_id in self.products_by_id and quantity and quantity > 0
+            )
+            view = self._views[view_key] = ([(product.id,) for product, _ in rows], rows)
+        return view
+
+    def _index_inventory(self, inventory, previous=None):
+        """
+        Derive the lookups from inventory. Only the stores whose rows changed
+        since previous are re-indexed, so reloading a few stores costs the
+        size of those stores, not of the whole inventory.
+        """
+        changed = inventory.changed_stores(previous.inventory if previous is not None else None)
+
+        store_stock = dict(previous._store_stock) if previous is not None else {}
+        product_stores = dict(previous.product_stores) if previous is not None else {}
+        # product -> changed stores to drop from its entries, and (store, quantity) entries to add
+        removed = {}
+        added = {}
+        for store_id in sorted(changed):
+            for product_id in store_stock.pop(store_id, ()):
+                removed.setdefault(product_id, []).append(store_id)
+            quantities = {}
+            for product_id, quantity in inventory.by_store.get(store_id, ()):
+                # The first row per (store, product) wins, like .first() did
+                if product_id not in quantities:
+                    quantities[product_id] = quantity
+                    added.setdefault(product_id, []).append((store_id, quantity))
+            if quantities:
+                store_stock[store_id] = quantities
+
+        for product_id in removed.keys() | added.keys():
+            # Entries are in store id order and each store appears once, so
+            # (store_id,) sorts right before its entry and insort never
+            # compares quantities
+            entries = list(product_stores.get(product_id, ()))
+            for store_id in removed.get(product_id, ()):
+                del entries[bisect_left(entries, (store_id,))]
+            for entry in added.get(product_id, ()):
+                insort(entries, entry)
+            if entries:
+                product_stores[product_id] = tuple(entries)
+            else:
+                product_stores.pop(product_id, None)
+
+        self._store_stock = store_stock
+        self.stock = StoreStockView(store_stock)
+        self.store_inventory = inventory.by_store
+        self.product_stores = MappingProxyType(product_stores)
+
+
+class Catalog:
+    """
+    Holds the current CatalogSnapshot and replaces it when data changes
+
+    Readers call snapshot() and keep using the object they got back for the
+    rest of the request; a snapshot is never mutated after it is published.
+    """
+
+    def __init__(self, loader, refresh_interval=300, store_loader=None):
+        self.loader = loader                  # callable(parts) -> dict of part name -> tuple
+        self.store_loader = store_loader      # callable(store_ids) -> inventory rows of those stores
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._version = 0
+        self._pending = set(CATALOG_PARTS)    # parts that must be reloaded
+        self._pending_stores = set()          # stores whose inventory must be reloaded
+        self._listeners = []
+        self._lock = threading.Lock()         # guards _pending
+        self._refresh_lock = threading.Lock()  # one loader at a time
+        self._refresher = None
+
+    def add_listener(self, listener):
+        """
+        Call listener(old_snapshot, new_snapshot) before a new version is
+        published; if it raises, the version is not published and its
+        changes are reloaded on the next refresh
+        """
+        self._listeners.append(listener)
+
+    def snapshot(self):
+        """Return the current snapshot, reloading invalidated parts first"""
+        self._ensure_refresher()
+        if self._pending or self._pending_stores or self._snapshot is None:
+            self.refresh()
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self, parts=CATALOG_PARTS):
+        """Mark parts of the catalog stale; the next read reloads them"""
+        with self._lock:
+            self._pending.update(parts)
+
+    def invalidate_stores(self, store_ids):
+        """Mark the inventory of some stores stale; only their rows are reloaded"""
+        if self.store_loader is None:
+            self.invalidate(('inventory',))
+            return
+        with self._lock:
+            self._pending_stores.update(store_ids)
+
+    def refresh(self, parts=None):
+        """Reload pending (or the given) parts and publish a new snapshot if anything changed"""
+        with self._refresh_lock:
+            with self._lock:
+                if parts is not None:
+                    self._pending.update(parts)
+                parts = set(self._pending)
+                stores = set(self._pending_stores)
+                self._pending.clear()
+                self._pending_stores.clear()
+
+            old = self._snapshot
+            if old is None:
+                parts = set(CATALOG_PARTS)
+            if 'inventory' in parts:
+                stores = set()
+            if not parts and not stores:
+                return old
+
+            # Until the new snapshot is published, a failure (in the loaders
+            # or a listener) puts the parts and stores back for the next try
+            try:
+                loaded = self.loader(parts) if parts else {}
+                if 'inventory' in loaded:
+                    loaded['inventory'] = StoreInventory.from_rows(
+                        loaded['inventory'], old.inventory if old is not None else None
+                    )
+                if stores:
+                    loaded['inventory'] = old.inventory.replace(stores, self.store_loader(stores))
+
+                # Keep unchanged parts as the very same objects so derived
+                # lookups and indexes can be reused
+                current = {
+                    part: getattr(old, part) if old is not None else None
+                    for part in CATALOG_PARTS
+                }
+                changed = False
+                for part, rows in loaded.items():
+                    if rows != current[part]:
+                        current[part] = rows
+                        changed = True
+
+                if not changed:
+                    return old
+
+                new = CatalogSnapshot(
+                    self._version + 1, current['products'], current['stores'], current['inventory'],
+                    previous=old
+                )
+                for listener in self._listeners:
+                    listener(old, new)
+            except Exception:
+                with self._lock:
+                    self._pending.update(parts)
+                    self._pending_stores.update(stores)
+                raise
+
+            self._version = new.version
+            self._snapshot = new
+            return new
+
+    def _ensure_refresher(self):
+        if self._refresher is not None or not self.refresh_interval:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='catalog-refresh', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        # Picks up changes made outside this process (or by raw SQL that
+        # skipped the invalidation hooks)
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh(CATALOG_PARTS)
+            except Exception:
+                logger.exception("Periodic catalog refresh failed")
@@ -0,0 +1,151 @@
+"""
+Write-behind chat history persistence
+Chat records are queued in memory and inserted in batches by a background
+thread, so chat responses never wait on a database commit.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ChatLogWriter:
+    """Bounded queue of chat records drained by a background batch writer"""
+
+    def __init__(self, write_batch, batch_size=100, flush_interval=0.5,
+                 max_queue=10000, put_timeout=0.05):
+        self.write_batch = write_batch    # callable taking a list of row dicts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'backpressured': 0,
+            'dropped': 0,
+            'failed': 0
+        }
+
+    def record(self, row):
+        """Queue one chat record; returns False if it had to be dropped"""
+        if self._closed:
+            self._count('dropped')
+            return False
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Queue is full: wait briefly for the writer, then give up
+            self._count('backpressured')
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                self._count('dropped')
+                return False
+
+        self._count('enqueued')
+        return True
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout=10):
+        """Write whatever is still queued and stop the background thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Counters describing writer throughput and backpressure"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            taken = 1
+            if item is _STOP:
+                stopping = True
+            else:
+                batch.append(item)
+
+            # Keep collecting until the batch is full or the interval ends
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            # On shutdown, drain everything that is left into the last batches
+            while stopping:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is not _STOP:
+                    batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.write_batch(batch)
+        except Exception:
+            logger.exception("Failed to write %d chat records", len(batch))
+            self._count('failed', len(batch))
+        else:
+            self._count('written', len(batch))
+            self._count('batches')
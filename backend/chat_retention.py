@@ -0,0 +1,285 @@
+"""
+Chat history retention
+chat_message only keeps the most recent chat turns. A background pass moves
+older rows, oldest first and a small transaction at a time, into one table
+per month (chat_message_YYYY_MM) where each bot response is replaced by a
+reference to a zlib-compressed blob in chat_response that identical
+responses share. Month tables past the retention period are dropped whole,
+and blobs no remaining row can reference are deleted in batches, so the
+database stops growing once it holds a retention period of traffic.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, column, func, select, table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+PARTITION_RE = re.compile(r'^chat_message_(\d{4})_(\d{2})$')
+PARTITION_GLOB = 'chat_message_[0-9][0-9][0-9][0-9]_[0-9][0-9]'
+COMPRESSION_LEVEL = 6
+
+
+sqlite_master = table('sqlite_master', column('type'), column('name'))
+partition_names = select(sqlite_master.c.name).where(
+    sqlite_master.c.type == 'table', sqlite_master.c.name.op('GLOB')(PARTITION_GLOB)
+)
+
+
+def partition_name(moment):
+    """Name of the month table holding chat turns from moment's month"""
+    return f'chat_message_{moment.year:04d}_{moment.month:02d}'
+
+
+def partition_month(name):
+    """First instant of a month table's month, or None if name is not a month table"""
+    match = PARTITION_RE.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def encode_response(bot_response):
+    """(digest, compressed body) of a JSON-encoded bot response"""
+    data = bot_response.encode('utf-8')
+    return hashlib.sha1(data).hexdigest(), zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decode_response(body):
+    """The bot response stored in a chat_response body"""
+    return json.loads(zlib.decompress(body))
+
+
+class ChatRetention:
+    """Moves, compacts and expires chat history in small batches"""
+
+    def __init__(self, engine, messages, responses, retention_days=90, hot_days=2,
+                 batch_size=500, interval=3600, pause=0.05):
+        self.engine = engine
+        self.messages = messages      # the chat_message table
+        self.responses = responses    # the chat_response table
+        self.retention_days = retention_days
+        self.hot_days = hot_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause            # seconds between batches, so writers get the lock
+        self._metadata = MetaData()
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            'passes': 0,
+            'moved': 0,
+            'partitions_dropped': 0,
+            'responses_deleted': 0,
+            'failed': 0,
+            'last_pass_seconds': 0.0
+        }
+
+    def start(self):
+        """Run a pass every interval seconds on a background thread (once per process)"""
+        if self._thread is not None or not self.interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='chat-retention', daemon=True)
+                self._thread.start()
+
+    def run(self, now=None):
+        """One full pass; returns what it did"""
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        result = {'moved': 0, 'partitions_dropped': 0, 'responses_deleted': 0}
+
+        hot_cutoff = now - timedelta(days=self.hot_days)
+        while True:
+            moved = self.move_batch(hot_cutoff)
+            result['moved'] += moved
+            if moved < self.batch_size:
+                break
+            time.sleep(self.pause)
+
+        if self.retention_days:
+            retention_cutoff = now - timedelta(days=self.retention_days)
+            result['partitions_dropped'] = self.drop_expired(retention_cutoff)
+            while True:
+                deleted = self.delete_unreferenced_batch(retention_cutoff)
+                result['responses_deleted'] += deleted
+                if deleted < self.batch_size:
+                    break
+                time.sleep(self.pause)
+
+        with self._lock:
+            self._stats['passes'] += 1
+            for key, value in result.items():
+                self._stats[key] += value
+            self._stats['last_pass_seconds'] = round(time.perf_counter() - started, 3)
+        return result
+
+    def batch_query(self, cutoff):
+        """The oldest batch of chat_message rows written before cutoff"""
+        m = self.messages.c
+        return select(m.id, m.session_id, m.user_message, m.bot_response, m.timestamp).where(
+            m.timestamp < cutoff
+        ).order_by(m.timestamp).limit(self.batch_size)
+
+    def unreferenced_query(self, cutoff):
+        """Ids of a batch of responses last used before cutoff"""
+        r = self.responses.c
+        return select(r.id).where(r.last_seen < cutoff).limit(self.batch_size)
+
+    def move_batch(self, cutoff):
+        """Move one batch of rows older than cutoff into their month tables; returns the row count"""
+        try:
+            return self._move_batch(cutoff)
+        except OperationalError as e:
+            if 'no such table' not in str(e.orig):
+                raise
+            # A cached month table was dropped (by another process, or the
+            # transaction creating it rolled back): forget them and retry once
+            self._partitions.clear()
+            return self._move_batch(cutoff)
+
+    def _move_batch(self, cutoff):
+        with self.engine.begin() as connection:
+            rows = connection.execute(self.batch_query(cutoff)).all()
+            if not rows:
+                return 0
+
+            # One blob per distinct response, remembering its newest use
+            blobs = {}
+            digests = []
+            for row in rows:
+                if row.bot_response is None:
+                    digests.append(None)
+                    continue
+                digest, body = encode_response(row.bot_response)
+                digests.append(digest)
+                blob = blobs.get(digest)
+                if blob is None:
+                    blobs[digest] = {'digest': digest, 'body': body, 'last_seen': row.timestamp}
+                elif row.timestamp > blob['last_seen']:
+                    blob['last_seen'] = row.timestamp
+            response_ids = self._store_responses(connection, list(blobs.values()))
+
+            by_partition = {}
+            for row, digest in zip(rows, digests):
+                by_partition.setdefault(partition_name(row.timestamp), []).append({
+                    'id': row.id,
+                    'session_id': row.session_id,
+                    'user_message': row.user_message,
+                    'response_id': response_ids.get(digest),
+                    'timestamp': row.timestamp
+                })
+            for name, partition_rows in by_partition.items():
+                partition = self._partition(connection, name)
+                # Another process may have moved the same rows already
+                connection.execute(partition.insert().prefix_with('OR IGNORE'), partition_rows)
+
+            connection.execute(self.messages.delete().where(self.messages.c.id.in_([row.id for row in rows])))
+        return len(rows)
+
+    def drop_expired(self, cutoff):
+        """Drop the month tables whose whole month is older than cutoff"""
+        dropped = 0
+        for name, start in self.partitions():
+            if next_month(start) > cutoff:
+                continue
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql(f'DROP TABLE IF EXISTS {name}')
+            self._partitions.pop(name, None)
+            dropped += 1
+            logger.info("Dropped expired chat history table %s", name)
+        return dropped
+
+    def delete_unreferenced_batch(self, retention_cutoff):
+        """Delete a batch of responses that no retained chat turn can reference"""
+        # A response's last_seen is at least the timestamp of every turn
+        # using it, so those last used before the oldest turn still stored
+        # are unreferenced. Both minimums are read in one statement, so
+        # from the same snapshot.
+        with self.engine.connect() as connection:
+            oldest_partition, oldest_hot = connection.execute(select(
+                select(func.min(sqlite_master.c.name)).where(
+                    partition_names.whereclause
+                ).scalar_subquery(),
+                select(func.min(self.messages.c.timestamp)).scalar_subquery()
+            )).one()
+        cutoff = retention_cutoff
+        if oldest_partition is not None:
+            cutoff = min(cutoff, partition_month(oldest_partition))
+        if oldest_hot is not None:
+            cutoff = min(cutoff, oldest_hot)
+
+        with self.engine.begin() as connection:
+            result = connection.execute(self.responses.delete().where(
+                self.responses.c.id.in_(self.unreferenced_query(cutoff).scalar_subquery())
+            ))
+        return result.rowcount
+
+    def partitions(self):
+        """(name, month start) of every month table, oldest first"""
+        with self.engine.connect() as connection:
+            names = connection.execute(partition_names.order_by(sqlite_master.c.name)).scalars().all()
+        return [(name, partition_month(name)) for name in names]
+
+    def stats(self):
+        """Counters of the passes run by this process"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _store_responses(self, connection, blobs):
+        """Upsert response blobs; returns {digest: id}"""
+        if not blobs:
+            return {}
+        r = self.responses.c
+        statement = sqlite_insert(self.responses)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[r.digest],
+            set_={'last_seen': func.max(r.last_seen, statement.excluded.last_seen)}
+        ), blobs)
+        rows = connection.execute(
+            select(r.digest, r.id).where(r.digest.in_([blob['digest'] for blob in blobs]))
+        ).all()
+        return dict(rows)
+
+    def _partition(self, connection, name):
+        """The month table called name, created the first time this process uses it"""
+        partition = self._partitions.get(name)
+        if partition is not None:
+            return partition
+        partition = self._metadata.tables.get(name)
+        if partition is None:
+            partition = Table(
+                name, self._metadata,
+                Column('id', Integer, primary_key=True),
+                Column('session_id', String(100)),
+                Column('user_message', Text),
+                Column('response_id', Integer),
+                Column('timestamp', DateTime),
+                Index(f'idx_{name}_session', 'session_id', 'timestamp')
+            )
+        partition.create(connection, checkfirst=True)
+        self._partitions[name] = partition
+        return partition
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run()
+            except Exception:
+                with self._lock:
+                    self._stats['failed'] += 1
+                logger.exception("Chat history retention pass failed")
@@ -0,0 +1,285 @@
+"""
+Synthetic dataset generator for scale testing
+Produces a seeded, reproducible catalogue: products with realistic names,
+categories and descriptions, stores clustered around real metro areas,
+dense or sparse inventory and a chat history. Rows are generated lazily and
+written with executemany in large chunks inside the caller's transaction, so
+tens of millions of rows never sit in memory at once.
+"""
+
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime
+
+CHUNK_SIZE = 50000
+
+# category -> (icon, items, pack sizes, price range)
+CATEGORIES = {
+    'fruits': (
+        '🍎',
+        ['Apples', 'Bananas', 'Oranges', 'Strawberries', 'Grapes', 'Pineapple', 'Mangoes', 'Pears',
+         'Blueberries', 'Peaches', 'Lemons', 'Limes', 'Kiwis', 'Cherries', 'Watermelon'],
+        ['1 lb', '2 lb', '3 lb bag', '6 ct', 'each'], (0.99, 8.99),
+    ),
+    'vegetables': (
+        '🥕',
+        ['Carrots', 'Broccoli', 'Bell Peppers', 'Tomatoes', 'Lettuce', 'Onions', 'Spinach', 'Potatoes',
+         'Cucumbers', 'Zucchini', 'Cauliflower', 'Kale', 'Garlic', 'Celery'],
+        ['1 lb', '2 lb', '5 lb bag', 'bunch', 'each'], (0.79, 6.99),
+    ),
+    'dairy': (
+        '🥛',
+        ['Whole Milk', 'Cheddar Cheese', 'Greek Yogurt', 'Butter', 'Cream Cheese', 'Mozzarella', 'Sour Cream',
+         'Heavy Cream', 'Cottage Cheese', 'Skim Milk', 'Parmesan', 'Oat Milk'],
+        ['8 oz', '16 oz', '32 oz', '1/2 gal', '1 gal'], (1.49, 9.99),
+    ),
+    'bakery': (
+        '🍞',
+        ['Sourdough Bread', 'Croissants', 'Bagels', 'Muffins', 'Baguette', 'Whole Wheat Bread', 'Dinner Rolls',
+         'Cinnamon Rolls', 'Tortillas', 'Pita Bread', 'Brioche'],
+        ['6 ct', '12 ct', '16 oz', '20 oz', 'each'], (1.99, 7.99),
+    ),
+    'snacks': (
+        '🍿',
+        ['Potato Chips', 'Pretzels', 'Popcorn', 'Trail Mix', 'Granola Bars', 'Crackers', 'Tortilla Chips',
+         'Almonds', 'Cookies', 'Rice Cakes', 'Dark Chocolate'],
+        ['5 oz', '8 oz', '10 oz', '16 oz', '6 ct'], (1.49, 8.49),
+    ),
+    'beverages': (
+        '🥤',
+        ['Orange Juice', 'Apple Juice', 'Sparkling Water', 'Cola', 'Iced Tea', 'Cold Brew Coffee', 'Lemonade',
+         'Coconut Water', 'Green Tea', 'Kombucha', 'Sports Drink'],
+        ['12 fl oz', '32 fl oz', '64 fl oz', '6 pk', '12 pk'], (0.99, 7.99),
+    ),
+    'meat': (
+        '🥩',
+        ['Chicken Breast', 'Ground Beef', 'Pork Chops', 'Bacon', 'Turkey Slices', 'Ribeye Steak',
+         'Chicken Thighs', 'Italian Sausage', 'Lamb Chops', 'Ham'],
+        ['12 oz', '1 lb', '2 lb', 'family pack'], (3.99, 24.99),
+    ),
+    'seafood': (
+        '🐟',
+        ['Salmon Fillet', 'Shrimp', 'Tilapia', 'Cod', 'Tuna Steak', 'Crab Legs', 'Scallops', 'Canned Tuna',
+         'Smoked Salmon'],
+        ['8 oz', '12 oz', '1 lb', '5 oz can'], (4.99, 29.99),
+    ),
+    'frozen': (
+        '🧊',
+        ['Frozen Pizza', 'Ice Cream', 'Frozen Peas', 'Frozen Berries', 'Fish Sticks', 'Waffles',
+         'Frozen Dumplings', 'Veggie Burgers', 'Frozen Corn'],
+        ['10 oz', '16 oz', '24 oz', '1.5 qt'], (2.49, 11.99),
+    ),
+    'pantry': (
+        '🥫',
+        ['Spaghetti', 'Basmati Rice', 'Olive Oil', 'Peanut Butter', 'Honey', 'Black Beans', 'Tomato Sauce',
+         'Oatmeal', 'Flour', 'Maple Syrup', 'Chicken Broth', 'Cereal'],
+        ['12 oz', '16 oz', '32 oz', '2 lb', '5 lb'], (0.99, 14.99),
+    ),
+    'household': (
+        '🧻',
+        ['Paper Towels', 'Dish Soap', 'Laundry Detergent', 'Trash Bags', 'Toilet Paper', 'Aluminum Foil',
+         'Sponges', 'All-Purpose Cleaner'],
+        ['1 ct', '3 ct', '6 rolls', '12 rolls', '50 oz'], (1.99, 19.99),
+    ),
+}
+BRANDS = [
+    'Harvest Farms', 'Green Valley', 'Sunrise', 'Golden Acres', 'Blue Ridge', 'Meadow Fresh', 'Orchard Lane',
+    'Pure Earth', 'Hillside', 'River Bend', 'Prairie Gold', 'Coastal Catch', 'Maple Grove', 'Wild Oak',
+    'Summit', 'Silver Spoon', 'Happy Hen', 'Evergreen', 'Red Barn', 'SUVAI Select',
+]
+MODIFIERS = [
+    'Organic', 'Fresh', 'Premium', 'Classic', 'Family Size', 'Low Fat', 'Gluten Free', 'Whole Grain',
+    'Farm Fresh', 'Artisan', 'Natural', 'Lightly Salted', 'Unsweetened', 'Extra Large', 'Local', 'Value Pack',
+]
+DESCRIPTIONS = [
+    '{modifier} {item} from {brand}, {size}',
+    '{brand} {item}, a {adjective} pantry staple',
+    '{adjective} {item} picked for flavour and freshness',
+    '{modifier} {item}, perfect for {occasion}',
+    'Our {adjective} {item}, sourced from {brand} growers',
+]
+ADJECTIVES = ['crisp', 'creamy', 'hearty', 'sweet', 'savory', 'wholesome', 'rich', 'zesty', 'tender', 'crunchy']
+OCCASIONS = ['weeknight dinners', 'school lunches', 'breakfast', 'snacking', 'the grill', 'holiday baking']
+
+# (city, region code, latitude, longitude, spread in degrees, relative weight)
+REGIONS = {
+    'nyc': [
+        ('New York', 'NY', 40.7589, -73.9851, 0.08, 1),
+    ],
+    'us': [
+        ('New York', 'NY', 40.7128, -74.0060, 0.25, 20), ('Los Angeles', 'CA', 34.0522, -118.2437, 0.3, 13),
+        ('Chicago', 'IL', 41.8781, -87.6298, 0.25, 9), ('Houston', 'TX', 29.7604, -95.3698, 0.3, 7),
+        ('Phoenix', 'AZ', 33.4484, -112.0740, 0.25, 5), ('Philadelphia', 'PA', 39.9526, -75.1652, 0.2, 6),
+        ('San Antonio', 'TX', 29.4241, -98.4936, 0.2, 3), ('San Diego', 'CA', 32.7157, -117.1611, 0.2, 3),
+        ('Dallas', 'TX', 32.7767, -96.7970, 0.3, 7), ('San Francisco', 'CA', 37.7749, -122.4194, 0.25, 5),
+        ('Seattle', 'WA', 47.6062, -122.3321, 0.2, 4), ('Denver', 'CO', 39.7392, -104.9903, 0.2, 3),
+        ('Boston', 'MA', 42.3601, -71.0589, 0.2, 5), ('Atlanta', 'GA', 33.7490, -84.3880, 0.3, 6),
+        ('Miami', 'FL', 25.7617, -80.1918, 0.2, 6), ('Minneapolis', 'MN', 44.9778, -93.2650, 0.2, 4),
+        ('Detroit', 'MI', 42.3314, -83.0458, 0.2, 4), ('Portland', 'OR', 45.5152, -122.6784, 0.15, 2),
+    ],
+    'world': [
+        ('New York', 'NY', 40.7128, -74.0060, 0.25, 20), ('Los Angeles', 'CA', 34.0522, -118.2437, 0.3, 13),
+        ('Chicago', 'IL', 41.8781, -87.6298, 0.25, 9), ('Toronto', 'ON', 43.6532, -79.3832, 0.2, 6),
+        ('Mexico City', 'CDMX', 19.4326, -99.1332, 0.25, 20), ('Sao Paulo', 'SP', -23.5505, -46.6333, 0.3, 21),
+        ('London', 'UK', 51.5074, -0.1278, 0.25, 14), ('Paris', 'FR', 48.8566, 2.3522, 0.2, 11),
+        ('Berlin', 'DE', 52.5200, 13.4050, 0.2, 6), ('Madrid', 'ES', 40.4168, -3.7038, 0.2, 6),
+        ('Lagos', 'NG', 6.5244, 3.3792, 0.2, 14), ('Cairo', 'EG', 30.0444, 31.2357, 0.2, 20),
+        ('Mumbai', 'MH', 19.0760, 72.8777, 0.2, 20), ('Chennai', 'TN', 13.0827, 80.2707, 0.2, 11),
+        ('Singapore', 'SG', 1.3521, 103.8198, 0.1, 6), ('Tokyo', 'JP', 35.6762, 139.6503, 0.3, 37),
+        ('Seoul', 'KR', 37.5665, 126.9780, 0.2, 10), ('Sydney', 'NSW', -33.8688, 151.2093, 0.25, 5),
+    ],
+}
+STREETS = ['Main', 'Oak', 'Maple', 'Park', 'Cedar', 'Elm', 'Washington', 'Lake', 'Hill', 'Market', 'Broadway',
+           'Church', 'River', 'Sunset', 'Highland', 'Mill', 'Spring', 'Union', 'Center', 'Station']
+STREET_SUFFIXES = ['St', 'Ave', 'Blvd', 'Rd', 'Way', 'Ln', 'Dr']
+STORE_SUFFIXES = ['Downtown', 'Uptown', 'Market', 'Express', 'Central', 'Plaza', 'Corner', 'Square', 'Heights']
+HOURS = ['Mon-Sun 7:00 AM - 10:00 PM', 'Mon-Sun 6:00 AM - 11:00 PM', 'Mon-Sun 8:00 AM - 9:00 PM', 'Open 24 hours']
+SERVICES = ['Grocery pickup', 'Delivery', 'Pharmacy', 'Bakery', 'Deli', 'Organic section', 'Butcher', 'Florist']
+
+CHAT_TEMPLATES = [
+    'find {item}', 'I need {item}', 'do you have {item}', 'where can I buy {item}', 'looking for {modifier} {item}',
+    'search for {item}', 'show nearby stores', 'stores near me', 'help', 'hello', 'what is on sale',
+    '{item} and {other}', 'is {item} in stock',
+]
+
+
+def _timestamp(connection):
+    """Convert datetimes to what the DateTime columns store on this connection's dialect"""
+    impl = DateTime().dialect_impl(connection.dialect)
+    return impl.bind_processor(connection.dialect) or (lambda value: value)
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_rows(connection, table, columns, rows):
+    """executemany rows into table in CHUNK_SIZE batches; returns the row count"""
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    count = 0
+    for chunk in _chunks(rows):
+        connection.exec_driver_sql(sql, chunk)
+        count += len(chunk)
+    return count
+
+
+def generate_products(rng, count, first_id, created_at):
+    """(id, name, category, price, description, icon, created_at) rows"""
+    categories = list(CATEGORIES)
+    for product_id in range(first_id, first_id + count):
+        category = rng.choice(categories)
+        icon, items, sizes, (low, high) = CATEGORIES[category]
+        item = rng.choice(items)
+        brand = rng.choice(BRANDS)
+        modifier = rng.choice(MODIFIERS)
+        size = rng.choice(sizes)
+        description = rng.choice(DESCRIPTIONS).format(
+            modifier=modifier, item=item.lower(), brand=brand, size=size,
+            adjective=rng.choice(ADJECTIVES), occasion=rng.choice(OCCASIONS)
+        )
+        yield (
+            product_id, f'{brand} {modifier} {item} {size}', category, round(rng.uniform(low, high), 2),
+            description[0].upper() + description[1:], icon, created_at
+        )
+
+
+def generate_stores(rng, count, first_id, regions, created_at):
+    """(id, name, address, latitude, longitude, phone, hours, services, created_at) rows"""
+    weights = [region[5] for region in regions]
+    for store_id in range(first_id, first_id + count):
+        city, code, lat, lng, spread, _ = rng.choices(regions, weights)[0]
+        latitude = round(max(-89.9, min(89.9, rng.gauss(lat, spread))), 6)
+        longitude = round(((rng.gauss(lng, spread) + 180) % 360) - 180, 6)
+        street = f'{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(STREET_SUFFIXES)}'
+        yield (
+            store_id, f'SUVAI {city} {rng.choice(STORE_SUFFIXES)} #{store_id}',
+            f'{street}, {city}, {code} {rng.randint(10000, 99999)}', latitude, longitude,
+            f'({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}',
+            rng.choice(HOURS), json.dumps(sorted(rng.sample(SERVICES, rng.randint(1, 4)))), created_at
+        )
+
+
+def generate_inventory(rng, store_ids, product_ids, density, updated_at):
+    """
+    (store_id, product_id, quantity, last_updated) rows: each store stocks
+    about `density` of the products, in (store, product) order so the unique
+    index is appended to rather than split. About one row in ten is out of stock.
+    """
+    product_count = len(product_ids)
+    for store_id in store_ids:
+        stocked = min(product_count, max(0, round(rng.gauss(density, density * 0.1) * product_count)))
+        if stocked * 2 > product_count:
+            skipped = set(rng.sample(range(product_count), product_count - stocked))
+            picks = (i for i in range(product_count) if i not in skipped)
+        else:
+            picks = sorted(rng.sample(range(product_count), stocked))
+        for i in picks:
+            quantity = 0 if rng.random() < 0.1 else min(500, int(rng.expovariate(1 / 40)) + 1)
+            yield store_id, product_ids[i], quantity, updated_at
+
+
+def generate_chat_messages(rng, count, start, end, format_timestamp):
+    """(session_id, user_message, bot_response, timestamp) rows in time order"""
+    sessions = max(1, count // 8)
+    items = [item.lower() for _, items, _, _ in CATEGORIES.values() for item in items]
+    span = (end - start).total_seconds()
+    for n in range(count):
+        item, other = rng.choice(items), rng.choice(items)
+        message = rng.choice(CHAT_TEMPLATES).format(item=item, other=other, modifier=rng.choice(MODIFIERS).lower())
+        if 'store' in message:
+            response = {'type': 'store_locations', 'message': 'Here are the stores closest to you', 'stores': []}
+        elif message in ('help', 'hello', 'what is on sale'):
+            response = {'type': 'text', 'message': "I can help you find products and nearby stores."}
+        else:
+            response = {'type': 'product_search', 'message': f'I found products matching "{item}"', 'products': []}
+        timestamp = start + timedelta(seconds=span * (n + rng.random()) / count)
+        yield f'gen-{rng.randrange(sessions)}', message, json.dumps(response), format_timestamp(timestamp)
+
+
+def generate_dataset(connection, products=100000, stores=2000, density=0.05, chat_messages=0,
+                     regions='us', seed=0, chat_days=90, now=None):
+    """
+    Append a synthetic dataset through connection, inside its transaction.
+    New stores get inventory for every product, old and new. Returns
+    {table: {'rows': n, 'seconds': s}}.
+    """
+    rng = random.Random(seed)
+    format_timestamp = _timestamp(connection)
+    # Anchored to the start of the day, so a seed gives the same rows all day
+    now = now or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    created_at = format_timestamp(now)
+    result = {}
+
+    def next_id(table):
+        return connection.exec_driver_sql(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').scalar()
+
+    def timed(table, columns, rows):
+        start = time.perf_counter()
+        count = insert_rows(connection, table, columns, rows)
+        result[table] = {'rows': count, 'seconds': round(time.perf_counter() - start, 2)}
+
+    timed('product', ('id', 'name', 'category', 'price', 'description', 'icon', 'created_at'),
+          generate_products(rng, products, next_id('product'), created_at))
+
+    first_store = next_id('store')
+    timed('store', ('id', 'name', 'address', 'latitude', 'longitude', 'phone', 'hours', 'services', 'created_at'),
+          generate_stores(rng, stores, first_store, REGIONS[regions], created_at))
+
+    product_ids = [row[0] for row in connection.exec_driver_sql('SELECT id FROM product ORDER BY id')]
+    timed('inventory', ('store_id', 'product_id', 'quantity', 'last_updated'),
+          generate_inventory(rng, range(first_store, first_store + stores), product_ids, density, created_at))
+
+    if chat_messages:
+        timed('chat_message', ('session_id', 'user_message', 'bot_response', 'timestamp'),
+              generate_chat_messages(rng, chat_messages, now - timedelta(days=chat_days), now, format_timestamp))
+    return result
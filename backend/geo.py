@@ -0,0 +1,332 @@
+"""
+Geospatial helpers for store lookups
+Haversine distance, bounding boxes and a grid index for nearest-store queries
+"""
+
+import heapq
+import math
+import threading
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points using Haversine formula"""
+    R = EARTH_RADIUS_KM  # Earth's radius in kilometers
+
+    lat1_rad = math.radians(lat1)
+    lon1_rad = math.radians(lon1)
+    lat2_rad = math.radians(lat2)
+    lon2_rad = math.radians(lon2)
+
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return R * c
+
+
+def batch_distance(lat, lng, lats, lngs):
+    """Haversine distances in km from one point to arrays of coordinates"""
+    lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+    return _haversine_radians(lat, lng, lats_rad, lngs_rad, np.cos(lats_rad))
+
+
+def _haversine_radians(lat, lng, lats_rad, lngs_rad, cos_lats):
+    """Vectorized haversine against coordinates already packed in radians"""
+    lat_rad = math.radians(lat)
+    lng_rad = math.radians(lng)
+
+    a = np.sin((lats_rad - lat_rad) / 2) ** 2 + math.cos(lat_rad) * cos_lats * np.sin((lngs_rad - lng_rad) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def smallest_k(values, k=None):
+    """Indices of the k smallest values in ascending order, ties in input order"""
+    n = len(values)
+    if k is None or k >= n:
+        return np.argsort(values, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # partition finds the k-th smallest in linear time; only values up to it
+    # get sorted, and ties with it are taken in input order like a full sort
+    kth = np.partition(values, k - 1)[k - 1]
+    below = np.flatnonzero(values < kth)
+    ties = np.flatnonzero(values == kth)[:k - len(below)]
+    top = np.concatenate((below, ties))
+    top.sort()
+    return top[np.argsort(values[top], kind='stable')]
+
+
+def _pack(points):
+    """Pack (store_id, lat, lng) tuples into arrays ready for batch_distance"""
+    ids = np.fromiter((p[0] for p in points), dtype=np.int64, count=len(points))
+    lats_rad = np.radians(np.fromiter((p[1] for p in points), dtype=np.float64, count=len(points)))
+    lngs_rad = np.radians(np.fromiter((p[2] for p in points), dtype=np.float64, count=len(points)))
+    return ids, lats_rad, lngs_rad, np.cos(lats_rad)
+
+
+def bounding_box(lat, lng, radius_km):
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing a radius around a point"""
+    dlat = radius_km / KM_PER_DEGREE
+
+    # Longitude degrees shrink towards the poles, so size the box for the
+    # highest latitude the circle reaches
+    widest_lat = min(abs(lat) + dlat, 90)
+    cos_lat = math.cos(math.radians(widest_lat))
+    if cos_lat < 1e-9:
+        dlng = 180
+    else:
+        dlng = min(radius_km / (KM_PER_DEGREE * cos_lat), 180)
+
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def location_cell(lat, lng, size):
+    """(row, col) of the size-degree grid cell containing a point"""
+    return math.floor(lat / size), math.floor(lng / size)
+
+
+def cell_circle(cell, size):
+    """
+    ((lat, lng), radius_km) of a circle around a grid cell's center that
+    covers the whole cell, with a little slack for rounding
+    """
+    row, col = cell
+    lat, lng = (row + 0.5) * size, (col + 0.5) * size
+    radius = max(
+        calculate_distance(lat, lng, corner_lat, corner_lng)
+        for corner_lat in (row * size, (row + 1) * size)
+        for corner_lng in (col * size, (col + 1) * size)
+    )
+    return (lat, lng), radius * 1.01 + 1e-6
+
+
+class StoreGridIndex:
+    """
+    Uniform lat/lng grid over store coordinates
+
+    Nearest-store queries scan rings of cells outwards from the query cell and
+    stop once the closest unscanned cell is further away than the results
+    found so far, so they only touch the neighbourhood of the query point.
+    Radius queries are first clipped to the cells under the radius's bounding
+    box, and stores outside the radius never reach the heap.
+    Ranking a given set of stores uses one packed array of every store's
+    coordinates instead, which is rebuilt lazily after stores change.
+    Longitudes are not wrapped at the antimeridian.
+    """
+
+    def __init__(self, cell_size=0.25):
+        self.cell_size = cell_size
+        self.built = False
+        self._lock = threading.Lock()
+        self._cells = {}      # (row, col) -> (tuple of (store_id, lat, lng), packed arrays)
+        self._locations = {}  # store_id -> (lat, lng)
+        self._extent = None   # (min_row, max_row, min_col, max_col) of occupied cells
+        self._packed = None   # (positions, ids, lats_rad, lngs_rad, cos_lats) for all stores
+
+    def build(self, stores):
+        """(Re)build the grid from an iterable of (store_id, lat, lng)"""
+        cells = {}
+        locations = {}
+        for store_id, lat, lng in stores:
+            locations[store_id] = (lat, lng)
+            cells.setdefault(self._cell(lat, lng), []).append((store_id, lat, lng))
+
+        extent = None
+        for key in cells:
+            extent = self._grow_extent(extent, key)
+
+        with self._lock:
+            self._cells = {key: (tuple(points), _pack(points)) for key, points in cells.items()}
+            self._locations = locations
+            self._extent = extent
+            self._packed = None
+            self.built = True
+
+    def upsert(self, store_id, lat, lng):
+        """Add a store or move it to new coordinates"""
+        with self._lock:
+            self._remove(store_id)
+            key = self._cell(lat, lng)
+            points = self._cells.get(key, ((), None))[0] + ((store_id, lat, lng),)
+            self._cells[key] = (points, _pack(points))
+            self._locations[store_id] = (lat, lng)
+            self._extent = self._grow_extent(self._extent, key)
+            self._packed = None
+
+    def remove(self, store_id):
+        """Drop a store from the grid"""
+        with self._lock:
+            self._remove(store_id)
+            self._packed = None
+
+    def distances(self, lat, lng, store_ids=None):
+        """
+        (store ids, distances in km) arrays for all stores, or for the given
+        store_ids that are indexed in the order given, in one vectorized pass
+        """
+        positions, ids, lats_rad, lngs_rad, cos_lats = self._packed_arrays()
+
+        if store_ids is not None:
+            rows = np.fromiter(
+                (positions[s] for s in store_ids if s in positions), dtype=np.intp
+            )
+            ids, lats_rad, lngs_rad, cos_lats = ids[rows], lats_rad[rows], lngs_rad[rows], cos_lats[rows]
+
+        return ids, _haversine_radians(lat, lng, lats_rad, lngs_rad, cos_lats)
+
+    def rank(self, lat, lng, k=None, store_ids=None, radius_km=None):
+        """
+        Return up to k (store_id, distance_km) pairs, closest first, computed
+        in one vectorized pass over all stores or just the given store_ids
+        """
+        ids, distances = self.distances(lat, lng, store_ids)
+        if radius_km is not None:
+            inside = distances <= radius_km
+            ids, distances = ids[inside], distances[inside]
+
+        order = smallest_k(distances, k)
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def nearest(self, lat, lng, k, radius_km=None):
+        """Return up to k (store_id, distance_km) pairs, closest first"""
+        results = []
+        if k <= 0:
+            return results
+        for item in self.iter_nearest(lat, lng, radius_km):
+            results.append(item)
+            if len(results) >= k:
+                break
+        return results
+
+    def iter_nearest(self, lat, lng, radius_km=None):
+        """Yield (store_id, distance_km) pairs in increasing distance order"""
+        cells, extent = self._cells, self._extent
+        if not cells or extent is None:
+            return
+
+        row, col = self._cell(lat, lng)
+        min_row, max_row, min_col, max_col = extent
+        if radius_km is not None:
+            min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+            box_min_row, box_min_col = self._cell(min_lat, min_lng)
+            box_max_row, box_max_col = self._cell(max_lat, max_lng)
+            min_row, max_row = max(min_row, box_min_row), min(max_row, box_max_row)
+            min_col, max_col = max(min_col, box_min_col), min(max_col, box_max_col)
+            if min_row > max_row or min_col > max_col:
+                return
+        max_ring = max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+
+        heap = []
+        ring = 0
+        while ring <= max_ring:
+            ring_cells = list(self._ring_cells(cells, row, col, ring))
+            if ring_cells:
+                ids, lats_rad, lngs_rad, cos_lats = (
+                    np.concatenate(arrays) for arrays in zip(*(packed for _, packed in ring_cells))
+                )
+                distances = _haversine_radians(lat, lng, lats_rad, lngs_rad, cos_lats)
+                if radius_km is not None:
+                    inside = distances <= radius_km
+                    ids, distances = ids[inside], distances[inside]
+                for distance, store_id in zip(distances.tolist(), ids.tolist()):
+                    heapq.heappush(heap, (distance, store_id))
+
+            bound = self._ring_bound(lat, lng, row, col, ring)
+            while heap and heap[0][0] <= bound:
+                distance, store_id = heapq.heappop(heap)
+                yield store_id, distance
+
+            if radius_km is not None and bound > radius_km:
+                return
+            ring += 1
+
+        # Every candidate cell has been scanned
+        while heap:
+            distance, store_id = heapq.heappop(heap)
+            yield store_id, distance
+
+    def __len__(self):
+        return len(self._locations)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def _grow_extent(self, extent, key):
+        row, col = key
+        if extent is None:
+            return (row, row, col, col)
+        min_row, max_row, min_col, max_col = extent
+        return (min(min_row, row), max(max_row, row), min(min_col, col), max(max_col, col))
+
+    def _remove(self, store_id):
+        location = self._locations.pop(store_id, None)
+        if location is None:
+            return
+        key = self._cell(*location)
+        points = tuple(p for p in self._cells.get(key, ((), None))[0] if p[0] != store_id)
+        if points:
+            self._cells[key] = (points, _pack(points))
+        else:
+            self._cells.pop(key, None)
+
+    def _packed_arrays(self):
+        packed = self._packed
+        if packed is None:
+            with self._lock:
+                points = [(store_id, lat, lng) for store_id, (lat, lng) in self._locations.items()]
+                ids, lats_rad, lngs_rad, cos_lats = _pack(points)
+                positions = {store_id: i for i, store_id in enumerate(ids.tolist())}
+                packed = self._packed = (positions, ids, lats_rad, lngs_rad, cos_lats)
+        return packed
+
+    def _ring_cells(self, cells, row, col, ring):
+        """Yield the (points, packed) entries of occupied cells exactly `ring` cells away"""
+        if ring == 0:
+            points = cells.get((row, col))
+            if points:
+                yield points
+            return
+
+        # Sparse grids: walking the occupied cells is cheaper than the ring
+        if 8 * ring > len(cells):
+            for (r, c), points in list(cells.items()):
+                if max(abs(r - row), abs(c - col)) == ring:
+                    yield points
+            return
+
+        for c in range(col - ring, col + ring + 1):
+            for r in (row - ring, row + ring):
+                points = cells.get((r, c))
+                if points:
+                    yield points
+        for r in range(row - ring + 1, row + ring):
+            for c in (col - ring, col + ring):
+                points = cells.get((r, c))
+                if points:
+                    yield points
+
+    def _ring_bound(self, lat, lng, row, col, ring):
+        """Lower bound on the distance to any store outside the scanned rings"""
+        size = self.cell_size
+        min_lat, max_lat = (row - ring) * size, (row + ring + 1) * size
+        min_lng, max_lng = (col - ring) * size, (col + ring + 1) * size
+
+        lat_gap = min(lat - min_lat, max_lat - lat)
+        lat_bound = lat_gap * KM_PER_DEGREE
+
+        # The shortest crossing of a longitude gap happens at the highest
+        # latitude inside the scanned band
+        lng_gap = min(lng - min_lng, max_lng - lng, 180)
+        band_lat = min(max(abs(min_lat), abs(max_lat)), 90)
+        lng_bound = calculate_distance(band_lat, 0, band_lat, lng_gap)
+
+        return min(lat_bound, lng_bound)
@@ -0,0 +1,357 @@
+"""
+Request instrumentation
+Per-request stage timers and SQL counters, latency histograms exported in
+the Prometheus text format, and an opt-in sampling profiler that writes the
+stacks of slow requests as folded stacks ("frame;frame;frame count" lines,
+the input of flamegraph.pl and speedscope). With the profiler off, a stage
+costs two clock reads and a histogram update.
+"""
+
+import bisect
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SQL_OPERATIONS = frozenset(['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'PRAGMA'])
+
+_trace = contextvars.ContextVar('request_trace', default=None)
+_untimed = nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1  # index len(buckets) is the +Inf overflow
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in sorted(self._series.items())}
+        for label_values, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{_number(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {_number(values[-1])}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, value in series:
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {_number(value)}')
+        return lines
+
+
+class Gauges:
+    """Gauges read from a callback returning {name: number} when metrics are rendered"""
+
+    def __init__(self, prefix, help_text, read):
+        self.prefix = prefix
+        self.help = help_text
+        self.read = read
+
+    def render(self):
+        lines = []
+        try:
+            values = self.read()
+        except Exception:
+            logger.exception("Reading %s gauges failed", self.prefix)
+            return lines
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+            lines += [f'# HELP {name} {self.help}: {key}', f'# TYPE {name} gauge', f'{name} {_number(value)}']
+        return lines
+
+
+class RequestTrace:
+    """What one request spent its time on"""
+
+    __slots__ = ('started', 'stages', 'sql_count', 'sql_seconds', 'samples')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}       # stage -> seconds, summed over repeats
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.samples = {}      # folded stack -> sample count, when profiling
+
+    def summary(self):
+        stages = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in self.stages.items())
+        return f"{stages or 'no stages'}; {self.sql_count} SQL queries in {self.sql_seconds * 1000:.1f}ms"
+
+
+class Stage:
+    """Context manager timing one stage; see Instrumentation.stage()"""
+
+    __slots__ = ('histogram', 'name', 'start')
+
+    def __init__(self, histogram, name):
+        self.histogram = histogram
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, self.name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages[self.name] = trace.stages.get(self.name, 0.0) + elapsed
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of threads that are serving requests every interval
+    seconds. Requests slower than the threshold get their samples written to
+    directory as a folded-stack file.
+    """
+
+    def __init__(self, directory, interval=0.005, max_dumps=1000):
+        self.directory = directory
+        self.interval = interval
+        self.max_dumps = max_dumps
+        self.dumps = 0
+        self._watched = {}  # thread id -> RequestTrace
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def watch(self, trace):
+        """Sample the calling thread into trace until unwatch()"""
+        self._watched[threading.get_ident()] = trace
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+
+    def unwatch(self):
+        self._watched.pop(threading.get_ident(), None)
+
+    def dump(self, trace, method, route, elapsed):
+        """Write a trace's samples as folded stacks; returns the path, or None"""
+        if not trace.samples or self.dumps >= self.max_dumps:
+            return None
+        self.dumps += 1
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^a-zA-Z0-9]+', '_', route).strip('_') or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.dumps}-{method}-{slug}-{elapsed * 1000:.0f}ms"
+        path = os.path.join(self.directory, name + '.folded')
+        with open(path, 'w') as f:
+            for stack, count in sorted(trace.samples.items()):
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            if not self._watched:
+                continue
+            frames = sys._current_frames()
+            for ident, trace in list(self._watched.items()):
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                trace.samples[key] = trace.samples.get(key, 0) + 1
+
+
+class Instrumentation:
+    """Stage timers, SQL counters, request histograms and the slow-request profiler for one process"""
+
+    def __init__(self, enabled=True, slow_request_ms=500, profiler=None):
+        self.enabled = enabled
+        self.slow_request = slow_request_ms / 1000
+        self.profiler = profiler
+        self.request_seconds = Histogram(
+            'freshmart_request_duration_seconds', 'HTTP request latency', ('method', 'route', 'status')
+        )
+        self.stage_seconds = Histogram(
+            'freshmart_stage_duration_seconds', 'Time spent in one stage of a request', ('stage',)
+        )
+        self.sql_seconds = Histogram('freshmart_sql_duration_seconds', 'SQL statement latency', ('operation',))
+        self.sql_per_request = Histogram(
+            'freshmart_sql_queries_per_request', 'SQL statements executed per request', ('route',), COUNT_BUCKETS
+        )
+        self.slow_requests = Counter(
+            'freshmart_slow_requests_total', f'Requests slower than {slow_request_ms} ms', ('method', 'route')
+        )
+        self.collectors = [
+            self.request_seconds, self.stage_seconds, self.sql_seconds, self.sql_per_request, self.slow_requests
+        ]
+
+    def add_gauges(self, prefix, help_text, read):
+        """Export the numbers of read() as gauges named prefix_<key>"""
+        self.collectors.append(Gauges(prefix, help_text, read))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for collector in self.collectors:
+            lines += collector.render()
+        return '\n'.join(lines) + '\n'
+
+    def stage(self, name):
+        """Context manager timing a block as a stage of the current request (and in the stage histogram)"""
+        return Stage(self.stage_seconds, name) if self.enabled else _untimed
+
+    def timed(self, name):
+        """Decorator form of stage(); returns the function itself when disabled"""
+        def decorator(fn):
+            if not self.enabled:
+                return fn
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def begin_request(self, sample=True):
+        """
+        Start tracing a request in the current context; returns a token for
+        end_request(), or None when disabled or already inside a traced
+        request. sample=False leaves profiling to watch_thread(), for requests
+        whose work runs on another thread.
+        """
+        if not self.enabled or _trace.get() is not None:
+            return None
+        trace = RequestTrace()
+        if sample and self.profiler is not None:
+            self.profiler.watch(trace)
+        return _trace.set(trace), sample
+
+    def end_request(self, token, method, route, status):
+        """Record a finished request, logging it (and dumping its profile) if it was slow"""
+        if token is None:
+            return None
+        context_token, sampled = token
+        trace = _trace.get()
+        _trace.reset(context_token)
+        if sampled and self.profiler is not None:
+            self.profiler.unwatch()
+        if trace is None:
+            return None
+
+        elapsed = time.perf_counter() - trace.started
+        self.request_seconds.observe(elapsed, method, route, str(status))
+        self.sql_per_request.observe(trace.sql_count, route)
+        if elapsed >= self.slow_request:
+            self.slow_requests.inc(method, route)
+            path = self.profiler.dump(trace, method, route, elapsed) if self.profiler is not None else None
+            logger.warning(
+                "Slow request %s %s (%s): %.1f ms; %s%s", method, route, status, elapsed * 1000, trace.summary(),
+                f'; profile in {path}' if path else ''
+            )
+        return trace
+
+    @contextmanager
+    def watch_thread(self):
+        """Profile the calling thread as part of the current request"""
+        trace = _trace.get()
+        if trace is None or self.profiler is None:
+            yield
+            return
+        self.profiler.watch(trace)
+        try:
+            yield
+        finally:
+            self.profiler.unwatch()
+
+    def install_sql_hooks(self):
+        """Count and time every SQL statement of every engine"""
+        if not self.enabled:
+            return
+        event.listen(Engine, 'before_cursor_execute', self._before_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._instrumentation_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_instrumentation_start', None)
+        if start is not None:
+            self.record_sql(statement, time.perf_counter() - start)
+
+    def record_sql(self, statement, elapsed):
+        """Count a statement run outside SQLAlchemy (e.g. through aiosqlite)"""
+        if not self.enabled:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else ''
+        self.sql_seconds.observe(elapsed, operation if operation in SQL_OPERATIONS else 'OTHER')
+        trace = _trace.get()
+        if trace is not None:
+            trace.sql_count += 1
+            trace.sql_seconds += elapsed
@@ -0,0 +1,139 @@
+"""
+Compiled intent routing for chat messages
+All intent keywords are compiled into one trie-shaped regular expression, so
+routing a message is a single scan whose cost barely depends on how many
+intents are registered.
+"""
+
+import re
+import threading
+from collections import namedtuple
+
+TOKEN_RE = re.compile(r'\b\w+\b')
+
+ParsedMessage = namedtuple('ParsedMessage', 'text lower tokens intents')
+Intent = namedtuple('Intent', 'name keywords handler priority order')
+
+
+def trie_pattern(keywords):
+    """
+    Regex source matching any of the keywords, with shared prefixes factored
+    out so the engine only follows branches that match the next character.
+    Longer keywords are preferred over their prefixes.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        group = '(?:%s)' % '|'.join(branches)
+        # Greedy '?' tries the longer keywords before stopping at this one
+        return group + '?' if '' in node else group
+
+    return build(trie)
+
+
+class IntentRouter:
+    """Registry of keyword-triggered intents dispatched by priority"""
+
+    def __init__(self, default_handler=None):
+        self.default_handler = default_handler
+        self._intents = {}
+        self._lock = threading.Lock()
+        self._compiled = None  # (pattern, keyword -> frozenset of intent names)
+
+    def register(self, name, keywords, handler, priority=0):
+        """
+        Add (or replace) an intent. A message triggers it when any keyword
+        occurs anywhere in the lowercased text; when several intents are
+        triggered the highest priority wins, and among equal priorities the
+        one registered first (a replaced intent keeps its place).
+        """
+        keywords = tuple(keyword.lower() for keyword in keywords)
+        with self._lock:
+            previous = self._intents.get(name)
+            order = previous.order if previous is not None else len(self._intents)
+            self._intents[name] = Intent(name, keywords, handler, priority, order)
+            self._compiled = None
+
+    def intent(self, name, keywords, priority=0):
+        """Decorator form of register()"""
+        def decorator(handler):
+            self.register(name, keywords, handler, priority)
+            return handler
+        return decorator
+
+    def parse(self, message):
+        """Tokenize the message once and find every intent it triggers"""
+        lower = message.lower()
+        pattern, intents_by_keyword = self._compile()
+
+        intents = set()
+        if pattern is not None:
+            for match in pattern.finditer(lower):
+                intents |= intents_by_keyword[match.group(1)]
+
+        return ParsedMessage(message, lower, TOKEN_RE.findall(lower), frozenset(intents))
+
+    def match(self, message):
+        """Return (intent or None, parsed message) without running a handler"""
+        parsed = self.parse(message)
+        best = None
+        for name in parsed.intents:
+            intent = self._intents.get(name)
+            # parsed.intents is a set, whose order varies between processes,
+            # so ties go to registration order rather than to iteration order
+            if intent is not None and (best is None or (-intent.priority, intent.order) < (-best.priority, best.order)):
+                best = intent
+        return best, parsed
+
+    def resolve(self, message):
+        """Return (handler, parsed message) for the winning intent, or the default handler"""
+        intent, parsed = self.match(message)
+        return (intent.handler if intent is not None else self.default_handler), parsed
+
+    def route(self, message, *args, **kwargs):
+        """Run the winning intent's handler as handler(parsed, *args, **kwargs)"""
+        handler, parsed = self.resolve(message)
+        return handler(parsed, *args, **kwargs)
+
+    def _compile(self):
+        compiled = self._compiled
+        if compiled is not None:
+            return compiled
+
+        with self._lock:
+            if self._compiled is not None:
+                return self._compiled
+
+            owners = {}
+            for intent in self._intents.values():
+                for keyword in intent.keywords:
+                    owners.setdefault(keyword, set()).add(intent.name)
+
+            if not owners:
+                self._compiled = (None, {})
+                return self._compiled
+
+            # The lookahead reports a match at every position, overlapping
+            # ones included, and each match is the longest keyword starting
+            # there. Any shorter keyword at the same position is a prefix of
+            # that one, so its intents are folded into the longer entry.
+            intents_by_keyword = {}
+            for keyword in owners:
+                intents = set()
+                for end in range(1, len(keyword) + 1):
+                    intents |= owners.get(keyword[:end], set())
+                intents_by_keyword[keyword] = frozenset(intents)
+
+            pattern = re.compile('(?=(%s))' % trie_pattern(owners))
+            self._compiled = (pattern, intents_by_keyword)
+            return self._compiled
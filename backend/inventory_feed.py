@@ -0,0 +1,135 @@
+"""
+Bulk inventory feeds
+POS and warehouse stock levels arrive as CSV or NDJSON. Feeds are parsed as a
+stream and handed to the writer in fixed-size chunks, so memory stays bounded
+however large the file is.
+"""
+
+import csv
+import json
+import time
+
+FEED_COLUMNS = ('store_id', 'product_id', 'quantity')
+
+# A chunk is staged in a per-connection temp table, so it can be upserted and
+# its availability change applied in a few set-based statements. Of two rows
+# for the same (store, product) the later one wins
+FEED_CHUNK_TABLE = 'feed_chunk'
+CREATE_FEED_CHUNK_SQL = (
+    f'CREATE TEMP TABLE IF NOT EXISTS {FEED_CHUNK_TABLE} ('
+    'store_id INTEGER NOT NULL, product_id INTEGER NOT NULL, quantity INTEGER NOT NULL, previous INTEGER, '
+    'PRIMARY KEY (store_id, product_id)) WITHOUT ROWID'
+)
+# Each row records the quantity it is about to replace, NULL for a new row
+STAGE_FEED_CHUNK_SQL = (
+    f'INSERT OR REPLACE INTO {FEED_CHUNK_TABLE} (store_id, product_id, quantity, previous) '
+    'SELECT ?1, ?2, ?3, (SELECT quantity FROM inventory WHERE store_id = ?1 AND product_id = ?2)'
+)
+CLEAR_FEED_CHUNK_SQL = f'DELETE FROM {FEED_CHUNK_TABLE}'
+
+# Absolute stock levels: a row replaces the quantity for its (store, product)
+UPSERT_INVENTORY_SQL = (
+    'INSERT INTO inventory (store_id, product_id, quantity, last_updated) '
+    f'SELECT store_id, product_id, quantity, CURRENT_TIMESTAMP FROM {FEED_CHUNK_TABLE} WHERE 1 '
+    'ON CONFLICT(store_id, product_id) DO UPDATE SET '
+    'quantity = excluded.quantity, last_updated = excluded.last_updated'
+)
+
+
+def parse_csv(lines):
+    """Yield (line number, values or None, error or None) for a CSV feed with a header row"""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [column.strip().lower() for column in header]
+    missing = [column for column in FEED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+    store_at, product_at, quantity_at = (header.index(column) for column in FEED_COLUMNS)
+    width = max(store_at, product_at, quantity_at) + 1
+
+    for line_number, fields in enumerate(reader, start=2):
+        if not fields:
+            continue
+        if len(fields) < width:
+            yield line_number, None, 'Missing columns'
+            continue
+        try:
+            yield line_number, (int(fields[store_at]), int(fields[product_at]), int(fields[quantity_at])), None
+        except ValueError:
+            yield line_number, None, 'store_id, product_id and quantity must be integers'
+
+
+def parse_ndjson(lines):
+    """Yield (line number, values or None, error or None) for an NDJSON feed"""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            values = tuple(record[column] for column in FEED_COLUMNS)
+        except (ValueError, KeyError, TypeError):
+            yield line_number, None, 'Expected an object with store_id, product_id and quantity'
+            continue
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            yield line_number, None, 'store_id, product_id and quantity must be integers'
+            continue
+        yield line_number, values, None
+
+
+FEED_PARSERS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+
+
+def ingest_feed(lines, feed_format, write_chunk, chunk_size=10000,
+                known_stores=None, known_products=None, max_errors=100):
+    """
+    Parse a feed and pass lists of (store_id, product_id, quantity) tuples to
+    write_chunk, one transaction per chunk. Returns counters, the set of
+    touched store ids and the first max_errors rejected lines. Chunks already
+    written stay written if a later one fails; the exception is re-raised
+    with the partial result attached as `result`.
+    """
+    parse = FEED_PARSERS[feed_format]
+    result = {'rows': 0, 'applied': 0, 'rejected': 0, 'chunks': 0, 'errors': [], 'stores': set()}
+    start = time.perf_counter()
+    chunk = []
+
+    def reject(line_number, error):
+        result['rejected'] += 1
+        if len(result['errors']) < max_errors:
+            result['errors'].append({'line': line_number, 'error': error})
+
+    def flush():
+        write_chunk(chunk)
+        result['applied'] += len(chunk)
+        result['chunks'] += 1
+        result['stores'].update(row[0] for row in chunk)
+        chunk.clear()
+
+    try:
+        for line_number, values, error in parse(lines):
+            result['rows'] += 1
+            if error:
+                reject(line_number, error)
+                continue
+            store_id, product_id, quantity = values
+            if quantity < 0:
+                reject(line_number, 'quantity cannot be negative')
+            elif known_stores is not None and store_id not in known_stores:
+                reject(line_number, f'Unknown store {store_id}')
+            elif known_products is not None and product_id not in known_products:
+                reject(line_number, f'Unknown product {product_id}')
+            else:
+                chunk.append(values)
+                if len(chunk) >= chunk_size:
+                    flush()
+        if chunk:
+            flush()
+    except Exception as e:
+        result['elapsed'] = time.perf_counter() - start
+        e.result = result
+        raise
+
+    result['elapsed'] = time.perf_counter() - start
+    return result
@@ -0,0 +1,49 @@
+"""
+Query plan checks
+Runs EXPLAIN QUERY PLAN on SQLAlchemy statements against SQLite and reports
+the ones that read a whole table instead of searching an index.
+"""
+
+import re
+
+# "SCAN inventory" reads every row; "SCAN product USING INDEX ..." walks an
+# index in order and "SEARCH ..." seeks one, so neither counts
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+# Views and subqueries SQLite evaluates separately; scanning their output is not a table scan
+SUBQUERY_RE = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+
+
+def driver_sql(statement, dialect, params=None):
+    """(SQL string, positional parameters) for running a statement on a raw DB-API connection"""
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    values = compiled.construct_params(params or {})
+    return compiled.string, tuple(values[name] for name in compiled.positiontup)
+
+
+def explain(connection, statement, params=None):
+    """EXPLAIN QUERY PLAN detail lines for a statement, run on a SQLAlchemy connection"""
+    sql, positional = driver_sql(statement, connection.dialect, params)
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', positional).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Tables a plan reads in full"""
+    subqueries = {match.group(1) for match in map(SUBQUERY_RE.match, plan) if match}
+    return [
+        match.group(1) for match in map(FULL_SCAN_RE.match, plan)
+        if match and match.group(1) not in subqueries
+    ]
+
+
+def check_query_plans(connection, queries):
+    """
+    Explain each (name, statement, params) query; returns a list of
+    (name, plan lines, fully scanned tables), one per query, in order.
+    """
+    results = []
+    for name, statement, params in queries:
+        plan = explain(connection, statement, params)
+        results.append((name, plan, full_scans(plan)))
+    return results
@@ -0,0 +1,81 @@
+"""
+Store ranking for chat product searches
+Every store holding some of the requested products gets a single score
+from its distance, its stock of those products and the search relevance of
+the ones it has; lower is better. Only the best k are selected
+(argpartition), so no handler sorts every candidate to keep a few.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from geo import smallest_k
+
+
+class RankingWeights(namedtuple('RankingWeights', 'distance stock text stock_cap')):
+    """
+    distance: score per km; stock: bonus for holding stock_cap or more of
+    every requested product; text: bonus for holding all of the requested
+    products' search relevance. Bonuses are in the same units as distance.
+    """
+
+    __slots__ = ()
+
+    def relevance_key(self, product_ids, relevance):
+        """The part of relevance that store scores depend on, for cache keys"""
+        if not self.text or not relevance:
+            return None
+        return tuple(relevance.get(product_id, 0) for product_id in product_ids)
+
+
+def store_scores(weights, distances, stocks, product_ids, relevance=None):
+    """
+    Scores for stores given their distances (km) and in-stock products
+    ([{'product_id', 'quantity'}] lists aligned with distances):
+    distance * km - stock * stock level - text * relevance share
+    """
+    scores = weights.distance * distances if weights.distance else np.zeros(len(distances))
+
+    if weights.stock:
+        cap = weights.stock_cap
+        levels = np.fromiter(
+            (sum(min(item['quantity'], cap) for item in stock) for stock in stocks),
+            dtype=np.float64, count=len(stocks)
+        )
+        scores = scores - weights.stock * levels / (cap * len(product_ids))
+
+    if weights.text:
+        # Without search scores every requested product counts the same
+        weight_of = relevance.get if relevance else (lambda product_id, default: 1)
+        total = sum(weight_of(product_id, 0) for product_id in product_ids)
+        if total:
+            shares = np.fromiter(
+                (sum(weight_of(item['product_id'], 0) for item in stock) for stock in stocks),
+                dtype=np.float64, count=len(stocks)
+            )
+            scores = scores - weights.text * shares / total
+
+    return scores
+
+
+def without_distances(store_ids):
+    """(store ids, zero distances) arrays, for ranking stores when the user's location is unknown"""
+    ids = np.fromiter(store_ids, dtype=np.int64, count=len(store_ids))
+    return ids, np.zeros(len(ids))
+
+
+def top_stores(ids, distances, scores, k=None):
+    """Up to k (store_id, distance_km) pairs with the lowest scores, best first"""
+    order = smallest_k(scores, k)
+    return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+
+def score_bound(scores, k, weights, radius_km):
+    """
+    Scores measured from a cell's center move by at most distance * radius
+    anywhere in the cell, so a store scoring above the k-th best plus twice
+    that can never be in the top k for a point of the cell
+    """
+    kth = np.partition(scores, k - 1)[k - 1]
+    return kth + 2 * weights.distance * radius_km
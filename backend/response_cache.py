@@ -0,0 +1,157 @@
+"""
+Precomputed JSON response cache
+Serialized bodies (plus gzip/brotli variants) are kept in a size-bounded LRU
+keyed by path, query string and catalog version, and served with strong
+ETags so repeat clients can revalidate with a bodyless 304.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip variants are always built
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+class CachedBody:
+    """One serialized response body and its pre-compressed variants"""
+
+    __slots__ = ('body', 'etag', 'variants', 'size')
+
+    def __init__(self, body, min_compress_size):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {}
+        if len(body) >= min_compress_size:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.size = len(body) + sum(len(v) for v in self.variants.values())
+
+    def etags(self):
+        """Strong ETags of every representation of this body"""
+        return [self.etag] + [f'{self.etag}-{encoding}' for encoding in self.variants]
+
+
+class ResponseCache:
+    """LRU cache of serialized JSON responses bounded by total bytes"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, min_compress_size=1024):
+        self.max_bytes = max_bytes
+        self.min_compress_size = min_compress_size
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Return the cached body for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, body):
+        """Serialize variants for body, cache them under key and return the entry"""
+        entry = CachedBody(body, self.min_compress_size)
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats['evictions'] += 1
+        return entry
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit-rate and size counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def respond(self, entry):
+        """Build the response for entry, honouring If-None-Match and Accept-Encoding"""
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in entry.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        etag = f'{entry.etag}-{encoding}' if encoding else entry.etag
+
+        # A 304 echoes the ETag the client matched (when several match, the
+        # one of the representation it would get now), not always the base one
+        matched = next(
+            (candidate for candidate in [etag] + entry.etags() if request.if_none_match.contains(candidate)),
+            None
+        )
+        if matched is not None:
+            with self._lock:
+                self._stats['not_modified'] += 1
+            response = Response(status=304)
+            response.set_etag(matched)
+        else:
+            if encoding:
+                response = Response(entry.variants[encoding], mimetype='application/json')
+                response.headers['Content-Encoding'] = encoding
+            else:
+                response = Response(entry.body, mimetype='application/json')
+            response.set_etag(etag)
+
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def cached(self, version_getter, skip_if=None):
+        """
+        Decorator caching a JSON view per path, query string and data version.
+        Requests for which skip_if() is true (e.g. streamed ones) bypass the cache.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if skip_if is not None and skip_if():
+                    return view(*args, **kwargs)
+                key = (
+                    request.path,
+                    tuple(sorted(request.args.items(multi=True))),
+                    version_getter()
+                )
+                entry = self.get(key)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    # Errors are never cached
+                    if response.status_code != 200:
+                        return response
+                    entry = self.put(key, response.get_data())
+                return self.respond(entry)
+            return wrapper
+        return decorator
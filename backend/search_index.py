@@ -0,0 +1,261 @@
+"""
+In-memory trigram index for product search
+Narrows fuzzy product searches to a small candidate set before scoring;
+the rest of the catalog is only scored when the candidates leave the
+results short
+"""
+
+import heapq
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from fuzzywuzzy import fuzz
+
+NGRAM_SIZE = 3
+MAX_SCORE = 100
+
+
+def make_ngrams(text, n=NGRAM_SIZE):
+    """Return the set of space-padded character n-grams of a string"""
+    if not text:
+        return set()
+    padded = f" {text.lower()} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+@lru_cache(maxsize=None)
+def unmatched_score_bound(length, n=NGRAM_SIZE):
+    """
+    Highest partial_ratio of two strings sharing no n-gram, the shorter of
+    them `length` characters long. They can only match in runs of fewer
+    than n characters with a skipped character between runs, which caps
+    the matched characters of every window partial_ratio compares.
+    """
+    run = n - 1
+    best = 0
+    for window in range(1, length + 1):
+        total = length + window
+        matched = min(window, run * (total + 1) // (2 * run + 1))
+        ratio = 2 * matched / total
+        if ratio > .995:
+            return MAX_SCORE
+        best = max(best, int(round(MAX_SCORE * ratio)))
+    return best
+
+
+class ProductSearchIndex:
+    """Trigram inverted index over product name, category and description"""
+
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self.built = False
+        self._lock = threading.RLock()
+        self._docs = {}                    # product_id -> (name, category, description)
+        self._grams = {}                   # product_id -> set of n-grams
+        self._postings = defaultdict(set)  # n-gram -> product ids
+        self._lengths = Counter()          # field length -> number of non-empty fields that long
+        self._stats = {'searches': 0, 'scored': 0, 'full_scans': 0}
+
+    def build(self, products):
+        """(Re)build the whole index from an iterable of products"""
+        docs = {}
+        grams = {}
+        postings = defaultdict(set)
+
+        for product in products:
+            doc = self._make_doc(product.name, product.category, product.description)
+            product_grams = self._doc_grams(doc)
+            docs[product.id] = doc
+            grams[product.id] = product_grams
+            for gram in product_grams:
+                postings[gram].add(product.id)
+
+        with self._lock:
+            self._docs = docs
+            self._grams = grams
+            self._postings = postings
+            self._lengths = self._field_lengths(docs.values())
+            self.built = True
+
+    def upsert(self, product_id, name, category, description):
+        """Add a product to the index or replace its indexed text"""
+        doc = self._make_doc(name, category, description)
+        product_grams = self._doc_grams(doc)
+
+        with self._lock:
+            self._remove_postings(product_id)
+            self._count_lengths(self._docs.get(product_id), -1)
+            self._count_lengths(doc, 1)
+            self._docs[product_id] = doc
+            self._grams[product_id] = product_grams
+            for gram in product_grams:
+                self._postings[gram].add(product_id)
+
+    def remove(self, product_id):
+        """Drop a product from the index"""
+        with self._lock:
+            self._remove_postings(product_id)
+            self._count_lengths(self._docs.pop(product_id, None), -1)
+            self._grams.pop(product_id, None)
+
+    def candidates(self, query):
+        """Return ids of products sharing at least one n-gram with the query"""
+        query = query.lower().strip()
+
+        with self._lock:
+            # Queries too short to produce a full n-gram, or with no overlap
+            # at all (heavy typos), fall back to scoring the whole catalog
+            if len(query) < self.n:
+                return sorted(self._docs)
+
+            matched = set()
+            for gram in make_ngrams(query, self.n):
+                matched.update(self._postings.get(gram, ()))
+
+            if not matched:
+                return sorted(self._docs)
+            return sorted(matched)
+
+    def search(self, query, threshold=60, limit=None, accept=None):
+        """Return product ids ranked by fuzzy score, highest first"""
+        return [product_id for product_id, _ in self.search_scored(query, threshold, limit, accept)]
+
+    def search_scored(self, query, threshold=60, limit=None, accept=None):
+        """
+        Return (product id, score) pairs ranked by fuzzy score, highest first
+        and ties in id order. With a limit only the best `limit` are kept, in
+        a bounded heap; accept optionally filters product ids before scoring.
+
+        Only products sharing an n-gram with the query are scored, unless
+        none of them matched (or, with a limit, fewer than `limit` did):
+        then the rest of the catalog is scored too, when any of it could
+        reach the threshold. So a weak match sharing no n-gram with the
+        query (e.g. 'tea' in 'vegetables') is only returned when the
+        candidates leave room for it.
+        """
+        if limit is not None and limit <= 0:
+            return []
+        query_lower = query.lower()
+        matches = []
+        heap = []  # (score, -product_id) of the best `limit` so far, worst on top
+        scored = 0
+
+        def collect(product_ids):
+            nonlocal scored
+            for product_id in product_ids:
+                if accept is not None and not accept(product_id):
+                    continue
+                score = self._score(query_lower, product_id)
+                scored += 1
+                if score is None or score < threshold:
+                    continue
+
+                if limit is None:
+                    matches.append((product_id, score))
+                    continue
+                entry = (score, -product_id)
+                if len(heap) < limit:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                # Ids come in increasing order, so once the worst kept
+                # product scores perfectly with a lower id no later one can
+                # displace any of them
+                if len(heap) == limit and heap[0] >= (MAX_SCORE, -product_id):
+                    break
+
+        candidates = self.candidates(query)
+        collect(candidates)
+
+        with self._lock:
+            full_scan = len(candidates) >= len(self._docs)
+        short = len(heap) < limit if limit is not None else not matches
+        if short and not full_scan and self.unmatched_bound(query) >= threshold:
+            candidate_ids = set(candidates)
+            with self._lock:
+                rest = [product_id for product_id in sorted(self._docs) if product_id not in candidate_ids]
+            collect(rest)
+            full_scan = True
+
+        with self._lock:
+            self._stats['searches'] += 1
+            self._stats['scored'] += scored
+            self._stats['full_scans'] += full_scan
+
+        if limit is not None:
+            return [(-negative_id, score) for score, negative_id in sorted(heap, reverse=True)]
+        matches.sort(key=lambda x: (-x[1], x[0]))
+        return matches
+
+    def unmatched_bound(self, query):
+        """Highest score a product sharing no n-gram with the query can reach"""
+        stripped = query.lower().strip()
+        # Queries candidates() can't narrow, or whose padding its n-grams
+        # don't cover, get no bound
+        if len(stripped) < self.n or stripped != query.lower():
+            return MAX_SCORE
+        with self._lock:
+            lengths = list(self._lengths)
+        return max((unmatched_score_bound(min(len(stripped), length), self.n) for length in lengths), default=0)
+
+    def stats(self):
+        """Searches run, products scored for them and searches that had to score the whole catalog"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['products'] = len(self._docs)
+        return stats
+
+    def export_postings(self):
+        """Sorted (n-gram, sorted product ids) pairs, for publishing the index to other processes"""
+        with self._lock:
+            return sorted((gram, sorted(ids)) for gram, ids in self._postings.items())
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _make_doc(self, name, category, description):
+        return (
+            (name or '').lower(),
+            (category or '').lower(),
+            description.lower() if description else None
+        )
+
+    def _score(self, query_lower, product_id):
+        """Best partial_ratio of the query over a product's fields, or None if it isn't indexed"""
+        doc = self._docs.get(product_id)
+        if doc is None:
+            return None
+        name, category, description = doc
+
+        # The score is the best of the three fields, so stop at a perfect one
+        score = fuzz.partial_ratio(query_lower, name)
+        if score < MAX_SCORE:
+            score = max(score, fuzz.partial_ratio(query_lower, category))
+        if score < MAX_SCORE and description:
+            score = max(score, fuzz.partial_ratio(query_lower, description))
+        return score
+
+    def _field_lengths(self, docs):
+        return Counter(len(field) for doc in docs for field in doc if field)
+
+    def _count_lengths(self, doc, sign):
+        for field in doc or ():
+            if field:
+                self._lengths[len(field)] += sign
+                if not self._lengths[len(field)]:
+                    del self._lengths[len(field)]
+
+    def _doc_grams(self, doc):
+        grams = set()
+        for field in doc:
+            grams |= make_ngrams(field, self.n)
+        return grams
+
+    def _remove_postings(self, product_id):
+        for gram in self._grams.get(product_id, ()):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(product_id)
+                if not posting:
+                    del self._postings[gram]
@@ -0,0 +1,196 @@
+"""
+Per-session chat context
+Follow-up turns such as "where can I buy that?" need what the session's
+previous turns resolved. Each session's context (its recent intents, the
+products its last search found with their scores, and its last location) is
+kept as compact JSON in a bounded LRU with a TTL, and an entry is trimmed to
+fit max_entry_bytes (oldest intents first, then the lowest-ranked products),
+so the store holds at most max_sessions * max_entry_bytes of context.
+Optionally, entries evicted while still live are handed to a spill callback
+(e.g. a SQLite table) and read back through a load callback on a later miss;
+until the spill reports them written with spilled(), they are also served
+from memory, so a write-behind spill loses nothing in between.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# intents: names, oldest first; products: (product_id, score) pairs, best
+# first; location: {'lat', 'lng'} or None
+SessionContext = namedtuple('SessionContext', 'intents products location')
+
+EMPTY_CONTEXT = SessionContext((), (), None)
+
+
+def encode_context(context):
+    return json.dumps({
+        'i': list(context.intents),
+        'p': [list(product) for product in context.products],
+        'l': [context.location['lat'], context.location['lng']] if context.location else None
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def decode_context(data):
+    value = json.loads(data)
+    location = value.get('l')
+    return SessionContext(
+        tuple(value.get('i', ())),
+        tuple((product_id, score) for product_id, score in value.get('p', ())),
+        {'lat': location[0], 'lng': location[1]} if location else None
+    )
+
+
+class SessionContextStore:
+    """Thread-safe LRU + TTL map of session id -> SessionContext, capped per entry"""
+
+    def __init__(self, max_sessions=10000, ttl=1800, max_entry_bytes=1024, max_intents=5,
+                 spill=None, load=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.max_intents = max_intents
+        self.spill = spill    # callable(session_id, data, expires_at) for live entries evicted; False if dropped
+        self.load = load      # callable(session_id) -> (data, expires_at) or None
+        self._entries = OrderedDict()  # session_id -> (expires_at, encoded context)
+        self._pending = {}             # session_id -> (encoded context, expires_at) not yet written by the spill
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                       'spilled': 0, 'restored': 0, 'trimmed': 0}
+
+    def get(self, session_id):
+        """The session's context, or None if it has none (or it expired)"""
+        if not session_id or self.max_sessions <= 0:
+            return None
+        data = self._lookup(session_id, True)
+        if data is not None:
+            return decode_context(data)
+
+        now = time.time()
+        with self._lock:
+            restored = self._pending.pop(session_id, None)
+        if restored is None and self.load is not None:
+            restored = self.load(session_id)
+        with self._lock:
+            if restored is None or restored[1] <= now:
+                self._stats['misses'] += 1
+                return None
+            self._stats['restored'] += 1
+            evicted = []
+            if session_id not in self._entries:
+                evicted = self._put(session_id, restored[1], restored[0])
+        self._spill(evicted)
+        return decode_context(restored[0])
+
+    def update(self, session_id, intent=None, products=None, location=None):
+        """
+        Record a turn: intent is appended to the recent intents, and products
+        ([(product_id, score)], best first) and location replace the
+        remembered ones when given. Restarts the session's TTL. Builds on
+        the context in memory, so get() the session first to restore a
+        spilled one.
+        """
+        if not session_id or self.max_sessions <= 0:
+            return
+        data = self._lookup(session_id, False)
+        context = decode_context(data) if data is not None else EMPTY_CONTEXT
+        intents = context.intents + (intent,) if intent else context.intents
+        context = SessionContext(
+            intents[-self.max_intents:],
+            tuple((product_id, score) for product_id, score in products) if products is not None else context.products,
+            {'lat': location['lat'], 'lng': location['lng']} if location else context.location
+        )
+        data = self._fit(context)
+        with self._lock:
+            evicted = self._put(session_id, time.time() + self.ttl, data)
+        self._spill(evicted)
+
+    def spilled(self, session_id, data):
+        """Called by the spill once (session_id, data) is written, so it can leave memory"""
+        with self._lock:
+            entry = self._pending.get(session_id)
+            if entry is not None and entry[0] == data:
+                del self._pending[session_id]
+
+    def clear(self):
+        """Forget every session kept in memory"""
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Size, hit-rate and eviction counters, and the TTL in seconds"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['ttl'] = self.ttl
+            stats['sessions'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['pending'] = len(self._pending)
+        lookups = stats['hits'] + stats['misses'] + stats['restored']
+        stats['hit_rate'] = round((stats['hits'] + stats['restored']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _lookup(self, session_id, count):
+        """The session's live encoded context in memory, or None; count says whether it is a hit"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] > time.time():
+                self._entries.move_to_end(session_id)
+                self._stats['hits'] += count
+                return entry[1]
+            self._remove(session_id)
+            self._stats['expired'] += 1
+            return None
+
+    def _fit(self, context):
+        """Encode context, dropping its oldest intents then its last products until it fits"""
+        data = encode_context(context)
+        if len(data) <= self.max_entry_bytes:
+            return data
+        with self._lock:
+            self._stats['trimmed'] += 1
+        intents, products = list(context.intents), list(context.products)
+        while len(data) > self.max_entry_bytes and (len(intents) > 1 or products):
+            if len(intents) > 1:
+                intents.pop(0)
+            else:
+                products.pop()
+            data = encode_context(SessionContext(tuple(intents), tuple(products), context.location))
+        return data
+
+    def _put(self, session_id, expires_at, data):
+        """Store an entry; returns the live (session_id, data, expires_at) entries evicted for room"""
+        self._remove(session_id)
+        self._entries[session_id] = (expires_at, data)
+        self._bytes += len(data)
+
+        evicted = []
+        now = time.time()
+        while len(self._entries) > self.max_sessions:
+            oldest, (oldest_expires, oldest_data) = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+            if oldest_expires > now:
+                evicted.append((oldest, oldest_data, oldest_expires))
+        return evicted
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _spill(self, evicted):
+        if self.spill is None or not evicted:
+            return
+        for session_id, data, expires_at in evicted:
+            with self._lock:
+                self._pending[session_id] = (data, expires_at)
+            if self.spill(session_id, data, expires_at) is False:
+                self.spilled(session_id, data)
+        with self._lock:
+            self._stats['spilled'] += len(evicted)
@@ -0,0 +1,569 @@
+"""
+Shared-memory catalog for multi-process serving
+A supervisor process owns the database-backed Catalog and writes every new
+snapshot to an image file (in /dev/shm when the OS has it): a JSON header with
+products and stores, then flat numpy arrays for the inventory, the lookups
+derived from it and the search index postings. Each image starts from the
+previous one's arrays and converts only the stores whose inventory changed.
+Workers mmap the current image and read those arrays in place, so the
+stores x products part of the catalog exists once however many workers
+there are; only products and stores are decoded per worker. Workers send invalidations to the supervisor over a
+localhost UDP socket and switch to the next image on their next read.
+"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections.abc import Mapping, Sequence
+from types import MappingProxyType
+
+import numpy as np
+
+from catalog import CATALOG_PARTS, CatalogSnapshot, ProductRecord, StoreInventory, StoreRecord
+from search_index import ProductSearchIndex, make_ngrams
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FMCATv1\n'
+ALIGN = 64
+POINTER_FILE = 'current.json'
+NULL_QUANTITY = np.iinfo(np.int64).min  # stands in for a NULL inventory quantity
+PRODUCT_MASK = 0xFFFFFFFF               # (store_id << 32) | product_id pair keys
+MAX_DATAGRAM = 60000
+KEEP_IMAGES = 2                         # readers may still be switching to the latest one
+INVENTORY_COLUMNS = ('inventory_stores', 'inventory_products', 'inventory_quantities')
+POSTING_ARRAYS = ('gram_keys', 'gram_offsets', 'gram_products')
+
+
+def default_directory():
+    """A fresh directory for catalog images, in shared memory when available"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    return tempfile.mkdtemp(prefix='freshmart-catalog-', dir=base)
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _groups(keys):
+    """(unique keys, offsets) of a sorted key array, for CSR lookups"""
+    if not len(keys):
+        return keys, np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.append(starts, len(keys)).astype(np.int64)
+
+
+def _quantities(values, has_null):
+    values = values.tolist()
+    if has_null:
+        return [None if q == NULL_QUANTITY else q for q in values]
+    return values
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def inventory_columns(inventory, previous=None):
+    """
+    (stores, products, quantities) arrays of the inventory rows, ordered by
+    store. previous is (inventory, columns) of an earlier image: when both
+    are StoreInventory, only the rows of stores that changed since are
+    converted and spliced into the earlier columns.
+    """
+    changed = None
+    if previous is not None and isinstance(inventory, StoreInventory) and isinstance(previous[0], StoreInventory):
+        changed = sorted(inventory.changed_stores(previous[0]))
+    if changed is None or len(changed) > len(inventory.by_store) // 2:
+        rows = inventory
+    else:
+        rows = [(store_id, product_id, quantity)
+                for store_id in changed
+                for product_id, quantity in inventory.by_store.get(store_id, ())]
+
+    count = len(rows)
+    stores = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+    products = np.fromiter((row[1] for row in rows), dtype=np.int64, count=count)
+    quantities = np.fromiter(
+        (NULL_QUANTITY if row[2] is None else row[2] for row in rows), dtype=np.int64, count=count
+    )
+    if rows is inventory:
+        if count and np.any(np.diff(stores) < 0):
+            order = np.argsort(stores, kind='stable')
+            stores, products, quantities = stores[order], products[order], quantities[order]
+        return stores, products, quantities
+
+    # Drop the changed stores' old rows, then insert their new rows where the
+    # stores sort; np.insert keeps rows inserted at the same position in order
+    old_stores, old_products, old_quantities = previous[1]
+    keep = ~np.isin(old_stores, changed)
+    old_stores, old_products, old_quantities = old_stores[keep], old_products[keep], old_quantities[keep]
+    positions = np.searchsorted(old_stores, stores)
+    return (
+        np.insert(old_stores, positions, stores),
+        np.insert(old_products, positions, products),
+        np.insert(old_quantities, positions, quantities),
+    )
+
+
+def inventory_arrays(stores, products, quantities):
+    """The inventory columns and the lookups derived from them"""
+    # The first row per (store, product) wins, as in CatalogSnapshot.stock
+    pairs, first = np.unique((stores << 32) | products, return_index=True)
+    stock_quantities = quantities[first]
+
+    # product -> (store, quantity), stores ascending like the dict version;
+    # the pairs are unique, so sorting them product-major needs no stable sort
+    by_product = np.argsort(((pairs & PRODUCT_MASK) << 32) | (pairs >> 32))
+    product_keys, product_offsets = _groups((pairs & PRODUCT_MASK)[by_product])
+    store_keys, store_offsets = _groups(stores)
+    return {
+        'inventory_stores': stores,
+        'inventory_products': products,
+        'inventory_quantities': quantities,
+        'store_keys': store_keys,
+        'store_offsets': store_offsets,
+        'stock_keys': pairs,
+        'stock_quantities': stock_quantities,
+        'product_keys': product_keys,
+        'product_offsets': product_offsets,
+        'product_stores': pairs[by_product] >> 32,
+        'product_quantities': stock_quantities[by_product],
+    }
+
+
+def posting_arrays(postings):
+    """Sorted gram keys and CSR product ids for the search postings"""
+    grams = [gram.encode('utf-8') for gram, _ in postings]
+    width = max((len(gram) for gram in grams), default=1)
+    return {
+        'gram_keys': np.array(grams, dtype=f'S{width}'),
+        'gram_offsets': np.cumsum([0] + [len(ids) for _, ids in postings], dtype=np.int64),
+        'gram_products': np.fromiter((pid for _, ids in postings for pid in ids), dtype=np.int64),
+    }
+
+
+def image_arrays(snapshot, postings, previous=None):
+    """
+    Flat arrays for a snapshot's inventory lookups and the search postings.
+    previous is (inventory, postings, arrays) of the last image written; what
+    did not change since is taken from its arrays.
+    """
+    last_inventory, last_postings, last_arrays = previous or (None, None, None)
+    if last_arrays is None:
+        arrays = inventory_arrays(*inventory_columns(snapshot.inventory))
+    elif last_inventory is snapshot.inventory:
+        arrays = {name: array for name, array in last_arrays.items() if name not in POSTING_ARRAYS}
+    else:
+        columns = tuple(last_arrays[name] for name in INVENTORY_COLUMNS)
+        arrays = inventory_arrays(*inventory_columns(snapshot.inventory, (last_inventory, columns)))
+
+    if last_arrays is not None and last_postings is postings:
+        arrays.update((name, last_arrays[name]) for name in POSTING_ARRAYS)
+    else:
+        arrays.update(posting_arrays(postings))
+    return arrays
+
+
+def write_image(path, snapshot, postings, previous=None):
+    """
+    Write a snapshot and search postings to an image file, atomically, and
+    return the arrays written; previous is passed on to image_arrays
+    """
+    arrays = image_arrays(snapshot, postings, previous)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = [offset, array.dtype.str, len(array)]
+        offset += array.nbytes
+
+    header = json.dumps({
+        'version': snapshot.version,
+        'versions': snapshot.versions,
+        'published_at': time.time(),
+        'products': [list(p) for p in snapshot.products],
+        'stores': [list(s[:7]) + [list(s.services)] for s in snapshot.stores],
+        'has_null_quantity': bool(np.any(arrays['inventory_quantities'] == NULL_QUANTITY)),
+        'arrays': layout,
+    }).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + layout[name][0] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp, path)
+    return arrays
+
+
+class CatalogImage:
+    """A mapped catalog image; its arrays are read-only views of the mapping"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a catalog image')
+        header_end = len(MAGIC) + 8
+        header_size = int.from_bytes(self._map[len(MAGIC):header_end], 'little')
+        self.header = json.loads(self._map[header_end:header_end + header_size])
+        self.size = len(self._map)
+
+        data_start = _align(header_end + header_size)
+        self.arrays = {
+            name: np.frombuffer(self._map, dtype=dtype, count=count, offset=data_start + offset)
+            if count else np.empty(0, dtype=dtype)
+            for name, (offset, dtype, count) in self.header['arrays'].items()
+        }
+
+
+class StockView(Mapping):
+    """(store_id, product_id) -> quantity, looked up in sorted pair keys"""
+
+    def __init__(self, keys, quantities, has_null):
+        self._keys = keys
+        self._quantities = quantities
+        self._has_null = has_null
+
+    def __getitem__(self, key):
+        store_id, product_id = key
+        pair = (store_id << 32) | product_id
+        i = int(np.searchsorted(self._keys, pair))
+        if i < len(self._keys) and self._keys[i] == pair:
+            quantity = int(self._quantities[i])
+            return None if self._has_null and quantity == NULL_QUANTITY else quantity
+        raise KeyError(key)
+
+    def __iter__(self):
+        for pair in self._keys.tolist():
+            yield (pair >> 32, pair & PRODUCT_MASK)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class GroupView(Mapping):
+    """key -> tuple of (id, quantity) pairs, over CSR arrays"""
+
+    def __init__(self, keys, offsets, ids, quantities, has_null):
+        self._keys = keys
+        self._offsets = offsets
+        self._ids = ids
+        self._quantities = quantities
+        self._has_null = has_null
+
+    def __getitem__(self, key):
+        i = int(np.searchsorted(self._keys, key))
+        if i >= len(self._keys) or self._keys[i] != key:
+            raise KeyError(key)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return tuple(zip(self._ids[start:end].tolist(), _quantities(self._quantities[start:end], self._has_null)))
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class InventoryRows(Sequence):
+    """The image's (store_id, product_id, quantity) rows, in catalog order"""
+
+    def __init__(self, stores, products, quantities, has_null):
+        self._columns = (stores, products, quantities)
+        self._has_null = has_null
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        stores, products, quantities = self._columns
+        quantity = int(quantities[index])
+        if self._has_null and quantity == NULL_QUANTITY:
+            quantity = None
+        return (int(stores[index]), int(products[index]), quantity)
+
+    def __len__(self):
+        return len(self._columns[0])
+
+
+class SharedCatalogSnapshot(CatalogSnapshot):
+    """CatalogSnapshot whose inventory lookups are views over a mapped image"""
+
+    __slots__ = ('image',)
+
+    def __init__(self, image, previous=None):
+        header = image.header
+        arrays = image.arrays
+        has_null = header['has_null_quantity']
+        self.image = image
+        self.version = header['version']
+        self.loaded_at = header['published_at']
+        self.versions = header['versions']
+        self._views = {}
+
+        # Products and stores are decoded per worker; unchanged ones are kept
+        # as the same objects so caches keyed on identity survive
+        if previous is not None and previous.versions['products'] == self.versions['products']:
+            self.products, self.products_by_id = previous.products, previous.products_by_id
+        else:
+            self.products = tuple(ProductRecord(*row) for row in header['products'])
+            self.products_by_id = MappingProxyType({p.id: p for p in self.products})
+
+        if previous is not None and previous.versions['stores'] == self.versions['stores']:
+            self.stores, self.stores_by_id = previous.stores, previous.stores_by_id
+        else:
+            self.stores = tuple(StoreRecord(*row[:7], tuple(row[7])) for row in header['stores'])
+            self.stores_by_id = MappingProxyType({s.id: s for s in self.stores})
+
+        self.inventory = InventoryRows(
+            arrays['inventory_stores'], arrays['inventory_products'], arrays['inventory_quantities'], has_null
+        )
+        self.stock = StockView(arrays['stock_keys'], arrays['stock_quantities'], has_null)
+        self.store_inventory = GroupView(
+            arrays['store_keys'], arrays['store_offsets'],
+            arrays['inventory_products'], arrays['inventory_quantities'], has_null
+        )
+        self.product_stores = GroupView(
+            arrays['product_keys'], arrays['product_offsets'],
+            arrays['product_stores'], arrays['product_quantities'], has_null
+        )
+
+
+class SharedSearchIndex(ProductSearchIndex):
+    """ProductSearchIndex that finds candidates in an image's postings instead of its own"""
+
+    def __init__(self):
+        super().__init__()
+        self._gram_keys = np.empty(0, dtype='S1')
+        self._gram_offsets = np.zeros(1, dtype=np.int64)
+        self._gram_products = np.empty(0, dtype=np.int64)
+
+    def load(self, snapshot, products_changed=True):
+        """Point the index at a snapshot's image; scoring text is rebuilt only when products changed"""
+        arrays = snapshot.image.arrays
+        docs = self._docs
+        if products_changed:
+            docs = {p.id: self._make_doc(p.name, p.category, p.description) for p in snapshot.products}
+        with self._lock:
+            self._docs = docs
+            if products_changed:
+                self._lengths = self._field_lengths(docs.values())
+            self._gram_keys = arrays['gram_keys']
+            self._gram_offsets = arrays['gram_offsets']
+            self._gram_products = arrays['gram_products']
+            self.built = True
+
+    def candidates(self, query):
+        query = query.lower().strip()
+
+        with self._lock:
+            docs, keys, offsets, products = self._docs, self._gram_keys, self._gram_offsets, self._gram_products
+
+        if len(query) < self.n:
+            return sorted(docs)
+
+        matched = set()
+        for gram in make_ngrams(query, self.n):
+            key = gram.encode('utf-8')
+            i = int(np.searchsorted(keys, key))
+            if i < len(keys) and keys[i] == key:
+                matched.update(products[offsets[i]:offsets[i + 1]].tolist())
+
+        if not matched:
+            return sorted(docs)
+        return sorted(matched)
+
+
+class SharedCatalogReader:
+    """
+    Worker-side stand-in for Catalog with the same snapshot(), invalidate*()
+    and add_listener() API. Serves the supervisor's latest image and forwards
+    invalidations to the supervisor, which reloads and publishes.
+    """
+
+    def __init__(self, directory, wait=30):
+        self.directory = directory
+        self.wait = wait  # seconds to wait for the first image
+        self.search_index = SharedSearchIndex()
+        self._pointer = os.path.join(directory, POINTER_FILE)
+        self._pointer_mtime = None
+        self._snapshot = None
+        self._address = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def add_listener(self, listener):
+        """Call listener(old_snapshot, new_snapshot) whenever a new image is attached"""
+        self._listeners.append(listener)
+
+    def snapshot(self):
+        """Return the snapshot of the latest published image"""
+        try:
+            mtime = os.stat(self._pointer).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._snapshot is None or mtime != self._pointer_mtime:
+            self._attach(mtime)
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot is not None else 0
+
+    def invalidate(self, parts=CATALOG_PARTS):
+        """Ask the supervisor to reload parts of the catalog"""
+        self._send({'parts': sorted(parts)})
+
+    def invalidate_stores(self, store_ids):
+        """Ask the supervisor to reload the inventory of some stores"""
+        message = {'stores': sorted(store_ids)}
+        if len(json.dumps(message)) > MAX_DATAGRAM:
+            message = {'parts': ['inventory']}
+        self._send(message)
+
+    def _send(self, message):
+        if self._address is None:
+            self.snapshot()
+        try:
+            self._socket.sendto(json.dumps(message).encode('utf-8'), self._address)
+        except OSError:
+            # The supervisor's periodic refresh still picks the change up
+            logger.warning("Could not send catalog invalidation %s", message, exc_info=True)
+
+    def _attach(self, mtime):
+        with self._lock:
+            if self._snapshot is not None and mtime == self._pointer_mtime:
+                return
+            deadline = time.monotonic() + self.wait
+            while True:
+                try:
+                    with open(self._pointer, 'rb') as f:
+                        pointer = json.load(f)
+                    image = None
+                    if self._snapshot is None or self._snapshot.version != pointer['version']:
+                        image = CatalogImage(os.path.join(self.directory, pointer['image']))
+                    break
+                except (FileNotFoundError, ValueError):
+                    # Not published yet, or replaced between reading the pointer and the image
+                    if self._snapshot is not None and time.monotonic() > deadline:
+                        return
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f'No catalog image was published in {self.directory}')
+                    time.sleep(0.01)
+
+            self._pointer_mtime = mtime
+            self._address = ('127.0.0.1', pointer['invalidate_port'])
+            if image is None:
+                return
+
+            old = self._snapshot
+            new = SharedCatalogSnapshot(image, previous=old)
+            self.search_index.load(new, products_changed=old is None or new.products is not old.products)
+            for listener in self._listeners:
+                listener(old, new)
+            self._snapshot = new
+
+
+class CatalogPublisher:
+    """Supervisor side: publishes every catalog version as an image and applies worker invalidations"""
+
+    def __init__(self, catalog, search_index, directory=None, coalesce=0.05):
+        self.catalog = catalog
+        self.search_index = search_index
+        self.directory = directory or default_directory()
+        self.coalesce = coalesce  # seconds to gather a burst of invalidations into one reload
+        self.published = 0
+        self.closed = False
+        self._images = []
+        self._postings = None
+        self._last = None  # (inventory, postings, arrays) of the last image written
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self.port = self._socket.getsockname()[1]
+
+    def start(self):
+        """Publish the current catalog, then keep publishing as it changes"""
+        self.catalog.add_listener(self._publish)
+        snapshot = self.catalog.snapshot()
+        if not self.published:
+            self._publish(None, snapshot)
+        threading.Thread(target=self._serve, name='catalog-invalidations', daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        self._socket.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _publish(self, old, new):
+        if self.closed:
+            return
+        try:
+            if self._postings is None or old is None or new.products is not old.products:
+                self._postings = self.search_index.export_postings()
+            name = f'catalog-{new.version}.bin'
+            path = os.path.join(self.directory, name)
+            write_image(path, new, self._postings, self._last)
+            # The next image reuses this one's arrays for the stores and parts
+            # that did not change; mapping it costs no copy
+            self._last = (new.inventory, self._postings, CatalogImage(path).arrays)
+            pointer = {'version': new.version, 'image': name, 'invalidate_port': self.port}
+            _write_atomic(os.path.join(self.directory, POINTER_FILE), json.dumps(pointer).encode('utf-8'))
+            self.published += 1
+
+            # Workers that still map an old image keep it readable after unlinking
+            self._images.append(name)
+            while len(self._images) > KEEP_IMAGES:
+                try:
+                    os.remove(os.path.join(self.directory, self._images[0]))
+                except OSError:
+                    break
+                self._images.pop(0)
+        except Exception:
+            logger.exception("Publishing catalog version %s failed", new.version)
+
+    def _apply(self, data):
+        try:
+            message = json.loads(data)
+            parts = CATALOG_PARTS.intersection(message.get('parts', ()))
+            stores = {int(store_id) for store_id in message.get('stores', ())}
+        except (ValueError, TypeError, AttributeError):
+            logger.warning("Ignoring malformed catalog invalidation %r", data[:100])
+            return
+        if parts:
+            self.catalog.invalidate(parts)
+        if stores:
+            self.catalog.invalidate_stores(stores)
+
+    def _serve(self):
+        while True:
+            try:
+                self._socket.settimeout(None)
+                self._apply(self._socket.recvfrom(65536)[0])
+                # Gather the rest of a burst of writes into one reload
+                deadline = time.monotonic() + self.coalesce
+                while (remaining := deadline - time.monotonic()) > 0:
+                    self._socket.settimeout(remaining)
+                    try:
+                        self._apply(self._socket.recvfrom(65536)[0])
+                    except socket.timeout:
+                        break
+                self.catalog.refresh()
+            except OSError:
+                return  # closed
+            except Exception:
+                logger.exception("Applying catalog invalidations failed")
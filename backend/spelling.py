@@ -0,0 +1,227 @@
+"""
+Symmetric-delete spelling correction for product search keywords
+Every vocabulary word is stored under each string obtained by deleting up
+to max_distance characters from its first prefix_length characters. A
+misspelt token is corrected by generating its own deletes and checking the
+few words found under them with an edit distance, so a lookup costs a
+bounded number of dictionary probes whatever the vocabulary size. The
+dictionary is saved as JSON with a hash of the product text it was built
+from, so a restart with unchanged products loads it without tokenizing the
+catalog or regenerating deletes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+from intent_router import TOKEN_RE
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MIN_WORD_LENGTH = 3  # extract_product_keywords drops shorter words
+MIN_CORRECT_LENGTH = 4  # shorter tokens have too many neighbours to correct safely
+
+
+def product_text(products):
+    """Lowercased names, categories and descriptions of products, one field per line"""
+    return '\n'.join(
+        text for product in products for text in (product.name, product.category, product.description) if text
+    ).lower()
+
+
+def text_words(text):
+    """Word counts of a text, ignoring words too short to be search keywords"""
+    return Counter(word for word in TOKEN_RE.findall(text) if len(word) >= MIN_WORD_LENGTH)
+
+
+def product_words(products):
+    """Word counts over the names, categories and descriptions of products"""
+    return text_words(product_text(products))
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance between a and b, or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class SpellingIndex:
+    """Symmetric-delete dictionary over product vocabulary"""
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.built = False
+        self._lock = threading.Lock()
+        self._words = Counter()  # word -> occurrences in the catalog
+        self._deletes = {}       # delete string -> words it was derived from
+        self._sorted = None      # sorted vocabulary for prefix checks, built lazily
+
+    def build(self, counts):
+        """(Re)build the dictionary from {word: count}"""
+        words = Counter({word: count for word, count in counts.items() if count > 0})
+        deletes = {}
+        for word in words:
+            for key in self._word_deletes(word):
+                deletes.setdefault(key, []).append(word)
+        with self._lock:
+            self._words = words
+            self._deletes = deletes
+            self._sorted = None
+            self.built = True
+
+    def update(self, added, removed):
+        """Apply word count changes, e.g. from products that were edited"""
+        with self._lock:
+            for word, count in added.items():
+                if word not in self._words:
+                    for key in self._word_deletes(word):
+                        self._deletes.setdefault(key, []).append(word)
+                    self._sorted = None
+                self._words[word] += count
+            for word, count in removed.items():
+                if word not in self._words:
+                    continue
+                self._words[word] -= count
+                if self._words[word] <= 0:
+                    del self._words[word]
+                    for key in self._word_deletes(word):
+                        entries = self._deletes.get(key)
+                        if entries is not None and word in entries:
+                            entries.remove(word)
+                            if not entries:
+                                del self._deletes[key]
+                    self._sorted = None
+
+    def correct(self, token):
+        """
+        The closest vocabulary word to token (fewest edits, then most common),
+        or token itself when it is known, a prefix of a known word, too short
+        or too far from every word
+        """
+        words = self._words
+        if token in words or len(token) < MIN_CORRECT_LENGTH or self._is_prefix(token):
+            return token
+
+        limit = min(self.max_distance, 1 if len(token) < 6 else 2)
+        deletes = self._deletes
+        best = None
+        seen = set()
+        for key in self._deletes_of(token[:self.prefix_length], limit):
+            for word in tuple(deletes.get(key, ())):
+                if word in seen:
+                    continue
+                seen.add(word)
+                distance = edit_distance(token, word, limit)
+                if distance > limit:
+                    continue
+                rank = (distance, -words.get(word, 0), word)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best is not None else token
+
+    def save(self, path, fingerprint):
+        """Write the dictionary to path (atomically), tagged with the fingerprint of its source"""
+        with self._lock:
+            data = {
+                'format': FORMAT_VERSION,
+                'fingerprint': fingerprint,
+                'max_distance': self.max_distance,
+                'prefix_length': self.prefix_length,
+                'words': dict(self._words),
+                'deletes': self._deletes
+            }
+            payload = json.dumps(data, separators=(',', ':'))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(payload)
+        os.replace(temporary, path)
+
+    def load(self, path, fingerprint):
+        """Load a saved dictionary; returns False if it is missing, unreadable or has another fingerprint"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (data.get('format') != FORMAT_VERSION or data.get('fingerprint') != fingerprint
+                or data.get('max_distance') != self.max_distance
+                or data.get('prefix_length') != self.prefix_length):
+            return False
+        with self._lock:
+            self._words = Counter(data['words'])
+            self._deletes = data['deletes']
+            self._sorted = None
+            self.built = True
+        return True
+
+    def load_or_build(self, path, products):
+        """Load the dictionary saved for these products, or build it and save it for next time"""
+        text = product_text(products)
+        fingerprint = hashlib.sha1(text.encode()).hexdigest()
+        if path and self.load(path, fingerprint):
+            return True
+        self.build(text_words(text))
+        if path:
+            try:
+                self.save(path, fingerprint)
+            except OSError:
+                logger.warning("Could not save the spelling index to %s", path, exc_info=True)
+        return False
+
+    def __len__(self):
+        return len(self._words)
+
+    def _is_prefix(self, token):
+        words = self._sorted
+        if words is None:
+            with self._lock:
+                words = self._sorted = sorted(self._words)
+        i = bisect_left(words, token)
+        return i < len(words) and words[i].startswith(token)
+
+    def _word_deletes(self, word):
+        return self._deletes_of(word[:self.prefix_length], self.max_distance)
+
+    @staticmethod
+    def _deletes_of(text, distance):
+        """text and every string made by deleting up to distance characters from it"""
+        found = {text}
+        frontier = [text]
+        for _ in range(distance):
+            next_frontier = []
+            for item in frontier:
+                if len(item) <= 1:
+                    continue
+                for i in range(len(item)):
+                    deleted = item[:i] + item[i + 1:]
+                    if deleted not in found:
+                        found.add(deleted)
+                        next_frontier.append(deleted)
+            frontier = next_frontier
+        return found
+
@@ -0,0 +1,64 @@
+"""
+SQLite storage profile
+Pragmas applied to every new connection (WAL journaling, relaxed fsync,
+page cache, mmap, busy timeout), plus query_only connections for the
+separate read pool so readers never queue behind the writer.
+"""
+
+from sqlalchemy import event
+
+# PRAGMA name -> config key; empty or None values leave SQLite's default
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+)
+
+# journal_mode is a property of the database file; only the writer sets it
+WRITER_ONLY_PRAGMAS = frozenset(['journal_mode'])
+
+
+def sqlite_pragmas(config, read_only=False):
+    """PRAGMA statements for the configured profile"""
+    statements = []
+    for pragma, key in SQLITE_PRAGMAS:
+        value = config.get(key)
+        if value in (None, '') or (read_only and pragma in WRITER_ONLY_PRAGMAS):
+            continue
+        statements.append(f'PRAGMA {pragma}={value}')
+    if read_only:
+        statements.append('PRAGMA query_only=1')
+    return statements
+
+
+def apply_sqlite_profile(engine, config, read_only=False):
+    """Run the profile's pragmas on every connection the engine opens; no-op for other databases"""
+    if engine.dialect.name != 'sqlite':
+        return []
+
+    statements = sqlite_pragmas(config, read_only)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return statements
+
+
+def current_pragmas(connection):
+    """Effective values of the profile's pragmas on a DB-API connection, for diagnostics"""
+    cursor = connection.cursor()
+    try:
+        values = {}
+        for pragma, _ in SQLITE_PRAGMAS + (('query_only', None),):
+            values[pragma] = cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+        return values
+    finally:
+        cursor.close()
@@ -1,5 +1,7 @@
 -- FreshMart Grocery E-commerce Database Schema
 -- SQLite Database Schema for Grocery Store with AI Chatbot
+-- Reference copy: the models in backend/app.py are the source of truth, and
+-- `flask migrate-db` brings an existing database up to them
 
 -- Products table - stores all grocery items
 CREATE TABLE IF NOT EXISTS product (
@@ -33,8 +35,7 @@ CREATE TABLE IF NOT EXISTS inventory (
     quantity INTEGER DEFAULT 0,
     last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (store_id) REFERENCES store (id),
-    FOREIGN KEY (product_id) REFERENCES product (id),
-    UNIQUE(store_id, product_id)
+    FOREIGN KEY (product_id) REFERENCES product (id)
 );
 
 -- Chat messages table - stores chatbot conversation history
@@ -46,15 +47,96 @@ CREATE TABLE IF NOT EXISTS chat_message (
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Deduplicated, zlib-compressed bot responses of archived chat turns. Turns
+-- older than CHAT_HOT_DAYS are moved out of chat_message into one table per
+-- month, created on demand as:
+--   CREATE TABLE chat_message_YYYY_MM (id INTEGER PRIMARY KEY, session_id VARCHAR(100),
+--       user_message TEXT, response_id INTEGER, timestamp DATETIME);
+--   CREATE INDEX idx_chat_message_YYYY_MM_session ON chat_message_YYYY_MM(session_id, timestamp);
+CREATE TABLE IF NOT EXISTS chat_response (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest VARCHAR(40) NOT NULL UNIQUE, -- SHA-1 of the response JSON
+    body BLOB NOT NULL,
+    last_seen DATETIME NOT NULL -- newest chat turn using it
+);
+
+-- Chat session contexts (recent intents, last search results, last location)
+-- evicted from memory while still live, when SESSION_CONTEXT_SPILL is on
+CREATE TABLE IF NOT EXISTS chat_session_context (
+    session_id VARCHAR(100) PRIMARY KEY,
+    context TEXT NOT NULL, -- compact JSON
+    expires_at FLOAT NOT NULL -- Unix time
+);
+
+-- Reservations - stock held for a checkout until ordered, released or expired
+CREATE TABLE IF NOT EXISTS reservation (
+    id VARCHAR(32) PRIMARY KEY,
+    session_id VARCHAR(100),
+    status VARCHAR(20) NOT NULL DEFAULT 'held', -- held, ordered, released, expired
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS reservation_item (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reservation_id VARCHAR(32) NOT NULL,
+    store_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    FOREIGN KEY (reservation_id) REFERENCES reservation (id),
+    FOREIGN KEY (store_id) REFERENCES store (id),
+    FOREIGN KEY (product_id) REFERENCES product (id)
+);
+
+-- Orders - placed from exactly one reservation
+CREATE TABLE IF NOT EXISTS "order" (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reservation_id VARCHAR(32) NOT NULL UNIQUE,
+    session_id VARCHAR(100),
+    total REAL NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (reservation_id) REFERENCES reservation (id)
+);
+
+-- Materialized availability, maintained by triggers on inventory (generated
+-- for the configured region size by migrate_schema in backend/app.py)
+CREATE TABLE IF NOT EXISTS product_availability (
+    product_id INTEGER PRIMARY KEY,
+    stores_available INTEGER NOT NULL DEFAULT 0,
+    total_quantity INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (product_id) REFERENCES product (id)
+);
+
+-- Regions are cells of a lat/lng grid: (floor(lat / size), floor(lng / size))
+CREATE TABLE IF NOT EXISTS product_region_availability (
+    product_id INTEGER NOT NULL,
+    region_row INTEGER NOT NULL,
+    region_col INTEGER NOT NULL,
+    stores_available INTEGER NOT NULL DEFAULT 0,
+    total_quantity INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (product_id, region_row, region_col),
+    FOREIGN KEY (product_id) REFERENCES product (id)
+);
+
+-- Holds a row only inside a bulk feed chunk's transaction, while the
+-- availability triggers are deferred
+CREATE TABLE IF NOT EXISTS availability_deferral (
+    id INTEGER PRIMARY KEY
+);
+
 -- Indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_product_category ON product(category);
 CREATE INDEX IF NOT EXISTS idx_product_name ON product(name);
-CREATE INDEX IF NOT EXISTS idx_store_location ON store(latitude, longitude);
-CREATE INDEX IF NOT EXISTS idx_inventory_store ON inventory(store_id);
+CREATE INDEX IF NOT EXISTS idx_product_price ON product(price);
+-- One row per (store, product); also serves lookups by store_id alone
+CREATE UNIQUE INDEX IF NOT EXISTS uq_inventory_store_product ON inventory(store_id, product_id);
 CREATE INDEX IF NOT EXISTS idx_inventory_product ON inventory(product_id);
-CREATE INDEX IF NOT EXISTS idx_inventory_quantity ON inventory(quantity);
-CREATE INDEX IF NOT EXISTS idx_chat_session ON chat_message(session_id);
+CREATE INDEX IF NOT EXISTS idx_chat_session ON chat_message(session_id, timestamp);
 CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON chat_message(timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_response_last_seen ON chat_response(last_seen);
+CREATE INDEX IF NOT EXISTS idx_chat_session_context_expiry ON chat_session_context(expires_at);
+CREATE INDEX IF NOT EXISTS idx_reservation_status_expiry ON reservation(status, expires_at);
+CREATE INDEX IF NOT EXISTS ix_reservation_item_reservation_id ON reservation_item(reservation_id);
 
 -- Views for common queries
 CREATE VIEW IF NOT EXISTS store_inventory_view AS
@@ -96,12 +178,7 @@ FROM product p
 LEFT JOIN inventory i ON p.id = i.product_id AND i.quantity > 0
 GROUP BY p.id, p.name, p.category, p.price, p.description, p.icon;
 
--- Triggers to update inventory timestamps
-CREATE TRIGGER IF NOT EXISTS update_inventory_timestamp 
-AFTER UPDATE ON inventory
-BEGIN
-    UPDATE inventory SET last_updated = CURRENT_TIMESTAMP WHERE id = NEW.id;
-END;
+-- last_updated is set by every write (model onupdate, reservations, feeds); no trigger
 
 -- Sample data insertion (will be handled by Python script)
 -- This is just for reference
@@ -134,11 +211,12 @@ INSERT INTO store (name, address, latitude, longitude, phone, hours, services) V
 */
 
 -- Database maintenance queries
--- Clean up old chat messages (older than 30 days)
--- DELETE FROM chat_message WHERE timestamp < datetime('now', '-30 days');
+-- Old chat messages are archived and expired by the retention thread
+-- (CHAT_RETENTION_DAYS); run a pass now with: flask prune-chat
 
--- Update inventory quantities (example)
--- UPDATE inventory SET quantity = quantity - 1 WHERE store_id = 1 AND product_id = 1 AND quantity > 0;
+-- Update inventory quantities (example; checkouts go through /api/inventory/reserve,
+-- which takes stock with the same conditional UPDATE)
+-- UPDATE inventory SET quantity = quantity - 1 WHERE store_id = 1 AND product_id = 1 AND quantity >= 1;
 
 -- Get low stock items (quantity < 10)
 -- SELECT s.name as store_name, p.name as product_name, i.quantity 
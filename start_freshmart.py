@@ -2,8 +2,13 @@
 """
 SUVAI Startup Script
 Automatically starts the Flask backend server and opens the website
+
+Usage: python start_freshmart.py [--server flask|asgi] [--workers N]
+The ASGI server (backend/asgi.py on uvicorn) runs N worker processes; the
+defaults can also be set with FRESHMART_SERVER and FRESHMART_WORKERS.
 """
 
+import argparse
 import subprocess
 import sys
 import time
@@ -29,7 +34,16 @@ def check_python_version():
     print(f"✅ Python version: {sys.version.split()[0]}")
     return True
 
-def check_dependencies():
+def parse_args():
+    """Read the server mode and worker count"""
+    parser = argparse.ArgumentParser(description='Start SUVAI')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default=os.environ.get('FRESHMART_SERVER', 'flask'),
+                        help='flask: development server; asgi: uvicorn with async chat and availability routes')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('FRESHMART_WORKERS', 1)),
+                        help='worker processes for the asgi server')
+    return parser.parse_args()
+
+def check_dependencies(server='flask'):
     """Check if required dependencies are installed"""
     print("\n📦 Checking dependencies...")
     
@@ -37,6 +51,8 @@ def check_dependencies():
         'flask', 'flask_cors', 'sqlalchemy', 
         'flask_sqlalchemy', 'requests', 'fuzzywuzzy'
     ]
+    if server == 'asgi':
+        required_packages += ['uvicorn', 'aiosqlite']
     
     missing_packages = []
     
@@ -66,9 +82,14 @@ def check_dependencies():
     
     return True
 
-def start_backend_server():
-    """Start the Flask backend server"""
-    print("\n🚀 Starting Flask backend server...")
+def start_backend_server(server='flask', workers=1):
+    """Start the Flask development server or the ASGI server"""
+    if server == 'asgi':
+        print(f"\n🚀 Starting ASGI backend server with {workers} worker(s)...")
+        command = [sys.executable, 'asgi.py', '--workers', str(workers)]
+    else:
+        print("\n🚀 Starting Flask backend server...")
+        command = [sys.executable, 'app.py']
     
     backend_path = Path("backend")
     if not backend_path.exists():
@@ -77,21 +98,19 @@ def start_backend_server():
     
     try:
         # Change to backend directory and start server
-        process = subprocess.Popen([
-            sys.executable, 'app.py'
-        ], cwd=backend_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process = subprocess.Popen(command, cwd=backend_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         # Wait a moment for server to start
         time.sleep(3)
         
         # Check if process is still running
         if process.poll() is None:
-            print("✅ Flask server started successfully")
+            print(f"✅ {'ASGI' if server == 'asgi' else 'Flask'} server started successfully")
             print("📍 Server running at: http://localhost:5000")
             return process
         else:
             stdout, stderr = process.communicate()
-            print("❌ Failed to start Flask server")
+            print("❌ Failed to start backend server")
             print(f"Error: {stderr.decode()}")
             return None
             
@@ -166,17 +185,18 @@ def show_usage_instructions():
 
 def main():
     """Main startup function"""
+    args = parse_args()
     print_banner()
     
     # Check system requirements
     if not check_python_version():
         sys.exit(1)
     
-    if not check_dependencies():
+    if not check_dependencies(args.server):
         sys.exit(1)
     
     # Start backend server
-    server_process = start_backend_server()
+    server_process = start_backend_server(args.server, args.workers)
     if not server_process:
         sys.exit(1)
     
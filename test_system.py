@@ -6,9 +6,13 @@ Tests all major functionality of the grocery e-commerce website with AI chatbot
 
 import requests
 import json
+import os
+import socket
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlparse
 
 # Configuration
 BASE_URL = "http://localhost:5000/api"
@@ -39,6 +43,17 @@ def print_warning(message):
 def print_info(message):
     print(f"{Colors.BLUE}ℹ {message}{Colors.ENDC}")
 
+def open_stalled_request(path):
+    """Send a GET on a socket with a tiny receive buffer and stop reading after the first byte, like a slow client"""
+    url = urlparse(BASE_URL)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.settimeout(10)
+    sock.connect((url.hostname, url.port or 80))
+    sock.sendall(f"GET {url.path}{path} HTTP/1.1\r\nHost: {url.netloc}\r\n\r\n".encode())
+    sock.recv(1)
+    return sock
+
 def test_server_connection():
     """Test if Flask server is running"""
     print_test_header("Server Connection")
@@ -102,7 +117,20 @@ def test_products_api():
             print_error(f"Product search failed with status: {response.status_code}")
     except Exception as e:
         print_error(f"Product search test failed: {str(e)}")
-    
+
+    # Test that a plain search only scores the products sharing a trigram with it
+    try:
+        before = requests.get(f"{BASE_URL}/stats").json()['search_index']
+        response = requests.get(f"{BASE_URL}/products?search=milk")
+        after = requests.get(f"{BASE_URL}/stats").json()['search_index']
+        scored = after['scored'] - before['scored']
+        if response.status_code == 200 and scored < after['products'] and after['full_scans'] == before['full_scans']:
+            print_success(f"Search for 'milk' scored {scored} of {after['products']} products")
+        else:
+            print_error(f"Search for 'milk' scored {scored} of {after['products']} products (status {response.status_code})")
+    except Exception as e:
+        print_error(f"Search pruning test failed: {str(e)}")
+
     # Test category filter
     try:
         response = requests.get(f"{BASE_URL}/products?category=fruits")
@@ -117,6 +145,25 @@ def test_products_api():
     except Exception as e:
         print_error(f"Category filter test failed: {str(e)}")
 
+    # Test that revalidating a compressed response echoes its ETag
+    try:
+        response = requests.get(f"{BASE_URL}/products", headers={'Accept-Encoding': 'gzip'})
+        etag = response.headers.get('ETag')
+        revalidated = requests.get(
+            f"{BASE_URL}/products", headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}
+        )
+        if response.headers.get('Content-Encoding') != 'gzip':
+            print_warning("Products list was not served gzip-compressed; ETag variant check skipped")
+        elif revalidated.status_code == 304 and revalidated.headers.get('ETag') == etag:
+            print_success(f"Revalidating the gzip products list returned 304 with its ETag {etag}")
+        else:
+            print_error(
+                f"Revalidating {etag} returned status {revalidated.status_code} "
+                f"with ETag {revalidated.headers.get('ETag')}"
+            )
+    except Exception as e:
+        print_error(f"ETag revalidation test failed: {str(e)}")
+
 def test_stores_api():
     """Test stores API endpoints"""
     print_test_header("Stores API")
@@ -160,6 +207,17 @@ def test_stores_api():
             print_error(f"Location-based store search failed with status: {response.status_code}")
     except Exception as e:
         print_error(f"Location-based store search test failed: {str(e)}")
+    
+    # Test that a non-positive limit is rejected on both the plain and radius paths
+    try:
+        queries = ["limit=0", "limit=-1", f"lat={TEST_LOCATION['lat']}&lng={TEST_LOCATION['lng']}&radius=10&limit=0"]
+        statuses = [requests.get(f"{BASE_URL}/stores?{query}").status_code for query in queries]
+        if all(status == 400 for status in statuses):
+            print_success("Non-positive store limits are rejected")
+        else:
+            print_error(f"Non-positive store limits returned statuses: {statuses}")
+    except Exception as e:
+        print_error(f"Store limit validation test failed: {str(e)}")
 
 def test_inventory_api():
     """Test inventory API endpoints"""
@@ -193,6 +251,230 @@ def test_inventory_api():
             
     except Exception as e:
         print_error(f"Inventory API test failed: {str(e)}")
+    
+    # Test that inventory streams stalled by slow clients don't hold the read
+    # connections other requests need
+    stalled = []
+    try:
+        pool = requests.get(f"{BASE_URL}/stats").json()['storage'].get('read', {}).get('pool', '')
+        pool_size = int(pool.split('Pool size:')[1].split()[0]) if 'Pool size:' in pool else 8
+        store_id = requests.get(f"{BASE_URL}/stores").json()[0]['id']
+        for _ in range(pool_size + 2):
+            stalled.append(open_stalled_request(f"/inventory/{store_id}?stream=1"))
+        
+        start = time.time()
+        response = requests.get(f"{BASE_URL}/products?stream=1&limit=3", timeout=10)
+        elapsed = time.time() - start
+        if response.status_code == 200 and len(response.text.splitlines()) == 3 and elapsed < 5:
+            print_success(f"Products streamed in {elapsed*1000:.0f}ms with {len(stalled)} stalled inventory streams open")
+        else:
+            print_error(f"Products stream took {elapsed:.1f}s with stalled streams open (status {response.status_code})")
+    except Exception as e:
+        print_error(f"Stalled stream test failed: {str(e)}")
+    finally:
+        for sock in stalled:
+            sock.close()
+
+def post_feed(rows):
+    """POST (store_id, product_id, quantity) rows as a CSV stock feed; returns the feed summary"""
+    lines = ''.join(f"{store_id},{product_id},{quantity}\n" for store_id, product_id, quantity in rows)
+    response = requests.post(
+        f"{BASE_URL}/inventory/bulk",
+        data="store_id,product_id,quantity\n" + lines,
+        headers={'Content-Type': 'text/csv'}
+    )
+    response.raise_for_status()
+    return response.json()
+
+def set_stock(store_id, product_id, quantity):
+    """Set one (store, product) quantity through the bulk feed endpoint"""
+    post_feed([(store_id, product_id, quantity)])
+
+def walk_pages(path, params):
+    """Follow `next` cursors from the first page to the last; returns every item and the page count"""
+    items, pages, after = [], 0, None
+    while True:
+        page = requests.get(f"{BASE_URL}/{path}", params=dict(params, **({'after': after} if after else {}))).json()
+        items.extend(page['items'])
+        pages += 1
+        if not page['next']:
+            return items, pages
+        if page['next'] == after:
+            raise RuntimeError(f"{path} returned the same cursor twice")
+        after = page['next']
+
+def test_pagination():
+    """Test that walking every cursor page gives the unpaginated result exactly once"""
+    print_test_header("Cursor Pagination")
+    
+    # Test that a store's inventory pages add up to the whole inventory
+    try:
+        store_id = requests.get(f"{BASE_URL}/stores").json()[0]['id']
+        expected = requests.get(f"{BASE_URL}/inventory/{store_id}").json()
+        items, pages = walk_pages(f"inventory/{store_id}", {'limit': 3})
+        product_ids = [item['product_id'] for item in items]
+        if len(product_ids) != len(set(product_ids)):
+            print_error(f"Store {store_id} inventory pages repeat products")
+        elif sorted(product_ids) != sorted(item['product_id'] for item in expected):
+            print_error(f"Store {store_id} inventory pages skip products: {len(items)} of {len(expected)}")
+        else:
+            print_success(f"{pages} inventory pages of store {store_id} hold all {len(items)} items once")
+    except Exception as e:
+        print_error(f"Inventory pagination test failed: {str(e)}")
+    
+    # Test that the cursor neither repeats nor skips rows sharing a sort key
+    try:
+        expected = requests.get(f"{BASE_URL}/products").json()
+        prices = [product['price'] for product in expected]
+        if len(set(prices)) == len(prices):
+            print_warning("No two products share a price; the tie-breaking check is not exercised")
+        items, pages = walk_pages("products", {'sort': 'price', 'limit': 2})
+        ids = [product['id'] for product in items]
+        keys = [(product['price'], product['id']) for product in items]
+        if len(ids) != len(set(ids)):
+            print_error("Product pages sorted by price repeat products")
+        elif sorted(ids) != sorted(product['id'] for product in expected):
+            print_error(f"Product pages sorted by price skip products: {len(items)} of {len(expected)}")
+        elif keys != sorted(keys):
+            print_error("Product pages sorted by price are out of order")
+        else:
+            print_success(
+                f"{pages} product pages sorted by price hold all {len(items)} products once, "
+                f"with {len(prices) - len(set(prices))} repeated prices"
+            )
+    except Exception as e:
+        print_error(f"Product pagination test failed: {str(e)}")
+
+def test_inventory_feed():
+    """Test that the bulk stock feed upserts: replays change nothing and updates never duplicate rows"""
+    print_test_header("Inventory Feed")
+    
+    try:
+        store_id = requests.get(f"{BASE_URL}/stores").json()[0]['id']
+        before = requests.get(f"{BASE_URL}/inventory/{store_id}").json()
+        stocked = {item['product_id'] for item in before}
+        missing = [product['id'] for product in requests.get(f"{BASE_URL}/products").json()
+                   if product['id'] not in stocked]
+        existing = before[0]
+    except Exception as e:
+        print_error(f"Could not pick products for the feed tests: {str(e)}")
+        return
+    
+    feed = [(store_id, existing['product_id'], existing['quantity'] + 5)]
+    if missing:
+        feed.append((store_id, missing[0], 7))
+    
+    def listing():
+        items = requests.get(f"{BASE_URL}/inventory/{store_id}").json()
+        return {item['product_id']: item['quantity'] for item in items}, len(items)
+    
+    try:
+        # Test that the same feed applied twice leaves the same rows
+        try:
+            first = post_feed(feed)
+            after_first = listing()
+            second = post_feed(feed)
+            after_second = listing()
+            expected = {product_id: quantity for _, product_id, quantity in feed}
+            rows, count = after_second
+            if (first['applied'] == second['applied'] == len(feed) and after_first == after_second
+                    and count == len(rows) == len(before) + len(feed) - 1
+                    and all(rows.get(product_id) == quantity for product_id, quantity in expected.items())):
+                print_success(f"Replaying a {len(feed)}-row feed left the same {count} rows for store {store_id}")
+            else:
+                print_error(f"Replaying a feed changed store {store_id}: {after_first} then {after_second}")
+        except Exception as e:
+            print_error(f"Feed replay test failed: {str(e)}")
+        
+        # Test that an update changes the quantity in place
+        try:
+            post_feed([(store_id, existing['product_id'], 11)])
+            rows, count = listing()
+            if rows.get(existing['product_id']) == 11 and count == len(rows) == len(before) + len(feed) - 1:
+                print_success("A feed update changed the quantity without adding a row")
+            else:
+                print_error(f"A feed update left {count} rows, product {existing['product_id']} at "
+                            f"{rows.get(existing['product_id'])}")
+        except Exception as e:
+            print_error(f"Feed update test failed: {str(e)}")
+    finally:
+        try:
+            post_feed([(store_id, existing['product_id'], existing['quantity'])]
+                      + [(store_id, product_id, 0) for product_id in missing[:1]])
+        except Exception as e:
+            print_warning(f"Could not restore stock at store {store_id}: {str(e)}")
+
+def reserve(store_id, product_id, quantity=1, ttl=None):
+    """POST a one-line reservation; returns the response"""
+    body = {'items': [{'store_id': store_id, 'product_id': product_id, 'quantity': quantity}]}
+    if ttl is not None:
+        body['ttl'] = ttl
+    return requests.post(f"{BASE_URL}/inventory/reserve", json=body, timeout=30)
+
+def test_reservations_api():
+    """Test that reservations never oversell and that expired holds give their stock back"""
+    print_test_header("Reservations API")
+    
+    try:
+        store_id = requests.get(f"{BASE_URL}/stores").json()[0]['id']
+        item = requests.get(f"{BASE_URL}/inventory/{store_id}").json()[0]
+        product_id, original = item['product_id'], item['quantity']
+    except Exception as e:
+        print_error(f"Could not pick a product for the reservation tests: {str(e)}")
+        return
+    
+    try:
+        set_stock(store_id, product_id, 1)
+        
+        # Test that asking for more than the store has is refused
+        try:
+            response = reserve(store_id, product_id, quantity=2)
+            if response.status_code == 409 and response.json().get('requested') == 2:
+                print_success("Reserving 2 of 1 in stock is refused with 409")
+            else:
+                print_error(f"Reserving more than in stock returned status {response.status_code}")
+        except Exception as e:
+            print_error(f"Insufficient stock test failed: {str(e)}")
+        
+        # Test that parallel checkouts of the last unit give exactly one hold
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                responses = list(pool.map(lambda _: reserve(store_id, product_id), range(8)))
+            statuses = sorted(response.status_code for response in responses)
+            held = [response.json()['reservation_id'] for response in responses if response.status_code == 201]
+            if statuses == [201] + [409] * 7:
+                print_success("8 parallel reservations of the last unit: 1 held, 7 refused")
+            else:
+                print_error(f"8 parallel reservations of the last unit returned statuses {statuses}")
+            for reservation_id in held:
+                requests.delete(f"{BASE_URL}/inventory/reserve/{reservation_id}")
+        except Exception as e:
+            print_error(f"Parallel reservation test failed: {str(e)}")
+        
+        # Test that a hold past its ttl is swept and its stock can be reserved again
+        try:
+            first = reserve(store_id, product_id, ttl=1)
+            blocked = reserve(store_id, product_id)
+            time.sleep(2.5)
+            again = reserve(store_id, product_id)
+            if first.status_code == 201 and blocked.status_code == 409 and again.status_code == 201:
+                print_success("An expired 1s hold gave its stock back to the next reservation")
+            else:
+                print_error(
+                    f"Expiry test statuses: hold {first.status_code}, while held {blocked.status_code}, "
+                    f"after expiry {again.status_code}"
+                )
+            if again.status_code == 201:
+                requests.delete(f"{BASE_URL}/inventory/reserve/{again.json()['reservation_id']}")
+        except Exception as e:
+            print_error(f"Reservation expiry test failed: {str(e)}")
+    except Exception as e:
+        print_error(f"Reservation tests failed: {str(e)}")
+    finally:
+        try:
+            set_stock(store_id, product_id, original)
+        except Exception as e:
+            print_warning(f"Could not restore stock of product {product_id} at store {store_id}: {str(e)}")
 
 def test_chatbot_api():
     """Test chatbot API with various queries"""
@@ -271,6 +553,128 @@ def test_chatbot_api():
         # Small delay between requests
         time.sleep(0.5)
 
+def test_chat_follow_up():
+    """Test that a follow-up turn reuses the session's last search, and only while the session is live"""
+    print_test_header("Chat Follow-ups")
+    
+    session_id = f"test_follow_up_{int(time.time())}"
+    
+    def chat(message, session, location=None):
+        payload = {"message": message, "session_id": session}
+        if location:
+            payload["location"] = location
+        return requests.post(f"{BASE_URL}/chat", json=payload, timeout=10).json()
+    
+    # Test that "which store has them" answers for the products of the previous turn
+    try:
+        first = chat("find milk", session_id, TEST_LOCATION)
+        follow_up = chat("which store has them", session_id)
+        products = [product['id'] for product in first.get('products', [])]
+        stores = [store['id'] for store in first.get('stores', [])]
+        if (products and follow_up.get('type') == 'product_search'
+                and [product['id'] for product in follow_up.get('products', [])] == products
+                and [store['id'] for store in follow_up.get('stores', [])] == stores):
+            print_success(f"The follow-up reused the {len(products)} product(s) and location of the last turn")
+        else:
+            print_error(f"The follow-up was answered as '{follow_up.get('type')}': {follow_up.get('message')}")
+    except Exception as e:
+        print_error(f"Follow-up test failed: {str(e)}")
+        return
+    
+    # Test that another session does not see this session's search
+    try:
+        other = chat("which store has them", f"{session_id}_other")
+        if other.get('products') is None:
+            print_success("A follow-up in a fresh session is answered as a new conversation")
+        else:
+            print_error("A fresh session answered a follow-up from another session's search")
+    except Exception as e:
+        print_error(f"Session isolation test failed: {str(e)}")
+    
+    # Test that the context expires after SESSION_CONTEXT_TTL
+    try:
+        ttl = requests.get(f"{BASE_URL}/stats").json()['session_context']['ttl']
+        if ttl > 5:
+            print_warning(f"Context expiry not checked: the server runs with SESSION_CONTEXT_TTL={ttl:g}; 2 enables it")
+            return
+        time.sleep(ttl + 1)
+        expired = chat("which store has them", session_id)
+        if expired.get('products') is None:
+            print_success(f"The session's context expired after {ttl}s")
+        else:
+            print_error(f"A follow-up {ttl + 1}s after the last turn still used the expired context")
+    except Exception as e:
+        print_error(f"Context expiry test failed: {str(e)}")
+
+def test_chat_batch():
+    """Test that a chat batch answers in order, isolates failing items and reuses duplicate searches"""
+    print_test_header("Chat Batch API")
+    
+    session_id = f"test_batch_{int(time.time())}"
+    items = [
+        {"message": "find apples", "location": TEST_LOCATION, "session_id": f"{session_id}_0"},
+        {"location": TEST_LOCATION, "session_id": f"{session_id}_1"},
+        {"message": "find milk", "location": TEST_LOCATION, "session_id": f"{session_id}_2"},
+        "not an object",
+        {"message": "find apples", "location": TEST_LOCATION, "session_id": f"{session_id}_4"},
+        {"message": "show nearby stores", "location": TEST_LOCATION, "session_id": f"{session_id}_5"}
+    ]
+    
+    try:
+        response = requests.post(f"{BASE_URL}/chat/batch", json={"messages": items}, timeout=30)
+        responses = response.json().get('responses', [])
+        if response.status_code != 200 or len(responses) != len(items):
+            print_error(f"Chat batch returned status {response.status_code} with {len(responses)} responses")
+            return
+    except Exception as e:
+        print_error(f"Chat batch request failed: {str(e)}")
+        return
+    
+    # Test that each slot answers its own item
+    try:
+        names = [[product['name'].lower() for product in reply.get('products', [])] for reply in responses]
+        types = [reply.get('type') for reply in responses]
+        if (types == ['product_search', None, 'product_search', None, 'product_search', 'store_locations']
+                and names[0] and 'apple' in names[0][0] and names[2] and 'milk' in names[2][0]):
+            print_success("Batch responses come back in request order")
+        else:
+            print_error(f"Batch responses are out of order: {types}")
+    except Exception as e:
+        print_error(f"Batch order test failed: {str(e)}")
+    
+    # Test that bad items get an error in their own slot only
+    try:
+        errors = [index for index, reply in enumerate(responses) if 'error' in reply]
+        if errors == [1, 3]:
+            print_success("Invalid items got their own errors without failing the batch")
+        else:
+            print_error(f"Batch items {errors} failed; expected only items 1 and 3")
+    except Exception as e:
+        print_error(f"Batch error isolation test failed: {str(e)}")
+    
+    # Test that a repeated search within the batch returns the identical payload
+    try:
+        if responses[0] == responses[4]:
+            print_success("A repeated search in the batch returned an identical payload")
+        else:
+            print_error("A repeated search in the batch returned a different payload")
+    except Exception as e:
+        print_error(f"Batch memoization test failed: {str(e)}")
+    
+    # Test that streaming yields the same responses, indexed in order
+    try:
+        response = requests.post(
+            f"{BASE_URL}/chat/batch", json={"messages": items, "stream": True}, timeout=30
+        )
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+        if ([line['index'] for line in lines] == list(range(len(items)))
+                and [line['response'] for line in lines] == responses):
+            print_success("Streamed batch lines match the batch responses, in order")
+        else:
+            print_error("Streamed batch lines differ from the batch responses")
+    except Exception as e:
+        print_error(f"Streamed batch test failed: {str(e)}")
+
 def test_database_integrity():
     """Test database integrity and relationships"""
     print_test_header("Database Integrity")
@@ -310,34 +714,34 @@ def test_database_integrity():
         print_error(f"Database integrity test failed: {str(e)}")
 
 def run_performance_test():
-    """Basic performance test"""
+    """Short load run against the server: req/s and p50/p95/p99 latency per operation"""
     print_test_header("Performance Test")
     
-    test_endpoints = [
-        f"{BASE_URL}/products",
-        f"{BASE_URL}/stores",
-        f"{BASE_URL}/products?search=apple",
-        f"{BASE_URL}/stores?lat={TEST_LOCATION['lat']}&lng={TEST_LOCATION['lng']}"
-    ]
+    # The full harness (in-process runs, checkout mixes, JSON results and
+    # baseline comparison) is backend/benchmarks/bench_load.py; this run
+    # leaves stock alone
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'benchmarks'))
+    try:
+        import bench_load
+        args = bench_load.parse_args([
+            '--url', BASE_URL, '--mix', 'chat=1,search=2,stores=1,inventory=2',
+            '--concurrency', '1,4', '--duration', '3', '--warmup', '1'
+        ])
+        document = bench_load.run(args)
+    except Exception as e:
+        print_error(f"Performance test failed: {str(e)}")
+        return
     
-    for endpoint in test_endpoints:
-        try:
-            start_time = time.time()
-            response = requests.get(endpoint, timeout=10)
-            end_time = time.time()
-            
-            response_time = (end_time - start_time) * 1000  # Convert to milliseconds
-            
-            if response.status_code == 200:
-                if response_time < 1000:  # Less than 1 second
-                    print_success(f"{endpoint.split('/')[-1]}: {response_time:.0f}ms")
-                else:
-                    print_warning(f"{endpoint.split('/')[-1]}: {response_time:.0f}ms (slow)")
-            else:
-                print_error(f"{endpoint.split('/')[-1]}: Failed ({response.status_code})")
-                
-        except Exception as e:
-            print_error(f"Performance test failed for {endpoint}: {str(e)}")
+    for level, results in document['results'].items():
+        overall = results['all']
+        summary = f"{level} concurrent clients: {overall['rps']:.0f} req/s, p50 {overall['p50_ms']:.0f}ms, p95 {overall['p95_ms']:.0f}ms, p99 {overall['p99_ms']:.0f}ms"
+        if overall['errors']:
+            print_error(f"{summary} ({overall['errors']} errors)")
+        elif overall['p95_ms'] < 1000:  # Less than 1 second
+            print_success(summary)
+        else:
+            print_warning(f"{summary} (slow)")
+    print_info("For JSON results and baseline comparison run: python backend/benchmarks/bench_load.py --help")
 
 def main():
     """Run all tests"""
@@ -355,7 +759,12 @@ def main():
     test_products_api()
     test_stores_api()
     test_inventory_api()
+    test_pagination()
+    test_inventory_feed()
+    test_reservations_api()
     test_chatbot_api()
+    test_chat_follow_up()
+    test_chat_batch()
     test_database_integrity()
     run_performance_test()
     